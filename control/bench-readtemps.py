@@ -0,0 +1,55 @@
+#!/usr/bin/python
+"""
+Benchmark reading sensors concurrently against reading them one after
+another, with dummy sensors that take a conversion time to update
+"""
+# pylint: disable=line-too-long
+
+import argparse
+import time
+
+import w1therm
+
+
+class SlowSensor(w1therm.OWTemp):
+    """Dummy sensor taking as long to update as a real one converting"""
+    def __init__(self, sensorid, delay):
+        w1therm.OWTemp.__init__(self, sensorid, dummy=True)
+        self.__delay = delay
+
+    def update(self):
+        time.sleep(self.__delay)
+        return w1therm.OWTemp.update(self)
+
+
+def timeread(sensors, parallel, repeat):
+    """Return the fastest of repeat readings of every sensor (seconds)"""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        w1therm.readtemps(sensors, parallel=parallel)
+        taken = time.time() - start
+        if best is None or taken < best:
+            best = taken
+    return best
+
+
+def main():
+    """Time serial and parallel readings and print a table"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sensors', type=int, nargs='+', default=[1, 2, 4, 8, 12], help='numbers of sensors to read')
+    parser.add_argument('--resolution', type=int, choices=sorted(w1therm.CONVERSION_TIME), default=12)
+    parser.add_argument('--repeat', type=int, default=3, help='readings timed, the fastest is shown')
+    args = parser.parse_args()
+
+    delay = w1therm.CONVERSION_TIME[args.resolution]
+    print "Each sensor takes %.3f seconds to read (%d bits)" % (delay, args.resolution)
+    print "sensors    serial  parallel  speedup"
+    for count in args.sensors:
+        sensors = [SlowSensor('28-%012x' % n, delay) for n in range(count)]
+        serial = timeread(sensors, False, args.repeat)
+        parallel = timeread(sensors, True, args.repeat)
+        print "%7d %8.3fs %8.3fs %7.1fx" % (count, serial, parallel, serial / parallel)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+"""
+Single threaded event loop: timers on a monotonic clock and callbacks on
+file descriptors becoming readable
+"""
+
+import collections
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+
+# From <time.h>
+CLOCK_MONOTONIC = 1
+
+
+class _Timespec(ctypes.Structure):
+    """struct timespec"""
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _loadclock():
+    """Return clock_gettime from libc or librt, None if it is unavailable"""
+    for name in ('c', 'rt'):
+        try:
+            lib = ctypes.CDLL(ctypes.util.find_library(name), use_errno=True)
+            clock = lib.clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+        return clock
+    return None
+
+_clock_gettime = _loadclock()
+_lastclock = [0.0]
+
+
+def monotonic():
+    """
+    Return seconds since an arbitrary point, unaffected by changes to the
+    system clock
+    """
+    if _clock_gettime is not None:
+        ts = _Timespec()
+        if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(ts)) == 0:
+            return ts.tv_sec + ts.tv_nsec * 1e-9
+    # Without a monotonic clock at least never go backwards
+    _lastclock[0] = max(_lastclock[0], time.time())
+    return _lastclock[0]
+
+
+class Timer(object):
+    """A callback scheduled on the loop, which may be cancelled"""
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.__callback = callback
+        self.__args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Do not run the callback"""
+        self.cancelled = True
+
+    def run(self):
+        """Run the callback"""
+        self.__callback(*self.__args)
+
+
+class Periodic(object):
+    """
+    A callback run every interval seconds at fixed times, start + n *
+    interval, so the time taken by callbacks does not add up. Runs missed
+    because the loop was busy are skipped rather than run late in a burst.
+    """
+    def __init__(self, loop, interval, callback, args):
+        self.__loop = loop
+        self.__interval = interval
+        self.__callback = callback
+        self.__args = args
+        self.__timer = None
+        self.restart(loop.time())
+
+    def restart(self, when):
+        """Run at when and every interval after it"""
+        self.cancel()
+        self.__timer = self.__loop.call_at(when, self.__run, when)
+
+    def cancel(self):
+        """Stop running"""
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+
+    def __run(self, when):
+        """Run the callback and schedule the next run"""
+        now = self.__loop.time()
+        nextrun = when + self.__interval
+        if nextrun <= now:
+            nextrun += ((now - nextrun) // self.__interval + 1) * self.__interval
+        self.__timer = self.__loop.call_at(nextrun, self.__run, nextrun)
+        self.__callback(*self.__args)
+
+
+class EventLoop(object):
+    """
+    Run timers and file descriptor callbacks from one thread. Other threads
+    hand work to the loop with call_soon_threadsafe(). Exceptions raised by
+    callbacks stop the loop and are raised from run_forever().
+    """
+    def __init__(self):
+        self.__timers = []
+        self.__sequence = itertools.count()
+        self.__readers = dict()
+        self.__lock = threading.Lock()
+        self.__pending = collections.deque()
+        self.__running = False
+        self.__wakeread, self.__wakewrite = os.pipe()
+        for fd in (self.__wakeread, self.__wakewrite):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+
+    def time(self):
+        """Return the loop's clock"""
+        return monotonic()
+
+    def call_at(self, when, callback, *args):
+        """Run callback at time when on the loop's clock"""
+        timer = Timer(when, callback, args)
+        heapq.heappush(self.__timers, (when, next(self.__sequence), timer))
+        return timer
+
+    def call_later(self, delay, callback, *args):
+        """Run callback after delay seconds"""
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_soon(self, callback, *args):
+        """Run callback as soon as possible"""
+        return self.call_at(self.time(), callback, *args)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """Run callback on the loop soon, may be called from any thread"""
+        with self.__lock:
+            self.__pending.append((callback, args))
+        try:
+            os.write(self.__wakewrite, 'w')
+        except OSError as e:
+            # A full pipe already has a wake up pending
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def every(self, interval, callback, *args):
+        """Run callback now and then every interval seconds"""
+        return Periodic(self, interval, callback, args)
+
+    def add_reader(self, fd, callback, *args):
+        """Run callback whenever fd is readable"""
+        self.__readers[fd] = (callback, args)
+
+    def remove_reader(self, fd):
+        """Stop watching fd"""
+        self.__readers.pop(fd, None)
+
+    def stop(self):
+        """Make run_forever() return once the current callback finishes"""
+        self.__running = False
+
+    def __wakeup(self):
+        """Empty the wake up pipe and run work handed over by other threads"""
+        try:
+            while os.read(self.__wakeread, 4096):
+                pass
+        except OSError as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+        with self.__lock:
+            pending = list(self.__pending)
+            self.__pending.clear()
+        for callback, args in pending:
+            callback(*args)
+
+    def run_forever(self):
+        """Run callbacks until stop() is called"""
+        self.__running = True
+        while self.__running:
+            while self.__timers and self.__timers[0][2].cancelled:
+                heapq.heappop(self.__timers)
+            timeout = None
+            if self.__timers:
+                timeout = max(0, self.__timers[0][0] - self.time())
+            fds = [self.__wakeread] + self.__readers.keys()
+            try:
+                ready = select.select(fds, [], [], timeout)[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in ready:
+                if fd == self.__wakeread:
+                    self.__wakeup()
+                elif fd in self.__readers:
+                    callback, args = self.__readers[fd]
+                    callback(*args)
+            now = self.time()
+            while self.__running and self.__timers and self.__timers[0][0] <= now:
+                timer = heapq.heappop(self.__timers)[2]
+                if not timer.cancelled:
+                    timer.run()
+
+    def close(self):
+        """Release the loop's file descriptors"""
+        os.close(self.__wakeread)
+        os.close(self.__wakewrite)
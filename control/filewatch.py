@@ -0,0 +1,169 @@
+#!/usr/bin/python
+"""Watch files for changes using inotify, falling back to polling stat()"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+# inotify event masks (from <sys/inotify.h>)
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events that mean a watched file may have new content. IN_MODIFY is left
+# out on purpose so a half written file is never picked up.
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ATTRIB
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _loadlibc():
+    """Return libc with the inotify calls, None if they are not available"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1  # pylint: disable=pointless-statement
+        # Without argtypes a unicode path would be passed as a wide string
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def signature(path):
+    """Return a tuple that changes whenever path is replaced or rewritten"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino, st.st_mtime, st.st_size)
+
+
+class FileWatcher(object):
+    """
+    Watch a set of files and report which of them changed.
+
+    inotify on the containing directories is used to wake up, and the stat()
+    signature of each file decides whether it really changed, so writes
+    by rename and in place rewrites are both seen. When inotify is not
+    available the files are polled every interval seconds instead.
+    """
+    def __init__(self, paths, interval=1.0, useinotify=True):
+        self.__paths = [os.path.abspath(p) for p in paths]
+        self.__interval = interval
+        self.__signatures = dict()
+        for p in self.__paths:
+            self.__signatures[p] = signature(p)
+        self.__lastpoll = time.time()
+        self.__fd = None
+        if useinotify:
+            self.__setupinotify()
+
+    def __setupinotify(self):
+        """Start watching the directories of every file with inotify"""
+        libc = _loadlibc()
+        if libc is None:
+            return
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            print "inotify unavailable, polling for changes"
+            return
+        for d in set(os.path.dirname(p) for p in self.__paths):
+            if libc.inotify_add_watch(fd, d, WATCH_MASK) < 0:
+                print "Unable to watch %s, polling for changes" % d
+                os.close(fd)
+                return
+        self.__fd = fd
+
+    def fileno(self):
+        """Return the inotify file descriptor, None when polling"""
+        return self.__fd
+
+    def close(self):
+        """Stop watching"""
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+
+    def __drain(self):
+        """Read pending inotify events, return True if any may concern us"""
+        names = set(os.path.basename(p) for p in self.__paths)
+        relevant = False
+        while True:
+            try:
+                data = os.read(self.__fd, 4096)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)  # pylint: disable=unused-variable
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW or name in names:
+                    relevant = True
+        return relevant
+
+    def __compare(self):
+        """Return the files whose signature changed, and remember the new one"""
+        changed = []
+        for p in self.__paths:
+            sig = signature(p)
+            if sig != self.__signatures[p]:
+                self.__signatures[p] = sig
+                changed.append(p)
+        return changed
+
+    def check(self):
+        """Return a list of files that changed since the last call, no waiting"""
+        if self.__fd is not None:
+            if not self.__drain():
+                return []
+        else:
+            now = time.time()
+            if (now - self.__lastpoll) < self.__interval:
+                return []
+            self.__lastpoll = now
+        return self.__compare()
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for a file to change
+        Return the list of files that changed, empty on timeout
+        """
+        end = time.time() + timeout
+        while True:
+            remaining = end - time.time()
+            if self.__fd is not None:
+                if remaining > 0:
+                    select.select([self.__fd], [], [], remaining)
+                if self.__drain():
+                    changed = self.__compare()
+                    if changed:
+                        return changed
+            else:
+                if remaining > 0:
+                    time.sleep(min(self.__interval, remaining))
+                self.__lastpoll = time.time()
+                changed = self.__compare()
+                if changed:
+                    return changed
+            if time.time() >= end:
+                return []
+
+    def refresh(self, path):
+        """Accept the current contents of path, eg after writing it ourselves"""
+        path = os.path.abspath(path)
+        self.__signatures[path] = signature(path)
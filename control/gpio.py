@@ -0,0 +1,368 @@
+#!/usr/bin/python
+"""
+GPIO access through interchangeable backends: wiringPi, the Linux GPIO
+character device, and an in memory fake for running without hardware
+"""
+
+import errno
+import fcntl
+import mmap
+import os
+import select
+import struct
+import threading
+
+# Backend used when none is named
+DEFAULT_BACKEND = 'wiringpi'
+
+# GPIO character device used by the chardev backend
+GPIO_CHIP = '/dev/gpiochip0'
+
+# Raspberry Pi GPIO registers as mapped by /dev/gpiomem, used by the
+# wiringpi backend to set or clear several pins with one write
+GPIOMEM_FILE = '/dev/gpiomem'
+GPSET = (0x1c, 0x20)
+GPCLR = (0x28, 0x2c)
+
+# From <linux/gpio.h>, version 1 of the character device interface
+GPIOHANDLES_MAX = 64
+GPIOHANDLE_REQUEST_INPUT = 1 << 0
+GPIOHANDLE_REQUEST_OUTPUT = 1 << 1
+GPIOHANDLE_REQUEST_BIAS_PULL_UP = 1 << 5
+GPIO_GET_LINEHANDLE_IOCTL = 0xc16cb403
+GPIOHANDLE_GET_LINE_VALUES_IOCTL = 0xc040b408
+GPIOHANDLE_SET_LINE_VALUES_IOCTL = 0xc040b409
+GPIO_GET_LINEEVENT_IOCTL = 0xc030b404
+GPIOEVENT_REQUEST_BOTH_EDGES = 3
+HANDLE_REQUEST = struct.Struct('64I I 64B 32s I i')
+HANDLE_DATA = struct.Struct('64B')
+EVENT_REQUEST = struct.Struct('I I I 32s i')
+EVENT_DATA_SIZE = 16
+
+# From wiringPi.h
+INT_EDGE_BOTH = 3
+
+
+class GPIOError(Exception):
+    """The backend is unavailable or a pin could not be set up"""
+    pass
+
+
+class Backend(object):
+    """
+    A way of driving GPIO pins. write() takes the values of several pins
+    at once and only passes on those that changed, for the backend to set
+    together where it can.
+    """
+    name = None
+
+    def __init__(self):
+        self.__values = dict()
+
+    def setoutputs(self, pins):
+        """Make pins outputs, all low, to be written together"""
+        self.claimoutputs(pins)
+        for pin in pins:
+            self.__values[pin] = 0
+
+    def setinputs(self, pins, pullup=False):
+        """Make pins inputs, pulled up if pullup is set"""
+        raise NotImplementedError
+
+    def read(self, pin):
+        """Return the value of an input pin"""
+        raise NotImplementedError
+
+    def watch(self, pin, callback, pullup=False):
+        """
+        Make pin an input and call callback(pin) whenever it may have
+        changed, from another thread. The pin bounces, so callback should
+        read() it once it has settled.
+        """
+        raise NotImplementedError
+
+    def write(self, values):
+        """
+        Set output pins from a list of (pin, value) pairs, given in the order
+        they are turned on. Where the pins cannot be set at once they are
+        turned off first, in the reverse order, and then turned on.
+        Returns True if any pin changed.
+        """
+        changes = [(pin, 1 if value else 0) for pin, value in values
+                   if self.__values.get(pin) != (1 if value else 0)]
+        if not changes:
+            return False
+        self.apply(changes)
+        for pin, value in changes:
+            self.__values[pin] = value
+        return True
+
+    def value(self, pin):
+        """Return the value last written to an output pin"""
+        return self.__values.get(pin, 0)
+
+    def claimoutputs(self, pins):
+        """Set up pins as outputs, all low"""
+        raise NotImplementedError
+
+    def apply(self, changes):
+        """Set the pins in changes, a list as for write() of changed pins"""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the pins"""
+        pass
+
+
+def ordered(changes):
+    """Return changes with pins turned off first, in reverse, then those turned on"""
+    off = [c for c in reversed(changes) if not c[1]]
+    on = [c for c in changes if c[1]]
+    return off + on
+
+
+class WiringPiBackend(Backend):
+    """
+    Pins numbered as wiringPi numbers them. Writes set and clear several
+    pins at once through the GPIO registers when /dev/gpiomem can be mapped,
+    and otherwise pin by pin in a safe order.
+    """
+    name = 'wiringpi'
+
+    def __init__(self):
+        Backend.__init__(self)
+        try:
+            import wiringpi
+        except ImportError:
+            raise GPIOError("wiringpi is not installed")
+        self.__wiringpi = wiringpi
+        wiringpi.wiringPiSetup()
+        self.__regs = None
+        try:
+            fd = os.open(GPIOMEM_FILE, os.O_RDWR | os.O_SYNC)
+        except OSError:
+            return
+        try:
+            self.__regs = mmap.mmap(fd, 4096)
+        except EnvironmentError:
+            pass
+        finally:
+            os.close(fd)
+
+    def claimoutputs(self, pins):
+        for pin in pins:
+            self.__wiringpi.pinMode(pin, 1)
+            self.__wiringpi.digitalWrite(pin, 0)
+
+    def setinputs(self, pins, pullup=False):
+        for pin in pins:
+            self.__wiringpi.pinMode(pin, 0)
+            self.__wiringpi.pullUpDnControl(pin, 2 if pullup else 0)
+
+    def read(self, pin):
+        return self.__wiringpi.digitalRead(pin)
+
+    def watch(self, pin, callback, pullup=False):
+        self.setinputs([pin], pullup)
+        self.__wiringpi.wiringPiISR(pin, INT_EDGE_BOTH, lambda: callback(pin))
+
+    def apply(self, changes):
+        if self.__regs is None:
+            for pin, value in ordered(changes):
+                self.__wiringpi.digitalWrite(pin, value)
+            return
+        masks = {GPSET: [0, 0], GPCLR: [0, 0]}
+        for pin, value in changes:
+            bcm = self.__wiringpi.wpiPinToGpio(pin)
+            masks[GPSET if value else GPCLR][bcm // 32] |= 1 << (bcm % 32)
+        for regs in (GPCLR, GPSET):
+            for bank, mask in enumerate(masks[regs]):
+                if mask:
+                    struct.pack_into('<I', self.__regs, regs[bank], mask)
+
+    def close(self):
+        if self.__regs is not None:
+            self.__regs.close()
+            self.__regs = None
+
+
+class CharDevBackend(Backend):
+    """
+    Pins numbered as the lines of a GPIO character device, BCM numbers on
+    a Raspberry Pi. The outputs set up by each setoutputs() are held as one
+    line handle, so writes to them take effect together.
+    """
+    name = 'chardev'
+
+    def __init__(self, chip=GPIO_CHIP):
+        Backend.__init__(self)
+        try:
+            self.__chip = os.open(chip, os.O_RDWR)
+        except OSError as e:
+            raise GPIOError("Unable to open %s: %s" % (chip, e.strerror))
+        # Pin to (handle fd, index in the handle, pins of the handle)
+        self.__lines = dict()
+        self.__handles = []
+        # Event fd to (pin, callback) of watched pins, and the thread
+        # waiting for their events
+        self.__events = dict()
+        self.__thread = None
+        self.__wakeread, self.__wakewrite = os.pipe()
+
+    def __request(self, pins, flags):
+        """Request a line handle for pins, all low, and record them"""
+        if len(pins) > GPIOHANDLES_MAX:
+            raise GPIOError("Too many pins in one request")
+        offsets = list(pins) + [0] * (GPIOHANDLES_MAX - len(pins))
+        data = HANDLE_REQUEST.pack(*(offsets + [flags] + [0] * GPIOHANDLES_MAX + ['heater', len(pins), -1]))
+        buf = bytearray(data)
+        try:
+            fcntl.ioctl(self.__chip, GPIO_GET_LINEHANDLE_IOCTL, buf, True)
+        except IOError as e:
+            raise GPIOError("Unable to request pins %s: %s" % (list(pins), e.strerror))
+        fd = HANDLE_REQUEST.unpack_from(buf)[-1]
+        self.__handles.append(fd)
+        pins = list(pins)
+        for index, pin in enumerate(pins):
+            self.__lines[pin] = (fd, index, pins)
+
+    def claimoutputs(self, pins):
+        self.__request(pins, GPIOHANDLE_REQUEST_OUTPUT)
+
+    def setinputs(self, pins, pullup=False):
+        flags = GPIOHANDLE_REQUEST_INPUT
+        if pullup:
+            flags |= GPIOHANDLE_REQUEST_BIAS_PULL_UP
+        for pin in pins:
+            self.__request([pin], flags)
+
+    def read(self, pin):
+        fd, index, pins = self.__lines[pin]  # pylint: disable=unused-variable
+        buf = bytearray(HANDLE_DATA.size)
+        fcntl.ioctl(fd, GPIOHANDLE_GET_LINE_VALUES_IOCTL, buf, True)
+        return buf[index]
+
+    def watch(self, pin, callback, pullup=False):
+        flags = GPIOHANDLE_REQUEST_INPUT
+        if pullup:
+            flags |= GPIOHANDLE_REQUEST_BIAS_PULL_UP
+        buf = bytearray(EVENT_REQUEST.pack(pin, flags, GPIOEVENT_REQUEST_BOTH_EDGES, 'heater', -1))
+        try:
+            fcntl.ioctl(self.__chip, GPIO_GET_LINEEVENT_IOCTL, buf, True)
+        except IOError as e:
+            raise GPIOError("Unable to watch pin %d: %s" % (pin, e.strerror))
+        fd = EVENT_REQUEST.unpack_from(buf)[-1]
+        self.__handles.append(fd)
+        # The values of an event line are read as for a line handle
+        self.__lines[pin] = (fd, 0, [pin])
+        self.__events[fd] = (pin, callback)
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self.__run)
+            self.__thread.daemon = True
+            self.__thread.start()
+        else:
+            os.write(self.__wakewrite, 'w')
+
+    def __run(self):
+        """Event thread, waits for edges and calls the callbacks"""
+        while True:
+            fds = [self.__wakeread] + list(self.__events)
+            try:
+                ready = select.select(fds, [], [])[0]
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for fd in ready:
+                if fd == self.__wakeread:
+                    if not os.read(self.__wakeread, 4096):
+                        return
+                    continue
+                # Only that there were edges matters, not how many
+                os.read(fd, EVENT_DATA_SIZE * 16)
+                pin, callback = self.__events[fd]
+                callback(pin)
+
+    def apply(self, changes):
+        changed = dict(changes)
+        handles = dict()
+        for pin in changed:
+            fd, index, pins = self.__lines[pin]  # pylint: disable=unused-variable
+            handles[fd] = pins
+        for fd, pins in handles.items():
+            values = [changed.get(p, self.value(p)) for p in pins]
+            buf = bytearray(HANDLE_DATA.pack(*(values + [0] * (GPIOHANDLES_MAX - len(values)))))
+            fcntl.ioctl(fd, GPIOHANDLE_SET_LINE_VALUES_IOCTL, buf, True)
+
+    def close(self):
+        # End of file on the pipe stops the event thread
+        os.close(self.__wakewrite)
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        os.close(self.__wakeread)
+        self.__events = dict()
+        for fd in self.__handles:
+            os.close(fd)
+        self.__handles = []
+        self.__lines = dict()
+        if self.__chip is not None:
+            os.close(self.__chip)
+            self.__chip = None
+
+
+class FakeBackend(Backend):
+    """
+    Pins held in memory, for running the controller and user interfaces
+    without hardware. Every write is recorded in writes, and inputs can be
+    set with setinput().
+    """
+    name = 'fake'
+
+    def __init__(self):
+        Backend.__init__(self)
+        self.pins = dict()
+        self.writes = []
+        self.__watches = dict()
+
+    def claimoutputs(self, pins):
+        for pin in pins:
+            self.pins[pin] = 0
+
+    def setinputs(self, pins, pullup=False):
+        for pin in pins:
+            self.pins[pin] = 1 if pullup else 0
+
+    def setinput(self, pin, value):
+        """Set the value read from an input pin, as if it changed"""
+        changed = self.pins.get(pin) != value
+        self.pins[pin] = value
+        if changed and pin in self.__watches:
+            self.__watches[pin](pin)
+
+    def read(self, pin):
+        return self.pins[pin]
+
+    def watch(self, pin, callback, pullup=False):
+        self.setinputs([pin], pullup)
+        self.__watches[pin] = callback
+
+    def apply(self, changes):
+        self.pins.update(changes)
+        self.writes.append(list(changes))
+
+
+# Backends by the name used in configuration
+BACKENDS = dict((b.name, b) for b in (WiringPiBackend, CharDevBackend, FakeBackend))
+
+
+def getbackend(name=DEFAULT_BACKEND, chip=GPIO_CHIP):
+    """
+    Return a new backend called name
+    Raises GPIOError if there is no such backend or it is unavailable
+    """
+    if name not in BACKENDS:
+        raise GPIOError("Unknown GPIO backend: %s" % name)
+    if name == 'chardev':
+        return CharDevBackend(chip)
+    return BACKENDS[name]()
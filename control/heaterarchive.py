@@ -0,0 +1,334 @@
+#!/usr/bin/python
+"""
+Memory mapped multi-resolution history archive
+
+Samples are averaged into one minute primary data points, which are then
+consolidated into the coarser levels as they complete, in the same way as
+the RRAs of the round robin database it replaces. Every level is a fixed
+size ring of rows so the archive never grows.
+"""
+
+import math
+import mmap
+import os
+import struct
+import time
+
+import mappedfile
+
+# Path to archive
+ARCHIVE_FILE = '/dev/shm/heater.archive'
+
+# Identifies the archive and its layout
+MAGIC = 'HTA1'
+
+# Step of the primary data points (seconds)
+BASE_STEP = 60
+
+# Consolidation levels: name, step (seconds) and number of rows kept
+LEVELS = [('1m', 60, 1440),
+          ('15m', 900, 672),
+          ('1h', 3600, 744),
+          ('1d', 86400, 365)]
+
+# Fraction of a consolidated row that may be unknown and the row still known
+XFF = 0.5
+
+# Maximum number of individual sensors recorded
+MAX_SENSORS = 16
+
+# Fixed columns, followed by one column per sensor
+COLUMNS = ['temp', 'setpoint', 'heat']
+NCOLS = len(COLUMNS) + MAX_SENSORS
+
+HEADER = struct.Struct('<4sIIII')
+SENSORID = struct.Struct('<16s')
+# Current bucket, followed by count and sum for every column
+ACCUMULATOR = struct.Struct('<q' + 'I' * NCOLS + 'd' * NCOLS)
+# Bucket, followed by the value of every column
+ROW = struct.Struct('<q' + 'd' * NCOLS)
+
+SENSORS_OFFSET = HEADER.size
+ACCUMULATORS_OFFSET = SENSORS_OFFSET + SENSORID.size * MAX_SENSORS
+ROWS_OFFSET = ACCUMULATORS_OFFSET + ACCUMULATOR.size * len(LEVELS)
+
+NAN = float('nan')
+
+# Give up on a consistent read after this many attempts
+READ_ATTEMPTS = 100
+
+
+def _levelsize():
+    """Return the offset of each level's rows and the total archive size"""
+    offsets = []
+    offset = ROWS_OFFSET
+    for name, step, rows in LEVELS:  # pylint: disable=unused-variable
+        offsets.append(offset)
+        offset += ROW.size * rows
+    return offsets, offset
+
+
+LEVEL_OFFSETS, ARCHIVE_SIZE = _levelsize()
+
+
+def getlevel(name):
+    """Return the index of the level called name"""
+    for i in range(0, len(LEVELS)):
+        if LEVELS[i][0] == name:
+            return i
+    raise KeyError(name)
+
+
+class Archive(object):
+    """Access to the history archive"""
+    def __init__(self, path=ARCHIVE_FILE, create=False):
+        self.__path = path
+        self.__writable = create
+        if create:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+            prot = mmap.PROT_READ | mmap.PROT_WRITE
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            prot = mmap.PROT_READ
+        try:
+            size = os.fstat(fd).st_size
+            if create and size != ARCHIVE_SIZE:
+                os.ftruncate(fd, ARCHIVE_SIZE)
+            elif size < ARCHIVE_SIZE:
+                raise ValueError("Archive %s is too small" % path)
+            self.__buf = mmap.mmap(fd, ARCHIVE_SIZE, mmap.MAP_SHARED, prot)
+        finally:
+            os.close(fd)
+        header = HEADER.unpack_from(self.__buf, 0)
+        if header[0] != MAGIC or header[2:] != (NCOLS, len(LEVELS), MAX_SENSORS):
+            if not create:
+                self.__buf.close()
+                raise ValueError("Archive %s has an unknown layout" % path)
+            print "Initialising archive %s" % path
+            self.__initialise()
+
+    def __initialise(self):
+        """Write an empty archive"""
+        self.__buf[0:ARCHIVE_SIZE] = '\0' * ARCHIVE_SIZE
+        empty = [-1] + [0] * NCOLS + [0.0] * NCOLS
+        for i in range(0, len(LEVELS)):
+            ACCUMULATOR.pack_into(self.__buf, ACCUMULATORS_OFFSET + ACCUMULATOR.size * i, *empty)
+            for r in range(0, LEVELS[i][2]):
+                ROW.pack_into(self.__buf, LEVEL_OFFSETS[i] + ROW.size * r, -1, *([NAN] * NCOLS))
+        HEADER.pack_into(self.__buf, 0, MAGIC, 0, NCOLS, len(LEVELS), MAX_SENSORS)
+
+    def getpath(self):
+        """Returns filesystem path of the archive"""
+        return self.__path
+
+    def close(self):
+        """Unmap the archive"""
+        self.__buf.close()
+
+    def __seq(self):
+        """Return the write sequence counter"""
+        return HEADER.unpack_from(self.__buf, 0)[1]
+
+    def __setseq(self, seq):
+        """Set the write sequence counter"""
+        struct.pack_into('<I', self.__buf, 4, seq & 0xffffffff)
+
+    def sensors(self):
+        """Return the sensor id recorded in each sensor column"""
+        ids = []
+        for i in range(0, MAX_SENSORS):
+            sid = SENSORID.unpack_from(self.__buf, SENSORS_OFFSET + SENSORID.size * i)[0]
+            ids.append(sid.rstrip('\0') or None)
+        return ids
+
+    def columns(self):
+        """Return the name of every column"""
+        names = list(COLUMNS)
+        for i, sid in enumerate(self.sensors()):
+            names.append(sid or 'sensor%d' % i)
+        return names
+
+    def __sensorcolumn(self, sensorid, ids):
+        """Return the column for sensorid, allocating one if needed"""
+        if sensorid in ids:
+            return len(COLUMNS) + ids.index(sensorid)
+        if None not in ids:
+            return None
+        slot = ids.index(None)
+        ids[slot] = sensorid
+        SENSORID.pack_into(self.__buf, SENSORS_OFFSET + SENSORID.size * slot, str(sensorid)[:SENSORID.size])
+        return len(COLUMNS) + slot
+
+    def __accumulate(self, level, bucket, values):
+        """
+        Add values to the accumulator of level, first writing out the row
+        for the previous bucket if bucket has moved on
+        Return the finished (bucket, values) row, None if still accumulating
+        """
+        offset = ACCUMULATORS_OFFSET + ACCUMULATOR.size * level
+        acc = list(ACCUMULATOR.unpack_from(self.__buf, offset))
+        finished = None
+        if acc[0] != bucket:
+            if acc[0] >= 0:
+                step = LEVELS[level][1]
+                needed = max(1, int(math.ceil((1 - XFF) * step / BASE_STEP))) if level > 0 else 1
+                row = []
+                for c in range(0, NCOLS):
+                    count = acc[1 + c]
+                    if count >= needed:
+                        row.append(acc[1 + NCOLS + c] / count)
+                    else:
+                        row.append(NAN)
+                rows = LEVELS[level][2]
+                ROW.pack_into(self.__buf, LEVEL_OFFSETS[level] + ROW.size * (acc[0] % rows), acc[0], *row)
+                finished = (acc[0], row)
+            acc = [bucket] + [0] * NCOLS + [0.0] * NCOLS
+        for c in range(0, NCOLS):
+            v = values[c]
+            if v is not None and not math.isnan(v):
+                acc[1 + c] += 1
+                acc[1 + NCOLS + c] += v
+        ACCUMULATOR.pack_into(self.__buf, offset, *acc)
+        return finished
+
+    def append(self, timestamp, temp, setpoint, heat, sensortemps=None):
+        """
+        Record a sample; None (or NaN) marks a value as unknown
+        sensortemps is a dict of sensor id to temperature
+        """
+        if not self.__writable:
+            raise IOError("Archive %s is read only" % self.__path)
+        ids = self.sensors()
+        values = [temp, setpoint, heat] + [None] * MAX_SENSORS
+        if sensortemps is not None:
+            for sid, t in sensortemps.items():
+                c = self.__sensorcolumn(sid, ids)
+                if c is not None:
+                    values[c] = t
+        seq = self.__seq()
+        self.__setseq(seq + 1)
+        try:
+            pdp = self.__accumulate(0, int(timestamp // BASE_STEP), values)
+            if pdp is not None:
+                start = pdp[0] * BASE_STEP
+                for level in range(1, len(LEVELS)):
+                    self.__accumulate(level, int(start // LEVELS[level][1]), pdp[1])
+        finally:
+            self.__setseq(seq + 2)
+
+    def fetch(self, level, start, end):
+        """
+        Return the rows of level whose time falls within start to end as a
+        list of (timestamp, values) sorted by time, unknown values are NaN
+        """
+        name, step, rows = LEVELS[level]  # pylint: disable=unused-variable
+        first = int(max(start, 0) // step)
+        last = int(end // step)
+        if last - first >= rows:
+            first = last - rows + 1
+        for attempt in range(0, READ_ATTEMPTS):  # pylint: disable=unused-variable
+            before = self.__seq()
+            if before & 1:
+                time.sleep(0.001)
+                continue
+            result = []
+            for bucket in range(first, last + 1):
+                row = ROW.unpack_from(self.__buf, LEVEL_OFFSETS[level] + ROW.size * (bucket % rows))
+                if row[0] == bucket:
+                    result.append((bucket * step, row[1:]))
+            if self.__seq() == before:
+                return result
+        return []
+
+    def nextupdate(self, level):
+        """Return the time after which level will complete its next row"""
+        acc = ACCUMULATOR.unpack_from(self.__buf, ACCUMULATORS_OFFSET + ACCUMULATOR.size * level)
+        if acc[0] < 0:
+            return None
+        return (acc[0] + 1) * LEVELS[level][1]
+
+
+def chooselevel(start, end, maxpoints, now=None):
+    """
+    Return the coarsest level which still holds start and has at least
+    maxpoints rows between start and end, or the finest level holding
+    start if none has that many
+    """
+    if now is None:
+        now = time.time()
+    # Allow a row of slack for the row still being accumulated
+    candidates = [i for i in range(0, len(LEVELS))
+                  if start >= now - LEVELS[i][1] * (LEVELS[i][2] + 1)]
+    if not candidates:
+        return len(LEVELS) - 1
+    for i in reversed(candidates):
+        if (end - start) / LEVELS[i][1] >= maxpoints:
+            return i
+    return candidates[0]
+
+
+def downsample(rows, threshold, column=0):
+    """
+    Reduce rows, as returned by fetch(), to threshold rows using Largest
+    Triangle Three Buckets on column, which keeps the visual shape of the
+    series. Rows where column is unknown are only kept to mark gaps.
+    """
+    count = len(rows)
+    if threshold >= count or threshold < 3:
+        return list(rows)
+    sampled = [rows[0]]
+    every = float(count - 2) / (threshold - 2)
+    a = 0
+    for i in range(0, threshold - 2):
+        # Average of the next bucket is the third point of the triangle
+        nextstart = int((i + 1) * every) + 1
+        nextend = min(int((i + 2) * every) + 1, count)
+        avgx = 0.0
+        avgy = 0.0
+        known = 0
+        for row in rows[nextstart:nextend]:
+            v = row[1][column]
+            if not math.isnan(v):
+                avgx += row[0]
+                avgy += v
+                known += 1
+        if known:
+            avgx /= known
+            avgy /= known
+        else:
+            avgx = rows[nextstart][0]
+            avgy = rows[a][1][column]
+
+        ax = rows[a][0]
+        ay = rows[a][1][column]
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        chosen = start
+        maxarea = -1.0
+        for j in range(start, end):
+            v = rows[j][1][column]
+            if math.isnan(v) or math.isnan(ay):
+                continue
+            area = abs((ax - avgx) * (v - ay) - (ax - rows[j][0]) * (avgy - ay))
+            if area > maxarea:
+                maxarea = area
+                chosen = j
+        sampled.append(rows[chosen])
+        a = chosen
+    sampled.append(rows[-1])
+    return sampled
+
+
+def openarchive(path=ARCHIVE_FILE):
+    """Open an existing archive for reading, None if there is none usable"""
+    return mappedfile.openmapped(Archive, path)
+
+
+class ArchiveReader(mappedfile.MappedFileReader):
+    """Keep the archive open for reading, reopening it if it is recreated"""
+    def __init__(self, path=ARCHIVE_FILE):
+        mappedfile.MappedFileReader.__init__(self, path, Archive)
+
+    def archive(self):
+        """Return the open archive, None if there is none usable"""
+        return self.get()
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+"""
+Settings broker: the controller owns the settings and other processes get,
+change and follow them over a Unix domain socket.
+
+Requests and replies are single lines of json:
+    {"cmd": "get"}
+    {"cmd": "set", "settings": {...}, "version": "<etag>"}
+    {"cmd": "subscribe"}
+Replies are {"ok": true, "settings": {...}, "version": "<etag>"} or
+{"ok": false, "error": "conflict"|"invalid"|"error", "message": "..."}.
+After a subscribe reply the connection receives a reply line every time
+the settings change, until the client closes it.
+"""
+
+import json
+import os
+import Queue
+import socket
+import threading
+
+# Path to the broker socket
+SOCKET_FILE = '/dev/shm/heater-control.sock'
+
+# Seconds a client waits for the broker to answer
+TIMEOUT = 5
+
+# Longest request line accepted
+MAX_REQUEST = 65536
+
+
+class BrokerError(Exception):
+    """The broker refused a request, code says why"""
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+def _reply(settings, version):
+    """Format a successful reply"""
+    return json.dumps({'ok': True, 'settings': settings, 'version': version}) + '\n'
+
+
+def _error(code, message):
+    """Format an error reply"""
+    return json.dumps({'ok': False, 'error': code, 'message': message}) + '\n'
+
+
+class Broker(object):
+    """
+    Serve the settings over a Unix socket.
+
+    get and subscribe are answered from the last published settings by the
+    connection threads. set requests are queued for the owner of the
+    settings, which calls process() from its own loop so all changes are
+    made by one thread; wake is called when a request is queued so that
+    loop need not wait for its next timeout.
+    """
+    def __init__(self, path=SOCKET_FILE, wake=None, perms=None, gid=None):
+        self.__path = path
+        self.__wake = wake
+        self.__lock = threading.Lock()
+        self.__settings = None
+        self.__version = None
+        self.__subscribers = set()
+        self.__commands = Queue.Queue()
+        self.__closed = False
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+        self.__sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.__sock.bind(path)
+        if perms is not None:
+            os.chmod(path, perms)
+        if gid is not None:
+            os.chown(path, -1, gid)
+        self.__sock.listen(16)
+        thread = threading.Thread(target=self.__accept)
+        thread.daemon = True
+        thread.start()
+
+    def close(self):
+        """
+        Stop accepting connections, remove the socket and refuse the set
+        requests still queued, which would otherwise wait for ever
+        """
+        with self.__lock:
+            self.__closed = True
+        self.__sock.close()
+        try:
+            os.unlink(self.__path)
+        except OSError:
+            pass
+        while True:
+            try:
+                reply = self.__commands.get_nowait()[2]
+            except Queue.Empty:
+                return
+            reply.put(_error('error', 'Settings broker closed'))
+
+    def publish(self, settings, version):
+        """Record the current settings and send them to every subscriber"""
+        msg = _reply(settings, version)
+        with self.__lock:
+            self.__settings = dict(settings)
+            self.__version = version
+            for conn in list(self.__subscribers):
+                # Never block the owner on a subscriber that is not reading
+                try:
+                    sent = conn.send(msg, socket.MSG_DONTWAIT)
+                except socket.error:
+                    sent = 0
+                if sent != len(msg):
+                    self.__subscribers.discard(conn)
+                    conn.shutdown(socket.SHUT_RDWR)
+
+    def process(self, apply):
+        """
+        Carry out queued set requests.
+        apply(changes, version) is called for each and returns the new
+        settings and their version, or raises BrokerError.
+        Returns True if any request was applied.
+        """
+        applied = False
+        while True:
+            try:
+                changes, version, reply = self.__commands.get_nowait()
+            except Queue.Empty:
+                return applied
+            try:
+                settings, version = apply(changes, version)
+            except BrokerError as e:
+                reply.put(_error(e.code, str(e)))
+            else:
+                applied = True
+                reply.put(_reply(settings, version))
+
+    def __accept(self):
+        """Accept connections, each is served by its own thread"""
+        while True:
+            try:
+                conn = self.__sock.accept()[0]
+            except socket.error:
+                return
+            thread = threading.Thread(target=self.__serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
+
+    def __serve(self, conn):
+        """Answer requests from one connection"""
+        reader = conn.makefile('rb')
+        try:
+            while True:
+                line = reader.readline(MAX_REQUEST)
+                if not line:
+                    return
+                try:
+                    request = json.loads(line)
+                    cmd = request['cmd']
+                except (ValueError, KeyError, TypeError):
+                    conn.sendall(_error('invalid', 'Malformed request'))
+                    continue
+                if cmd == 'get':
+                    with self.__lock:
+                        conn.sendall(_reply(self.__settings, self.__version))
+                elif cmd == 'subscribe':
+                    with self.__lock:
+                        conn.sendall(_reply(self.__settings, self.__version))
+                        self.__subscribers.add(conn)
+                    # Only publish() writes to a subscribed connection from
+                    # now on, further requests are ignored until it closes
+                    while reader.readline(MAX_REQUEST):
+                        pass
+                    return
+                elif cmd == 'set':
+                    changes = request.get('settings')
+                    if not isinstance(changes, dict):
+                        conn.sendall(_error('invalid', 'settings must be an object'))
+                        continue
+                    # Block without a timeout, a timed wait polls in Python 2;
+                    # close() answers any request left queued
+                    reply = Queue.Queue(1)
+                    with self.__lock:
+                        if self.__closed:
+                            reply.put(_error('error', 'Settings broker closed'))
+                        else:
+                            self.__commands.put((changes, request.get('version'), reply))
+                    if self.__wake is not None:
+                        self.__wake()
+                    conn.sendall(reply.get())
+                else:
+                    conn.sendall(_error('invalid', 'Unknown command: %s' % cmd))
+        except socket.error:
+            pass
+        finally:
+            with self.__lock:
+                self.__subscribers.discard(conn)
+            reader.close()
+            conn.close()
+
+
+def _connect(path, timeout):
+    """Return a socket connected to the broker"""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        raise
+    return sock
+
+
+def _readreply(reader):
+    """Read one reply, return the settings and version or raise BrokerError"""
+    line = reader.readline()
+    if not line:
+        raise socket.error("Settings broker closed the connection")
+    reply = json.loads(line)
+    if not reply['ok']:
+        raise BrokerError(reply['error'], reply['message'])
+    return reply['settings'], reply['version']
+
+
+def request(req, path=SOCKET_FILE, timeout=TIMEOUT):
+    """
+    Send a request to the broker and return the settings and version
+    Raises socket.error if the broker cannot be reached, BrokerError if it
+    refuses the request
+    """
+    sock = _connect(path, timeout)
+    try:
+        sock.sendall(json.dumps(req) + '\n')
+        reader = sock.makefile('rb')
+        try:
+            return _readreply(reader)
+        finally:
+            reader.close()
+    finally:
+        sock.close()
+
+
+def getsettings(path=SOCKET_FILE, timeout=TIMEOUT):
+    """Return the controller's settings and their version"""
+    return request({'cmd': 'get'}, path, timeout)
+
+
+def setsettings(changes, version=None, path=SOCKET_FILE, timeout=TIMEOUT):
+    """
+    Change some settings and return the new settings and version.
+    If version is given the change is refused with a 'conflict' BrokerError
+    unless it matches the current settings.
+    """
+    req = {'cmd': 'set', 'settings': changes}
+    if version is not None:
+        req['version'] = version
+    return request(req, path, timeout)
+
+
+def subscribe(path=SOCKET_FILE):
+    """Generator of the settings and version, each time they change"""
+    sock = _connect(path, TIMEOUT)
+    try:
+        sock.sendall(json.dumps({'cmd': 'subscribe'}) + '\n')
+        sock.settimeout(None)
+        reader = sock.makefile('rb')
+        try:
+            while True:
+                yield _readreply(reader)
+        finally:
+            reader.close()
+    finally:
+        sock.close()
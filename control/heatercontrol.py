@@ -3,12 +3,20 @@
 # pylint: disable=line-too-long
 
 import grp
-import json
 import os
 import sys
 import time
-import wiringpi
 
+import eventloop
+import filewatch
+import gpio
+import heaterarchive
+import heaterbroker
+import heaterlogic
+import heatermetrics
+import heatershm
+import heaterstate
+import tempsampler
 import w1therm
 
 ###
@@ -37,6 +45,10 @@ settings['run'] = 'off'
 # Valid settings: auto, high, low
 settings['elements'] = 'auto'
 
+# How the heater state is decided, see heaterlogic
+# Valid settings: hysteresis, pid, mpc
+settings['controller'] = 'hysteresis'
+
 ###
 # End default settings
 ###
@@ -45,14 +57,54 @@ settings['elements'] = 'auto'
 # System configuration
 ###
 
+# How the GPIO pins are driven: wiringpi, chardev or fake, see gpio.py.
+# Pins are numbered as the backend numbers them, wiringPi's numbers for
+# wiringpi and the chip's line (BCM) numbers for chardev
+GPIO_BACKEND = gpio.DEFAULT_BACKEND
+
+# GPIO character device used by the chardev backend
+GPIO_CHIP = gpio.GPIO_CHIP
+
 # Heater GPIO pin for HIGH element
 GPIO_HIGH = 5
 
 # Heater GPIO pin for LOW element and FAN
 GPIO_LOW = 4
 
-# ID of sensors
-SENSOR_IDS = ['28-000006db9c2a']
+# IDs or aliases of sensors, or 'auto' for every temperature sensor found
+# on the 1-wire bus that no other zone lists, following sensors as they are
+# plugged in and removed
+SENSOR_IDS = 'auto'
+
+# Zones, each a heater with its own sensors and settings, all run by this
+# process. The zone named heaterstate.DEFAULT_ZONE uses the file paths
+# below, the others have their name added to them, see heaterstate.zonepath
+# eg {'name': 'garage', 'high': 3, 'low': 2, 'sensors': ['28-0000075a1b2c']}
+ZONES = [{'name': heaterstate.DEFAULT_ZONE, 'high': GPIO_HIGH, 'low': GPIO_LOW, 'sensors': SENSOR_IDS}]
+
+# Names shown for sensors, by ID, which zones may list them by
+# eg {'28-000006db9c2a': 'lounge'}
+SENSOR_ALIASES = {}
+
+# Calibration offset added to each reading (C), by ID or alias
+SENSOR_OFFSETS = {}
+
+# Seconds between listings of the 1-wire devices, to find sensors plugged in
+# or removed; sysfs gives no notice of them
+SCAN_INTERVAL = w1therm.SCAN_INTERVAL
+
+# Resolution of sensors in bits, by ID or alias, from 9 bits converting in 94ms to
+# 12 bits converting in 750ms; sensors not listed are left as they are
+SENSOR_RESOLUTION = {}
+
+# Read all sensors concurrently rather than one after another
+SENSOR_PARALLEL = True
+
+# Seconds between background sensor readings
+SAMPLE_INTERVAL = 1
+
+# Number of readings the median filter is taken over
+SAMPLE_WINDOW = 9
 
 # Path to status file
 STATUS_FILE = '/dev/shm/heater-status'
@@ -60,7 +112,25 @@ STATUS_FILE = '/dev/shm/heater-status'
 # Path to control file
 CONTROL_FILE = '/dev/shm/heater-control'
 
-# Group and permissions for the control file
+# Path to history archive, None to disable
+ARCHIVE_FILE = heaterarchive.ARCHIVE_FILE
+
+# Path to binary shared memory copy of status and settings, None to disable
+SHM_FILE = heatershm.SHM_FILE
+
+# Path to the settings broker socket, None to disable
+SOCKET_FILE = heaterbroker.SOCKET_FILE
+
+# Path to the list of zones read by the user interfaces
+ZONES_FILE = heaterstate.ZONES_FILE
+
+# Path the timing histograms and counters are dumped to, None to disable
+METRICS_FILE = heatermetrics.METRICS_FILE
+
+# Seconds between dumps of the metrics
+METRICS_INTERVAL = 15
+
+# Group and permissions for the control file and broker socket
 CONTROL_GROUP = 'www-data'
 CONTROL_PERMS = 0666
 
@@ -73,20 +143,52 @@ TEMP_MAX = 30
 # Absolute minimum duration that heater to be turned on for
 MIN_DURATION = 5
 
+# Seconds over which the power asked for by the proportional controllers is
+# delivered by switching between heater states, None to switch directly
+DUTY_WINDOW = heaterlogic.DUTY_WINDOW
+
+# Seconds between checks of the control files when inotify is unavailable
+WATCH_INTERVAL = 1
+
+# Seconds between updates of the status file while nothing else changes
+PUBLISH_INTERVAL = 5
+
 ###
 # End system configuration
 ###
 
+# GPIO backend driving the heaters
+pins = None
+
+# Watches the zones' control files for changes made by the user interfaces
+settingswatch = None
+
+# Event loop running the controller's tasks
+loop = None
+
+# The zones being controlled
+zones = []
+
+# Cached listing of the temperature sensors on the 1-wire bus
+directory = None
+
+# Sensors by ID, kept while they are unplugged so their state survives
+sensors = dict()
+
 
 class Heater(object):
     """Class to represent two element heater"""
-    def __init__(self, lowpin, highpin):
+    def __init__(self, backend, lowpin, highpin, window=None, zone=None):
+        self.__backend = backend
+        self.__zone = zone
         self.__lowpin = lowpin
         self.__highpin = highpin
-        wiringpi.pinMode(lowpin, 1)
-        wiringpi.pinMode(highpin, 1)
-        self.__state = 'undefined'
-        self.setstate('off')
+        if window is None:
+            self.__duty = None
+        else:
+            self.__duty = heaterlogic.DutyCycle(window)
+        backend.setoutputs([lowpin, highpin])
+        self.__state = 'off'
 
     def getstate(self):
         """Accessor for state"""
@@ -95,21 +197,41 @@ class Heater(object):
     def setstate(self, state):
         """Modifier for state"""
         s = str(state).lower()
-        print "Set heater: %s" % s
         if s == "0" or s == "off":
-            wiringpi.digitalWrite(self.__highpin, 0)
-            wiringpi.digitalWrite(self.__lowpin, 0)
-            self.__state = 'off'
+            state = 'off'
         elif s == "1" or s == "lo" or s == "low":
-            wiringpi.digitalWrite(self.__highpin, 0)
-            wiringpi.digitalWrite(self.__lowpin, 1)
-            self.__state = 'low'
+            state = 'low'
         elif s == "2" or s == "hi" or s == "high" or s == "on":
-            wiringpi.digitalWrite(self.__highpin, 1)
-            wiringpi.digitalWrite(self.__lowpin, 1)
-            self.__state = 'high'
+            state = 'high'
+        else:
+            return
+        if state == self.__state:
+            return
+        print "Set heater: %s" % state
+        # The low element runs the fan, so it is turned on first and off
+        # last where the backend cannot switch both at once
+        with heatermetrics.registry.time('heater_stage_seconds', {'zone': self.__zone, 'stage': 'gpio'}):
+            self.__backend.write([(self.__lowpin, state != 'off'), (self.__highpin, state == 'high')])
+        heatermetrics.registry.inc('heater_switches_total', {'zone': self.__zone, 'state': state})
+        self.__state = state
         return
 
+    def setduty(self, fraction, elements, minduration, now):
+        """
+        Deliver a fraction of full power by switching between states over
+        the duty window, holding each for at least minduration seconds
+        Returns the time the heater next needs to be switched
+        """
+        state, nextchange = self.__duty.output(fraction, elements, minduration, now)
+        if state != self.__state:
+            self.setstate(state)
+        return nextchange
+
+    def stopduty(self):
+        """Stop switching states, the next setduty() starts a new window"""
+        if self.__duty is not None:
+            self.__duty.reset()
+
     def is_on(self):
         """Return bool to represent if heater is on"""
         if self.__state == "off":
@@ -130,252 +252,389 @@ class Heater(object):
         self.setstate("off")
 
 
-def gettemp(sensorlist):
-    """Get average temperature from sensors"""
-    temps = []
-    for s in sensorlist:
-        t = s.gettemp()
-        if t is not None:
-            temps.append(t)
-    temperature = 0
-    for t in temps:
-        temperature = temperature + t
-    if len(temps) > 0:
-        temperature = float(temperature) / len(temps)
-    else:
-        temperature = None
-    return temperature
-
-
-def getmediantemp(sensors, attempts):
+class Zone(object):
     """
-    Query every sensor in sensors attempts times
-    Return the median temperature
+    A heater with its own sensors and settings, and the tasks run for it by
+    the event loop: taking each sensor sample, applying settings changes,
+    publishing the status, switching the heater through its duty cycle and
+    deciding the heater state.
+    Checks are made on a fixed cadence of the monotonic clock, and at once
+    when the settings change.
     """
-    # print "Begin temperature check"
-    templist = []
-    for a in range(0, attempts):  # pylint: disable=unused-variable
-        gt = gettemp(sensors)
-        if gt is not None:
-            templist.append(gettemp(sensors))
-            time.sleep(1)
-    if len(templist) == 0:
-        print "Error getting temperature for all attempts"
-        return None
-    print "Temperatures: ", templist
-    templist.sort()
-    temp = templist[len(templist)/2]
-    print "Median temperature: %f" % temp
-    return temp
-
-
-def writestate(heater, temp):
-    """Dump current status to file"""
-    state = dict()
-    if temp is None:
-        state['temperature'] = -999
-    else:
-        state['temperature'] = temp
-    state['run'] = settings['run']
-    state['heater'] = heater.getstate()
-    state['setpoint'] = settings['setpoint']
-    try:
-        fd = open(STATUS_FILE, "w")
-        json.dump(state, fd)
-        fd.write('\n')
-        fd.close()
-    except IOError:
-        print "Error writing status file"
-
-
-def writesettings():
-    """Dump current settings to file"""
-    try:
-        fd = open(CONTROL_FILE, "w")
-        json.dump(settings, fd)
-        fd.write('\n')
-        fd.close()
-    except IOError:
-        print "Error writing control file"
-
+    def __init__(self, name, heater, sensors):
+        self.name = name
+        self.heater = heater
+        self.settings = dict(settings)
+        self.statuspath = heaterstate.zonepath(STATUS_FILE, name)
+        self.controlpath = heaterstate.zonepath(CONTROL_FILE, name)
+        self.controlfile = heaterstate.JSONFile(self.controlpath)
+        # The sampler reads the sensors in its own thread, and hands each
+        # sample to the loop
+        self.sampler = tempsampler.TempSampler(sensors, SAMPLE_INTERVAL, SAMPLE_WINDOW,
+                                               parallel=SENSOR_PARALLEL,
+                                               callback=lambda temp, temps: loop.call_soon_threadsafe(self.sampled, temp, temps))
+        self.segment = None
+        self.archive = None
+        self.broker = None
+        self.strategy = None
+        self.power = None
+        self.__check = None
+        self.__switch = None
+        self.__published = None
+
+    def setup(self):
+        """Create the zone's files, broker, segment and archive"""
+        try:
+            if not os.access(self.controlpath, os.F_OK):
+                fd = open(self.controlpath, "w")
+                fd.close()
+                uid = os.stat(self.controlpath).st_uid
+                if type(CONTROL_GROUP) is int:
+                    gid = CONTROL_GROUP
+                else:
+                    try:
+                        gid = grp.getgrnam(CONTROL_GROUP).gr_gid
+                    except KeyError:
+                        gid = os.stat(self.controlpath).st_gid
+                os.chown(self.controlpath, uid, gid)
+                os.chmod(self.controlpath, CONTROL_PERMS)
+        except IOError:
+            print "Error accessing control file: %s" % self.controlpath
+            sys.exit(1)
+        if SOCKET_FILE is not None:
+            path = heaterstate.zonepath(SOCKET_FILE, self.name)
+            try:
+                self.broker = heaterbroker.Broker(path, lambda: loop.call_soon_threadsafe(self.processcommands), CONTROL_PERMS,
+                                                  os.stat(self.controlpath).st_gid)
+            except EnvironmentError:
+                print "Error creating settings broker socket: %s" % path
+        if SHM_FILE is not None:
+            path = heaterstate.zonepath(SHM_FILE, self.name)
+            try:
+                self.segment = heatershm.HeaterSegment(path, create=True)
+            except EnvironmentError:
+                print "Error creating shared memory segment: %s" % path
+        if ARCHIVE_FILE is not None:
+            path = heaterstate.zonepath(ARCHIVE_FILE, self.name)
+            try:
+                self.archive = heaterarchive.Archive(path, create=True)
+            except EnvironmentError:
+                print "Error opening history archive: %s" % path
+        self.writesettings()
+        try:
+            if not os.access(self.statuspath, os.F_OK):
+                fd = open(self.statuspath, "w")
+                fd.close()
+        except IOError:
+            print "Error accessing status file: %s" % self.statuspath
+            sys.exit(1)
+
+    def close(self):
+        """Stop sampling and turn the heater off"""
+        self.sampler.stop()
+        self.heater.off()
+        self.writestate(self.sampler.gettemp())
+        if self.broker is not None:
+            self.broker.close()
+
+    def writestate(self, temp):
+        """Dump current status to file"""
+        state = dict()
+        if temp is None:
+            state['temperature'] = -999
+        else:
+            state['temperature'] = temp
+        state['run'] = self.settings['run']
+        state['heater'] = self.heater.getstate()
+        state['setpoint'] = self.settings['setpoint']
+        with heatermetrics.registry.time('heater_stage_seconds', {'zone': self.name, 'stage': 'status'}):
+            if not heaterstate.writejson(self.statuspath, state):
+                print "Error writing status file"
+            if self.segment is not None:
+                self.segment.writestate(state)
+
+    def archivesample(self, temp, sensortemps):
+        """Record a sample in the history archive"""
+        if self.archive is None:
+            return
+        if self.settings['run'] == 'auto':
+            setpoint = self.settings['setpoint']
+        else:
+            setpoint = None
+        state = self.heater.getstate()
+        if state == 'high':
+            heat = 2
+        elif state == 'low':
+            heat = 1
+        else:
+            heat = 0
+        self.archive.append(time.time(), temp, setpoint, heat, sensortemps)
+
+    def writesettings(self):
+        """Dump current settings to file"""
+        with heaterstate.settingslock(self.name):
+            if not heaterstate.writejson(self.controlpath, self.settings):
+                print "Error writing control file"
+        if self.segment is not None:
+            self.segment.writesettings(self.settings)
+        if self.broker is not None:
+            self.broker.publish(self.settings, heaterstate.etag(self.settings))
+        if settingswatch is not None:
+            settingswatch.refresh(self.controlpath)
+
+    def updatesettings(self):
+        """Read control file and apply any changes to settings"""
+        try:
+            with heatermetrics.registry.time('heater_stage_seconds', {'zone': self.name, 'stage': 'settings'}):
+                newsettings = self.controlfile.load()
+        except IOError:
+            print "Error reading control file"
+            self.writesettings()
+            return
+        except ValueError:
+            print "Error parsing json from control file"
+            self.writesettings()
+            return
+        try:
+            newsettings, problems = heaterstate.sanitisesettings(newsettings, TEMP_MIN, TEMP_MAX, MIN_DURATION)
+        except ValueError as e:
+            print "Error parsing control file: %s" % e
+            self.writesettings()
+            return
+
+        for problem in problems:
+            print problem
+        self.settings.update(newsettings)
+
+        if problems:
+            self.writesettings()
+        else:
+            if self.segment is not None:
+                self.segment.writesettings(self.settings)
+            if self.broker is not None:
+                self.broker.publish(self.settings, heaterstate.etag(self.settings))
 
-def updatesettings():
-    """Read control file and apply any changes to settings"""
-    try:
-        fd = open(CONTROL_FILE, "r")
-        newsettings = json.load(fd)
-        fd.close()
-    except IOError:
-        print "Error reading control file"
-        writesettings()
-        return
-    except ValueError:
-        print "Error parsing json from control file"
-        writesettings()
         return
-    try:
-        setpoint = float(newsettings['setpoint'])
-        minduration = int(newsettings['minduration'])
-        temphyst = float(newsettings['temphyst'])
-        highlowthresh = float(newsettings['highlowthresh'])
-        run = str(newsettings['run']).lower()
-        elements = str(newsettings['elements']).lower()
-    except ValueError:
-        print "Error parsing control file"
-        writesettings()
+
+    def applysettings(self, changes, version):
+        """
+        Apply a change made through the settings broker
+        Returns the new settings and their version
+        """
+        if version is not None and version != heaterstate.etag(self.settings):
+            raise heaterbroker.BrokerError('conflict', 'Settings have changed')
+        try:
+            changes = heaterstate.validatesettings(changes, TEMP_MIN, TEMP_MAX, MIN_DURATION)
+        except ValueError as e:
+            raise heaterbroker.BrokerError('invalid', str(e))
+        self.settings.update(changes)
+        self.writesettings()
+        return dict(self.settings), heaterstate.etag(self.settings)
+
+    def processcommands(self):
+        """Apply changes queued by the settings broker, checking at once if any"""
+        if self.broker.process(self.applysettings):
+            self.control()
+
+    def start(self):
+        """Start the zone's tasks on the loop"""
+        self.updatesettings()
+        loop.every(PUBLISH_INTERVAL, self.publish, True)
+        self.control()
+
+    def sampled(self, temp, sensortemps):
+        """Record a sample, called on the loop for each sensor reading"""
+        self.archivesample(temp, sensortemps)
+
+    def publish(self, force=False):
+        """Write the status if it changed, or if force is set"""
+        state = {'temperature': self.sampler.gettemp(), 'run': self.settings['run'],
+                 'heater': self.heater.getstate(), 'setpoint': self.settings['setpoint']}
+        if force or state != self.__published:
+            self.writestate(state['temperature'])
+            self.__published = state
+
+    def switch(self):
+        """Move to the next state of the duty cycle"""
+        self.__switch = None
+        if self.power is None:
+            return
+        nextchange = self.heater.setduty(self.power, self.settings['elements'], self.settings['minduration'], loop.time())
+        self.__switch = loop.call_at(nextchange, self.switch)
+        self.publish()
+
+    def control(self, scheduled=None):
+        """
+        Decide the heater state. scheduled is the time the check was due,
+        the next one is due an interval after it; None means now.
+        """
+        now = loop.time()
+        if scheduled is None:
+            scheduled = now
+        if self.__check is not None:
+            self.__check.cancel()
+        if self.__switch is not None:
+            self.__switch.cancel()
+            self.__switch = None
+
+        if self.strategy is None or self.strategy.name != self.settings['controller']:
+            self.strategy = heaterlogic.getstrategy(self.settings['controller'], TEMP_MAX)
+            print "%s: using %s controller" % (self.name, self.strategy.name)
+
+        temp = self.sampler.gettemp()
+        self.power = None
+        if DUTY_WINDOW is not None and isinstance(self.strategy, heaterlogic.Proportional):
+            self.power = self.strategy.power(self.settings, temp, now)
+        if self.power is None:
+            self.heater.stopduty()
+            state = self.strategy.decide(self.settings, temp, self.heater.getstate(), now)
+            if self.heater.getstate() != state:
+                self.heater.setstate(state)
+        else:
+            self.switch()
+        self.publish()
+
+        nextcheck = scheduled + heaterlogic.interval(self.settings)
+        self.__check = loop.call_at(max(nextcheck, now), self.control, nextcheck)
+        heatermetrics.registry.observe('heater_stage_seconds', loop.time() - now, {'zone': self.name, 'stage': 'control'})
+        target = heaterlogic.goal(self.settings, TEMP_MAX)
+        if target is not None:
+            if temp is None:
+                current = "unknown"
+            else:
+                current = "%fC" % temp
+            print "%s: check took %.3f seconds, target %fC, current %s, heater %s" % (self.name, loop.time() - now, target[0], current, self.heater.getstate())
+            print "%s: next check in %d seconds" % (self.name, nextcheck - now)
+
+
+def checksettings():
+    """Reload the settings of zones whose control file changed"""
+    # A wait of no time checks now, whether inotify is in use or not
+    changed = settingswatch.wait(0)
+    for zone in zones:
+        if zone.controlpath in changed:
+            zone.updatesettings()
+            print "%s: control file changed, checking now" % zone.name
+            zone.control()
+
+
+def sensorsetting(table, sid, default=None):
+    """Return the entry in table for a sensor, by its ID or alias"""
+    if sid in table:
+        return table[sid]
+    return table.get(SENSOR_ALIASES.get(sid), default)
+
+
+def getsensor(sid):
+    """Return the sensor with ID sid, kept while it comes and goes"""
+    if sid not in sensors:
+        sensors[sid] = w1therm.OWTemp(sid, resolution=sensorsetting(SENSOR_RESOLUTION, sid),
+                                      alias=SENSOR_ALIASES.get(sid),
+                                      offset=sensorsetting(SENSOR_OFFSETS, sid, 0.0))
+    return sensors[sid]
+
+
+def zonesensors(config, present):
+    """Return the sensors of a zone, given the IDs of the sensors present"""
+    ids = dict((alias, sid) for sid, alias in SENSOR_ALIASES.items())
+    if config['sensors'] != 'auto':
+        return [getsensor(ids.get(name, name)) for name in config['sensors']]
+    listed = set()
+    for other in ZONES:
+        if other['sensors'] != 'auto':
+            listed.update(ids.get(name, name) for name in other['sensors'])
+    return [getsensor(sid) for sid in present if sid not in listed]
+
+
+def rescan():
+    """List the 1-wire devices and hand sensors that came or went to the zones"""
+    added, removed = directory.refresh()
+    if not added and not removed:
         return
+    for sid in added:
+        print "Sensor %s added" % getsensor(sid).getname()
+    for sid in removed:
+        print "Sensor %s removed" % getsensor(sid).getname()
+    present = directory.sensors()
+    for config, zone in zip(ZONES, zones):
+        zone.sampler.setsensors(zonesensors(config, present))
+
 
-    needwrite = False
-    if(setpoint < TEMP_MIN):
-        print "Setpoint %f too low, setting to min: %f" % (setpoint, TEMP_MIN)
-        setpoint = TEMP_MIN
-        needwrite = True
-    elif(setpoint > TEMP_MAX):
-        print "Setpoint %f too high, setting to max: %f" % (setpoint, TEMP_MAX)
-        setpoint = TEMP_MAX
-        needwrite = True
-    if(minduration < MIN_DURATION):
-        print "Minimum duration %d too short, setting to min: %d" % (minduration, MIN_DURATION)  # noqa
-        minduration = MIN_DURATION
-        needwrite = True
-    if(temphyst < 0):
-        print "Negative hysterisis value %f is invalid, setting to 0" % (temphyst)  # noqa
-        temphyst = 0
-        needwrite = True
-    if(highlowthresh < 0):
-        print "Negative high/low threshold value %f is invalid, setting to 0" % (highlowthresh)  # noqa
-        highlowthresh = 0
-        needwrite = True
-    if(run not in ['off', 'cont', 'auto']):
-        print "Invalid run state: %s: Setting to off" % (run)
-        run = 'off'
-        needwrite = True
-    if(elements not in ['auto', 'high', 'low']):
-        print "Invalid elements state: %s: Setting to auto" % (elements)
-        elements = 'auto'
-        needwrite = True
-
-    settings['setpoint'] = setpoint
-    settings['setpoint'] = setpoint
-    settings['minduration'] = minduration
-    settings['temphyst'] = temphyst
-    settings['highlowthresh'] = highlowthresh
-    settings['run'] = run
-    settings['elements'] = elements
-
-    if needwrite:
-        writesettings()
-
-    return
+def dumpmetrics():
+    """Write the metrics for the web UI"""
+    if not heaterstate.writejson(METRICS_FILE, heatermetrics.registry.snapshot()):
+        print "Error writing metrics file"
 
 
 def setup():
     """Configure hardware"""
-    wiringpi.wiringPiSetup()
-    try:
-        if not os.access(CONTROL_FILE, os.F_OK):
-            fd = open(CONTROL_FILE, "w")
-            fd.close()
-            uid = os.stat(CONTROL_FILE).st_uid
-            if type(CONTROL_GROUP) is int:
-                gid = CONTROL_GROUP
-            else:
-                try:
-                    gid = grp.getgrnam(CONTROL_GROUP).gr_gid
-                except KeyError:
-                    gid = os.stat(CONTROL_FILE).st_gid
-            os.chown(CONTROL_FILE, uid, gid)
-            os.chmod(CONTROL_FILE, CONTROL_PERMS)
-    except IOError:
-        print "Error accessing control file: %s" % CONTROL_FILE
-        sys.exit(1)
-    writesettings()
+    global settingswatch, loop, pins, directory  # pylint: disable=global-statement
+    names = [z['name'] for z in ZONES]
+    for name in names:
+        if not heaterstate.ZONE_NAME.match(name) or names.count(name) > 1:
+            print "Invalid or repeated zone name: %s" % name
+            sys.exit(1)
+
     try:
-        if not os.access(STATUS_FILE, os.F_OK):
-            fd = open(STATUS_FILE, "w")
-            fd.close()
-    except IOError:
-        print "Error accessing control file: %s" % CONTROL_FILE
+        pins = gpio.getbackend(GPIO_BACKEND, GPIO_CHIP)
+    except gpio.GPIOError as e:
+        print "Error setting up GPIO: %s" % e
         sys.exit(1)
+    loop = eventloop.EventLoop()
+    directory = w1therm.SensorDirectory(interval=SCAN_INTERVAL)
+    present = directory.sensors()
+    for config in ZONES:
+        if config['sensors'] != 'auto' and len(config['sensors']) == 0:
+            print "No temperature sensors defined for zone %s" % config['name']
+            sys.exit(1)
+        sensorlist = zonesensors(config, present)
+        if len(sensorlist) == 0:
+            print "No temperature sensors found for zone %s yet" % config['name']
+        heater = Heater(pins, config['low'], config['high'], DUTY_WINDOW, config['name'])
+        zone = Zone(config['name'], heater, sensorlist)
+        zone.setup()
+        zones.append(zone)
+    settingswatch = filewatch.FileWatcher([z.controlpath for z in zones], WATCH_INTERVAL)
+    if not heaterstate.writejson(ZONES_FILE, {'zones': names}):
+        print "Error writing zones file: %s" % ZONES_FILE
 
 
 def main():
     """ Main loop"""
     setup()
 
-    sensors = []
-    for sid in SENSOR_IDS:
-        sensor = w1therm.OWTemp(sid)
-        sensors.append(sensor)
-
-    if len(sensors) == 0:
-        print "No temperature sensors defined"
-        exit(1)
-
-    heater = Heater(GPIO_LOW, GPIO_HIGH)
-
-    print "Target temperature: %fC" % settings['setpoint']
-    temp = getmediantemp(sensors, 9)
-    print "Current temperature: %fC" % temp
-    if temp is None:
-        temp = -999
-    writestate(heater, temp)
+    for zone in zones:
+        zone.sampler.start()
+    for zone in zones:
+        print "%s: target temperature: %fC" % (zone.name, zone.settings['setpoint'])
+        zone.sampler.wait(SAMPLE_INTERVAL * SAMPLE_WINDOW)
+        temp = zone.sampler.gettemp()
+        if temp is None:
+            print "%s: error getting initial temperature" % zone.name
+        else:
+            print "%s: current temperature: %fC" % (zone.name, temp)
 
     try:
         print "Starting main loop"
-        while True:
-            startcheck = time.time()
-
-            updatesettings()
-
-            if settings['run'] == "off":
-                if heater.is_on():
-                    heater.off()
-                temp = getmediantemp(sensors, 1)
-                writestate(heater, temp)
-                time.sleep(1)
-                continue
-
-            temp = getmediantemp(sensors, 9)
-            if temp is None:
-                heater.off()
-            else:
-                if settings['run'] == "auto":
-                    temphyst = settings['temphyst']
-                    setpoint = settings['setpoint']
-                elif settings['run'] == "cont":
-                    temphyst = 1
-                    setpoint = TEMP_MAX - temphyst
-                else:
-                    # This shouldn't be reached during normal operation
-                    time.sleep(1)
-                    continue
-
-                if (temp < (setpoint - temphyst)):
-                    if (settings['elements'] == 'high') or (
-                            (settings['elements'] == "auto") and (
-                                (setpoint - temp) > settings['highlowthresh']
-                                )):
-                        if heater.getstate() != "high":
-                            heater.high()
-                    else:
-                        if heater.getstate() != "low":
-                            heater.low()
-                elif (temp > (setpoint + temphyst)) and heater.is_on():
-                    heater.off()
-
-            writestate(heater, temp)
-
-            print "Check took %d seconds, target %fC, current %fC, heater %s" % (time.time() - startcheck, setpoint, temp, heater.getstate())
-            delay = settings['minduration'] - (time.time() - startcheck)
-            if delay > 0:
-                print "Next check in %d seconds" % (delay)
-                time.sleep(delay)
-    except:
-        raise
+        if settingswatch.fileno() is not None:
+            loop.add_reader(settingswatch.fileno(), checksettings)
+        else:
+            loop.every(WATCH_INTERVAL, checksettings)
+        for zone in zones:
+            zone.start()
+        if METRICS_FILE is not None:
+            loop.every(METRICS_INTERVAL, dumpmetrics)
+        if any(config['sensors'] == 'auto' for config in ZONES):
+            # The listing was just taken by setup()
+            loop.call_later(SCAN_INTERVAL, loop.every, SCAN_INTERVAL, rescan)
+        loop.run_forever()
     finally:
-        heater.off()
-        writestate(heater, temp)
+        for zone in zones:
+            zone.close()
+        if METRICS_FILE is not None:
+            dumpmetrics()
+        loop.close()
+        pins.close()
 
 if __name__ == "__main__":
     main()
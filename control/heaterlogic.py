@@ -0,0 +1,383 @@
+#!/usr/bin/python
+"""
+Heater control decisions, kept free of hardware, files and clocks so the
+same logic drives the real heater and the simulator
+"""
+
+import math
+
+# Seconds between checks while the heater is switched off
+OFF_INTERVAL = 1
+
+
+def goal(settings, tempmax):
+    """
+    Return the (setpoint, hysteresis) the heater is controlled to, None
+    if it is not being controlled
+    """
+    if settings['run'] == "auto":
+        return settings['setpoint'], settings['temphyst']
+    elif settings['run'] == "cont":
+        return tempmax - 1, 1
+    return None
+
+
+def decide(settings, temp, state, tempmax):
+    """
+    Return the state the heater should be in: "off", "low" or "high"
+    temp is the current temperature, None if it is unknown, and state is
+    the current heater state
+    """
+    if settings['run'] == "off" or temp is None:
+        return "off"
+    target = goal(settings, tempmax)
+    if target is None:
+        return state
+    setpoint, temphyst = target
+
+    if temp < (setpoint - temphyst):
+        if (settings['elements'] == 'high') or (
+                (settings['elements'] == "auto") and (
+                    (setpoint - temp) > settings['highlowthresh'])):
+            return "high"
+        return "low"
+    elif (temp > (setpoint + temphyst)) and state != "off":
+        return "off"
+    return state
+
+
+def interval(settings):
+    """Return the seconds from one check to the next"""
+    if settings['run'] not in ("auto", "cont"):
+        return OFF_INTERVAL
+    return settings['minduration']
+
+
+###
+# Proportional and predictive strategies
+###
+
+# Share of full power given by the low element alone
+LOW_FRACTION = 0.5
+
+# Seconds the proportional strategies hold a state before changing it
+MIN_HOLD = 300
+
+# Most full power checks worth of difference between demand and output the
+# proportional strategies carry forward
+CARRY_LIMIT = 10.0
+
+# Seconds over which DutyCycle spreads the power asked for
+DUTY_WINDOW = 600
+
+# PID gains, demand is a fraction of full power and error is in C
+PID_KP = 1.0
+PID_KI = 0.0001
+PID_KD = 0.0
+
+# Room model used for prediction: time constant (seconds) and how far
+# above outside each heater state holds the room (C), see heatertune.py
+MODEL_TAU = 10000.0
+MODEL_RISE = {'off': 0.0, 'low': 15.0, 'high': 30.0}
+
+# Length of each step of the prediction (seconds) and number of steps
+MPC_STEP = 600
+MPC_HORIZON = 6
+
+# Cost of each heater switch, and of each hour at full power, relative to
+# an hour spent one degree from the setpoint
+MPC_SWITCH_COST = 0.2
+MPC_ENERGY_COST = 0.01
+
+# Fraction of the prediction error applied to the outside estimate
+MPC_GAIN = 0.3
+
+###
+# End proportional and predictive strategies
+###
+
+
+def levels(elements):
+    """
+    Return the (state, fraction of full power) pairs the elements setting
+    allows, from off up to the most powerful
+    """
+    allowed = [("off", 0.0)]
+    if elements in ("auto", "low"):
+        allowed.append(("low", LOW_FRACTION))
+    if elements in ("auto", "high"):
+        allowed.append(("high", 1.0))
+    return allowed
+
+
+class Strategy(object):
+    """
+    A way of deciding the heater state, keeping whatever history it needs
+    between calls to decide()
+    """
+    name = None
+
+    def __init__(self, tempmax):
+        self.tempmax = tempmax
+
+    def reset(self):
+        """Forget any history, eg after the heater was turned off"""
+        pass
+
+    def decide(self, settings, temp, state, now):
+        """
+        Return the state the heater should be in at time now: "off", "low"
+        or "high"
+        """
+        raise NotImplementedError
+
+
+class Hysteresis(Strategy):
+    """On below the setpoint less the hysteresis, off above it plus it"""
+    name = 'hysteresis'
+
+    def decide(self, settings, temp, state, now):
+        return decide(settings, temp, state, self.tempmax)
+
+
+class Proportional(Strategy):
+    """
+    A strategy computing a demand for a fraction of full power, turned into
+    heater states by carrying the difference between the demand and the
+    state chosen over to the next decision, so the average power over a few
+    checks matches the demand
+    """
+    def __init__(self, tempmax):
+        Strategy.__init__(self, tempmax)
+        self.__carry = 0.0
+        self.__changed = None
+
+    def reset(self):
+        self.__carry = 0.0
+        self.__changed = None
+
+    def demand(self, settings, temp, setpoint, now):
+        """Return the fraction of full power wanted"""
+        raise NotImplementedError
+
+    def power(self, settings, temp, now):
+        """
+        Return the fraction of full power wanted, for a DutyCycle to
+        deliver, None if the heater should follow decide() instead
+        """
+        if settings['run'] == "off" or temp is None:
+            self.reset()
+            return None
+        target = goal(settings, self.tempmax)
+        if target is None:
+            return None
+        return self.demand(settings, temp, target[0], now)
+
+    def decide(self, settings, temp, state, now):
+        if settings['run'] == "off" or temp is None:
+            self.reset()
+            return "off"
+        target = goal(settings, self.tempmax)
+        if target is None:
+            return state
+        wanted = self.demand(settings, temp, target[0], now)
+        choices = levels(settings['elements'])
+        wanted += self.__carry
+        chosen, level = min(choices, key=lambda l: abs(l[1] - wanted))
+        allowed = dict(choices)
+        if chosen != state and state in allowed and self.__changed is not None and now - self.__changed < MIN_HOLD:
+            # Hold the state for a while to spare the relays, the carried
+            # difference builds up and is paid back after the switch
+            chosen, level = state, allowed[state]
+        if chosen != state:
+            self.__changed = now
+        self.__carry = max(-CARRY_LIMIT, min(CARRY_LIMIT, wanted - level))
+        return chosen
+
+
+class PID(Proportional):
+    """PID control of the power fraction with integral anti-windup"""
+    name = 'pid'
+
+    def __init__(self, tempmax, kp=PID_KP, ki=PID_KI, kd=PID_KD):
+        Proportional.__init__(self, tempmax)
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.reset()
+
+    def reset(self):
+        Proportional.reset(self)
+        self.__integral = 0.0
+        self.__last = None
+
+    def demand(self, settings, temp, setpoint, now):
+        error = setpoint - temp
+        derivative = 0.0
+        dt = 0.0
+        if self.__last is not None:
+            lasttime, lasttemp = self.__last
+            dt = now - lasttime
+            if dt > 0:
+                # On the measurement, so setpoint changes give no kick
+                derivative = -(temp - lasttemp) / dt
+        self.__last = (now, temp)
+
+        output = self.kp * error + self.ki * self.__integral + self.kd * derivative
+        # Only integrate while the output is not held at a limit by it
+        if (0.0 < output < 1.0) or (output >= 1.0 and error < 0) or (output <= 0.0 and error > 0):
+            self.__integral += error * dt
+        return max(0.0, min(1.0, output))
+
+
+class DutyCycle(object):
+    """
+    Slow PWM of the two elements: deliver a fraction of full power by
+    spending part of each window in the state above it and the rest in the
+    state below, eg low and high for more than LOW_FRACTION.
+    No state is held for less than the minimum duration; power a window
+    could not deliver because of that is carried over to the next one.
+    The fraction is taken up at the start of each window.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        """Start a new window at the next call"""
+        self.__start = None
+        self.__plan = None
+        self.__carry = 0.0
+
+    def __planwindow(self, fraction, elements, minduration):
+        """Return the upper state, seconds in it and the lower state"""
+        allowed = levels(elements)
+        wanted = max(0.0, min(allowed[-1][1], fraction + self.__carry / self.window))
+        lower = allowed[0]
+        upper = allowed[-1]
+        for a, b in zip(allowed, allowed[1:]):
+            if a[1] <= wanted <= b[1]:
+                lower, upper = a, b
+                break
+        seconds = self.window * (wanted - lower[1]) / (upper[1] - lower[1])
+        if seconds < minduration:
+            seconds = 0
+        elif self.window - seconds < minduration:
+            seconds = self.window
+        delivered = lower[1] + (upper[1] - lower[1]) * seconds / self.window
+        self.__carry = max(-self.window, min(self.window, (wanted - delivered) * self.window))
+        return upper[0], seconds, lower[0]
+
+    def output(self, fraction, elements, minduration, now):
+        """
+        Return the state the heater should be in at time now and the time
+        it should next be checked
+        """
+        if self.__start is None or now >= self.__start + self.window:
+            if self.__start is None or now >= self.__start + 2 * self.window:
+                self.__start = now
+            else:
+                self.__start += self.window
+            self.__plan = self.__planwindow(fraction, elements, minduration)
+        upper, seconds, lower = self.__plan
+        switch = self.__start + seconds
+        if now < switch:
+            return upper, switch
+        return lower, self.__start + self.window
+
+
+class MPC(Strategy):
+    """
+    Model predictive control: predict the room with a first order model for
+    every plan of holding one state and then another over the horizon, and
+    take the first state of the cheapest plan. The model's outside
+    temperature is corrected from how far its predictions were out.
+    """
+    name = 'mpc'
+
+    def __init__(self, tempmax, tau=MODEL_TAU, rise=None):
+        Strategy.__init__(self, tempmax)
+        self.tau = tau
+        self.rise = dict(MODEL_RISE if rise is None else rise)
+        self.reset()
+
+    def reset(self):
+        self.__outside = None
+        self.__predicted = None
+        self.__since = None
+        self.__last = None
+
+    def __predict(self, temp, state, seconds):
+        """Return the model temperature after seconds in state"""
+        equilibrium = self.__outside + self.rise[state]
+        return equilibrium + (temp - equilibrium) * math.exp(-seconds / self.tau)
+
+    def __correct(self, temp, state, now):
+        """Follow the applied state with the model, correcting it every step"""
+        if self.__outside is None:
+            # Assume the room started out settled
+            self.__outside = temp - self.rise[state]
+        if self.__last is not None:
+            lasttime, laststate = self.__last
+            self.__predicted = self.__predict(self.__predicted, laststate, now - lasttime)
+            elapsed = now - self.__since
+            if elapsed >= MPC_STEP:
+                sensitivity = 1 - math.exp(-elapsed / self.tau)
+                self.__outside += MPC_GAIN * (temp - self.__predicted) / sensitivity
+                self.__predicted = temp
+                self.__since = now
+        else:
+            self.__predicted = temp
+            self.__since = now
+        self.__last = (now, state)
+
+    def __cost(self, temp, setpoint, plan, state):
+        """Return the cost of following plan, a state for each step"""
+        cost = 0.0
+        hours = MPC_STEP / 3600.0
+        for s in plan:
+            if s != state:
+                cost += MPC_SWITCH_COST
+                state = s
+            end = self.__predict(temp, s, MPC_STEP)
+            error = (temp + end) / 2.0 - setpoint
+            cost += error * error * hours
+            cost += MPC_ENERGY_COST * self.rise[s] / self.rise['high'] * hours
+            temp = end
+        return cost
+
+    def decide(self, settings, temp, state, now):
+        if settings['run'] == "off" or temp is None:
+            self.reset()
+            return "off"
+        target = goal(settings, self.tempmax)
+        if target is None:
+            return state
+        self.__correct(temp, state, now)
+
+        states = [name for name, _ in levels(settings['elements'])]
+        best = None
+        for first in states:
+            for second in states:
+                for change in range(1, MPC_HORIZON + 1):
+                    if first == second and change != MPC_HORIZON:
+                        continue
+                    plan = [first] * change + [second] * (MPC_HORIZON - change)
+                    cost = self.__cost(temp, target[0], plan, state)
+                    if best is None or cost < best[0]:
+                        best = (cost, first)
+        self.__last = (now, best[1])
+        return best[1]
+
+
+# Names of the strategies used in the control file, in the order the shared
+# memory segment numbers them, so new ones go at the end
+CONTROLLERS = [s.name for s in (Hysteresis, PID, MPC)]
+
+# Strategies by the name used in the control file
+STRATEGIES = dict((s.name, s) for s in (Hysteresis, PID, MPC))
+
+
+def getstrategy(name, tempmax):
+    """Return a new strategy called name, hysteresis if there is none"""
+    return STRATEGIES.get(name, Hysteresis)(tempmax)
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+"""
+Timing histograms and counters kept by the controller, dumped to a file in
+shared memory and rendered in the Prometheus text format by the web UI
+"""
+
+import bisect
+import contextlib
+import threading
+
+import eventloop
+
+# Path the controller dumps its metrics to
+METRICS_FILE = '/dev/shm/heater-metrics'
+
+# Upper bounds of the timing histogram buckets (seconds)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Description of each metric, for the exposition
+HELP = {'heater_stage_seconds': 'Time taken by each stage of the control loop',
+        'heater_sensor_read_seconds': 'Time taken to read each sensor, including retries',
+        'heater_sensor_retries_total': 'Sensor reads retried, by reason',
+        'heater_sensor_failures_total': 'Sensor reads that failed after every retry',
+        'heater_sensor_quarantines_total': 'Times a failing sensor was left unread for a while',
+        'heater_switches_total': 'Heater switches, by the state switched to'}
+
+
+class Histogram(object):
+    """Counts of observations by bucket, with their sum"""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Record one observation"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+
+class Registry(object):
+    """Named counters and histograms with labels, updated from any thread"""
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__counters = dict()
+        self.__histograms = dict()
+
+    def inc(self, name, labels=None, amount=1):
+        """Add amount to a counter"""
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + amount
+
+    def observe(self, name, value, labels=None):
+        """Record an observation in a histogram"""
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = Histogram()
+            histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name, labels=None):
+        """Record the seconds taken by the block in a histogram"""
+        start = eventloop.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, eventloop.monotonic() - start, labels)
+
+    def snapshot(self):
+        """Return the metrics as a json serialisable dict"""
+        with self.__lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in self.__counters.items()]
+            histograms = [{'name': name, 'labels': dict(labels), 'buckets': list(h.buckets),
+                           'counts': list(h.counts), 'sum': h.sum}
+                          for (name, labels), h in self.__histograms.items()]
+        return {'counters': counters, 'histograms': histograms}
+
+
+def _labels(labels, extra=None):
+    """Format labels for the exposition, {} if there are none"""
+    items = sorted(labels.items())
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    escaped = []
+    for key, value in items:
+        value = unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append('%s="%s"' % (key, value))
+    return '{%s}' % ','.join(escaped)
+
+
+def _number(value):
+    """Format a number for the exposition"""
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snapshot):
+    """Return a snapshot in the Prometheus text exposition format"""
+    lines = []
+    metrics = dict()
+    for counter in snapshot.get('counters', []):
+        metrics.setdefault((counter['name'], 'counter'), []).append(counter)
+    for histogram in snapshot.get('histograms', []):
+        metrics.setdefault((histogram['name'], 'histogram'), []).append(histogram)
+    for name, kind in sorted(metrics):
+        if name in HELP:
+            lines.append('# HELP %s %s' % (name, HELP[name]))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for metric in sorted(metrics[(name, kind)], key=lambda m: sorted(m['labels'].items())):
+            labels = metric['labels']
+            if kind == 'counter':
+                lines.append('%s%s %s' % (name, _labels(labels), _number(metric['value'])))
+                continue
+            total = 0
+            for bound, count in zip(metric['buckets'] + [float('inf')], metric['counts']):
+                total += count
+                lines.append('%s_bucket%s %d' % (name, _labels(labels, ('le', _number(bound))), total))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _number(metric['sum'])))
+            lines.append('%s_count%s %d' % (name, _labels(labels), total))
+    return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
@@ -0,0 +1,203 @@
+#!/usr/bin/python
+"""
+Fixed layout shared memory segment holding heater status and settings
+
+The controller is the only writer. Each section is guarded by a sequence
+counter which is odd while the section is being written, so readers can
+take a consistent snapshot without locking or parsing: read the counter,
+copy the section, and retry if the counter was odd or has moved on.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+import heaterlogic
+import mappedfile
+
+# Path to shared memory segment
+SHM_FILE = '/dev/shm/heater-shm'
+
+# Identifies the segment and its layout
+MAGIC = 'HTR2'
+
+HEATER_STATES = ['undefined', 'off', 'low', 'high']
+RUN_STATES = ['off', 'cont', 'auto']
+ELEMENT_STATES = ['auto', 'high', 'low']
+
+HEADER = struct.Struct('<4s')
+SEQ = struct.Struct('<I')
+# updated, temperature, setpoint, heater, run
+STATUS = struct.Struct('<dddBB')
+# updated, setpoint, temphyst, highlowthresh, minduration, run, elements,
+# controller
+SETTINGS = struct.Struct('<ddddiBBB')
+
+STATUS_OFFSET = HEADER.size
+SETTINGS_OFFSET = STATUS_OFFSET + SEQ.size + STATUS.size
+SEGMENT_SIZE = SETTINGS_OFFSET + SEQ.size + SETTINGS.size
+
+# Give up on a snapshot after this many attempts (writer died mid-write)
+READ_ATTEMPTS = 1000
+
+
+def _encode(states, value):
+    """Turn a state name into its index"""
+    try:
+        return states.index(str(value).lower())
+    except ValueError:
+        return 0
+
+
+def _decode(states, value):
+    """Turn a state index into its name"""
+    if value < len(states):
+        return states[value]
+    return states[0]
+
+
+class Section(object):
+    """A seqlock protected region of the segment"""
+    def __init__(self, buf, offset, layout):
+        self.__buf = buf
+        self.__offset = offset
+        self.__layout = layout
+
+    def seq(self):
+        """Return the sequence counter, which changes on every write"""
+        return SEQ.unpack_from(self.__buf, self.__offset)[0]
+
+    def write(self, values):
+        """Write a new set of values"""
+        seq = self.seq()
+        SEQ.pack_into(self.__buf, self.__offset, (seq + 1) & 0xffffffff)
+        self.__layout.pack_into(self.__buf, self.__offset + SEQ.size, *values)
+        SEQ.pack_into(self.__buf, self.__offset, (seq + 2) & 0xffffffff)
+
+    def read(self):
+        """Return a consistent copy of the values, None if never written"""
+        for attempt in range(0, READ_ATTEMPTS):  # pylint: disable=unused-variable
+            before = self.seq()
+            if before & 1:
+                continue
+            values = self.__layout.unpack_from(self.__buf, self.__offset + SEQ.size)
+            if self.seq() == before:
+                if before == 0:
+                    return None
+                return values
+        return None
+
+
+class HeaterSegment(object):
+    """Access to the heater shared memory segment"""
+    def __init__(self, path=SHM_FILE, create=False):
+        self.__path = path
+        if create:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0644)
+            try:
+                os.ftruncate(fd, SEGMENT_SIZE)
+                self.__buf = mmap.mmap(fd, SEGMENT_SIZE, mmap.MAP_SHARED,
+                                       mmap.PROT_READ | mmap.PROT_WRITE)
+            finally:
+                os.close(fd)
+            self.__buf[STATUS_OFFSET:SEGMENT_SIZE] = '\0' * (SEGMENT_SIZE - STATUS_OFFSET)
+            HEADER.pack_into(self.__buf, 0, MAGIC)
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                if os.fstat(fd).st_size < SEGMENT_SIZE:
+                    raise ValueError("Segment %s is too small" % path)
+                self.__buf = mmap.mmap(fd, SEGMENT_SIZE, mmap.MAP_SHARED,
+                                       mmap.PROT_READ)
+            finally:
+                os.close(fd)
+            if HEADER.unpack_from(self.__buf, 0)[0] != MAGIC:
+                self.__buf.close()
+                raise ValueError("Segment %s has an unknown layout" % path)
+        self.status = Section(self.__buf, STATUS_OFFSET, STATUS)
+        self.settings = Section(self.__buf, SETTINGS_OFFSET, SETTINGS)
+
+    def getpath(self):
+        """Returns filesystem path of the segment"""
+        return self.__path
+
+    def writestate(self, state):
+        """Publish a status dict"""
+        self.status.write((time.time(),
+                           float(state['temperature']),
+                           float(state['setpoint']),
+                           _encode(HEATER_STATES, state['heater']),
+                           _encode(RUN_STATES, state['run'])))
+
+    def writesettings(self, settings):
+        """Publish a settings dict"""
+        self.settings.write((time.time(),
+                             float(settings['setpoint']),
+                             float(settings['temphyst']),
+                             float(settings['highlowthresh']),
+                             int(settings['minduration']),
+                             _encode(RUN_STATES, settings['run']),
+                             _encode(ELEMENT_STATES, settings['elements']),
+                             _encode(heaterlogic.CONTROLLERS, settings['controller'])))
+
+    def readstate(self):
+        """Return the status dict in the same form as the status file"""
+        values = self.status.read()
+        if values is None:
+            return None
+        state = dict()
+        state['temperature'] = values[1]
+        state['setpoint'] = values[2]
+        state['heater'] = _decode(HEATER_STATES, values[3])
+        state['run'] = _decode(RUN_STATES, values[4])
+        return state
+
+    def readsettings(self, since=None):
+        """
+        Return the settings dict in the same form as the control file, None
+        if they were published before the time since
+        """
+        values = self.settings.read()
+        if values is None or (since is not None and values[0] < since):
+            return None
+        settings = dict()
+        settings['setpoint'] = values[1]
+        settings['temphyst'] = values[2]
+        settings['highlowthresh'] = values[3]
+        settings['minduration'] = values[4]
+        settings['run'] = _decode(RUN_STATES, values[5])
+        settings['elements'] = _decode(ELEMENT_STATES, values[6])
+        settings['controller'] = _decode(heaterlogic.CONTROLLERS, values[7])
+        return settings
+
+    def close(self):
+        """Unmap the segment"""
+        self.__buf.close()
+
+
+class SegmentReader(mappedfile.MappedFileReader):
+    """Keep a segment open for reading, reopening it if it is recreated"""
+    def __init__(self, path=SHM_FILE):
+        mappedfile.MappedFileReader.__init__(self, path, HeaterSegment)
+
+    def segment(self):
+        """Return the open segment, None if there is none usable"""
+        return self.get()
+
+    def readstate(self):
+        """Return the status dict, None if the segment is unusable"""
+        seg = self.segment()
+        if seg is None:
+            return None
+        return seg.readstate()
+
+    def readsettings(self, since=None):
+        """
+        Return the settings dict, None if the segment is unusable or they
+        were published before the time since
+        """
+        seg = self.segment()
+        if seg is None:
+            return None
+        return seg.readsettings(since)
@@ -0,0 +1,261 @@
+#!/usr/bin/python
+"""
+Simulated room and heater, to run the control logic against a virtual clock
+far faster than real time
+"""
+# pylint: disable=line-too-long
+
+import argparse
+import math
+import random
+
+import heaterlogic
+import heaterstate
+
+###
+# Default room model
+###
+
+# Heat needed to warm the room by one degree (J/K)
+CAPACITY = 500000.0
+
+# Heat lost to outside per degree of difference (W/K)
+LOSS = 50.0
+
+# Heat output of each heater state (W)
+POWER = {'off': 0.0, 'low': 750.0, 'high': 1500.0}
+
+# Mean outside temperature (C) and the size of its daily swing either side
+OUTSIDE = 5.0
+OUTSIDE_SWING = 3.0
+
+# Sensor resolution (C) and standard deviation of its noise (C)
+RESOLUTION = 0.0625
+NOISE = 0.05
+
+# Longest time the model is advanced in one go, short enough to follow the
+# outside temperature (seconds)
+MAX_STEP = 60
+
+###
+# End default room model
+###
+
+
+class VirtualClock(object):
+    """Clock that only moves when told to"""
+    def __init__(self, start=0.0):
+        self.__now = start
+
+    def time(self):
+        """Return the current virtual time"""
+        return self.__now
+
+    def sleep(self, seconds):
+        """Move the clock forward"""
+        self.__now += max(seconds, 0)
+
+
+class Room(object):
+    """
+    First order thermal model of a heated room: a single heat capacity
+    warmed by the heater and losing heat to outside in proportion to the
+    temperature difference.
+    The model is solved exactly for each step so long steps lose nothing.
+    """
+    def __init__(self, temp=None, capacity=CAPACITY, loss=LOSS, power=None,
+                 outside=OUTSIDE, swing=OUTSIDE_SWING):
+        self.__capacity = capacity
+        self.__loss = loss
+        self.__power = dict(POWER if power is None else power)
+        self.__outside = outside
+        self.__swing = swing
+        if temp is None:
+            temp = outside
+        self.temp = temp
+
+    def timeconstant(self):
+        """Return the time constant of the room (seconds)"""
+        return self.__capacity / self.__loss
+
+    def power(self, state):
+        """Return the heat output of the heater in state (W)"""
+        return self.__power[state]
+
+    def rise(self, state):
+        """Return how far above outside the heater in state holds the room"""
+        return self.__power[state] / self.__loss
+
+    def outside(self, t):
+        """Return the outside temperature at time t, coldest at 4am"""
+        return self.__outside - self.__swing * math.cos(2 * math.pi * (t - 4 * 3600) / 86400.0)
+
+    def advance(self, t, seconds, state):
+        """
+        Run the model from time t for seconds with the heater in state
+        Returns the lowest and highest temperatures reached
+        """
+        low = high = self.temp
+        tau = self.timeconstant()
+        end = t + seconds
+        while t < end:
+            step = min(MAX_STEP, end - t)
+            equilibrium = self.outside(t + step / 2.0) + self.rise(state)
+            self.temp = equilibrium + (self.temp - equilibrium) * math.exp(-step / tau)
+            low = min(low, self.temp)
+            high = max(high, self.temp)
+            t += step
+        return low, high
+
+
+class Sensor(object):
+    """Temperature sensor with limited resolution and noise"""
+    def __init__(self, room, resolution=RESOLUTION, noise=NOISE, seed=None):
+        self.__room = room
+        self.__resolution = resolution
+        self.__noise = noise
+        self.__random = random.Random(seed)
+
+    def gettemp(self):
+        """Return a reading of the room temperature"""
+        temp = self.__room.temp
+        if self.__noise:
+            temp += self.__random.gauss(0, self.__noise)
+        if self.__resolution:
+            temp = round(temp / self.__resolution) * self.__resolution
+        return temp
+
+
+def simulate(settings, duration, room=None, sensor=None, clock=None,
+             tempmax=heaterstate.TEMP_MAX, trace=None, strategy=None, window=None):
+    """
+    Run the control logic for duration virtual seconds and return a dict of
+    statistics: number of heater switches, seconds spent on low and high,
+    energy used (kWh), the most the room went over and under the setpoint,
+    and the time weighted mean of the distance from it.
+    The strategy named by the controller setting is used unless one is
+    given. If window is given the power asked for by proportional
+    strategies is delivered by a heaterlogic.DutyCycle over that window.
+    trace, if given, is a list (time, reading, room temperature, heater
+    state) is appended to at every check.
+    """
+    if room is None:
+        room = Room(settings['setpoint'])
+    if sensor is None:
+        sensor = Sensor(room)
+    if clock is None:
+        clock = VirtualClock()
+    if strategy is None:
+        strategy = heaterlogic.getstrategy(settings.get('controller'), tempmax)
+    duty = None
+    if window is not None and isinstance(strategy, heaterlogic.Proportional):
+        duty = heaterlogic.DutyCycle(window)
+
+    state = 'off'
+    stats = {'switches': 0, 'low': 0.0, 'high': 0.0, 'energy': 0.0,
+             'overshoot': 0.0, 'undershoot': 0.0, 'error': 0.0}
+    start = clock.time()
+    end = start + duration
+    while clock.time() < end:
+        now = clock.time()
+        temp = sensor.gettemp()
+        power = None
+        if duty is not None:
+            power = strategy.power(settings, temp, now)
+        step = min(heaterlogic.interval(settings), end - now)
+        if power is None:
+            if duty is not None:
+                duty.reset()
+            new = strategy.decide(settings, temp, state, now)
+        else:
+            new, nextchange = duty.output(power, settings['elements'], settings['minduration'], now)
+            step = min(step, nextchange - now)
+        if new != state:
+            stats['switches'] += 1
+            state = new
+        if trace is not None:
+            trace.append((now, temp, room.temp, state))
+
+        before = room.temp
+        low, high = room.advance(now, step, state)
+        if state != 'off':
+            stats[state] += step
+            stats['energy'] += room.power(state) * step / 3.6e6
+        target = heaterlogic.goal(settings, tempmax)
+        if target is not None:
+            setpoint = target[0]
+            stats['overshoot'] = max(stats['overshoot'], high - setpoint)
+            stats['undershoot'] = max(stats['undershoot'], setpoint - low)
+            stats['error'] += abs((before + room.temp) / 2.0 - setpoint) * step
+        clock.sleep(step)
+
+    if duration > 0:
+        stats['error'] /= duration
+    return stats
+
+
+def compare(settings, duration, start=None, outside=OUTSIDE, seed=None, names=None, window=None):
+    """
+    Simulate each strategy with the same room, starting temperature and
+    sensor noise, and return their statistics by name
+    """
+    if names is None:
+        names = sorted(heaterlogic.STRATEGIES)
+    results = dict()
+    for name in names:
+        room = Room(settings['setpoint'] if start is None else start, outside=outside)
+        results[name] = simulate(dict(settings, controller=name), duration, room, Sensor(room, seed=seed), window=window)
+    return results
+
+
+def main():
+    """Simulate the controller and print a summary"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=float, default=7, help='length of the simulation')
+    parser.add_argument('--setpoint', type=float, default=20.0)
+    parser.add_argument('--temphyst', type=float, default=heaterstate.DEFAULT_SETTINGS['temphyst'])
+    parser.add_argument('--highlowthresh', type=float, default=heaterstate.DEFAULT_SETTINGS['highlowthresh'])
+    parser.add_argument('--minduration', type=int, default=heaterstate.DEFAULT_SETTINGS['minduration'])
+    parser.add_argument('--elements', choices=heaterstate.ELEMENTS, default='auto')
+    parser.add_argument('--controller', choices=heaterstate.CONTROLLERS, default='hysteresis')
+    parser.add_argument('--compare', action='store_true', help='compare every controller')
+    parser.add_argument('--window', type=float, default=None, help='duty cycle window for the proportional controllers')
+    parser.add_argument('--start', type=float, default=None, help='starting room temperature')
+    parser.add_argument('--outside', type=float, default=OUTSIDE, help='mean outside temperature')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the sensor noise')
+    parser.add_argument('--csv', help='write every check to this file')
+    args = parser.parse_args()
+
+    settings = dict(heaterstate.DEFAULT_SETTINGS)
+    settings.update(run='auto', setpoint=args.setpoint, temphyst=args.temphyst,
+                    highlowthresh=args.highlowthresh, minduration=args.minduration,
+                    elements=args.elements, controller=args.controller)
+    duration = args.days * 86400
+    if args.compare:
+        results = compare(settings, duration, args.start, args.outside, args.seed, window=args.window)
+        print "Simulated %.1f days" % args.days
+        print "controller  mean error  overshoot  undershoot  switches/day  kWh/day"
+        for name in sorted(results):
+            stats = results[name]
+            print "%-10s %11.2f %10.2f %11.2f %13.0f %8.1f" % (
+                name, stats['error'], stats['overshoot'], stats['undershoot'],
+                stats['switches'] / args.days, stats['energy'] / args.days)
+        return
+
+    room = Room(args.setpoint if args.start is None else args.start, outside=args.outside)
+    trace = [] if args.csv else None
+    stats = simulate(settings, duration, room, Sensor(room, seed=args.seed), trace=trace, window=args.window)
+
+    print "Simulated %.1f days" % args.days
+    print "Heater switches: %d" % stats['switches']
+    print "On low: %.1f hours, on high: %.1f hours, %.1f kWh" % (stats['low'] / 3600, stats['high'] / 3600, stats['energy'])
+    print "Overshoot: %.2fC, undershoot: %.2fC, mean error: %.2fC" % (stats['overshoot'], stats['undershoot'], stats['error'])
+    if trace is not None:
+        fd = open(args.csv, "w")
+        fd.write("time,reading,temperature,heater\n")
+        for row in trace:
+            fd.write("%d,%.4f,%.4f,%s\n" % row)
+        fd.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+#!/usr/bin/python
+"""Shared access to the heater status and control files"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+
+import filewatch
+import heaterbroker
+import heaterlogic
+import heatershm
+
+# Path to status file
+STATUS_FILE = '/dev/shm/heater-status'
+
+# Path to control file
+CONTROL_FILE = '/dev/shm/heater-control'
+
+# Lock file serialising read-modify-write updates of the control file
+LOCK_FILE = '/dev/shm/heater-control.lock'
+
+# List of the zones the controller runs, written by the controller
+ZONES_FILE = '/dev/shm/heater-zones'
+
+# Zone whose files have the paths above, other zones have their name added
+DEFAULT_ZONE = 'main'
+
+# Zone names allowed, they become part of file names and URLs
+ZONE_NAME = re.compile(r'^[A-Za-z0-9_]+$')
+
+# Limits on settings, these match the controller's
+TEMP_MIN = 0
+TEMP_MAX = 30
+MIN_DURATION = 5
+RUN_MODES = ['off', 'cont', 'auto']
+ELEMENTS = ['auto', 'high', 'low']
+CONTROLLERS = heaterlogic.CONTROLLERS
+
+# Settings used when the control file cannot be read, these match the
+# controller's defaults
+DEFAULT_SETTINGS = {"highlowthresh": 0.75,
+                    "temphyst": 0.33,
+                    "elements": "auto",
+                    "run": "off",
+                    "setpoint": 20.0,
+                    "minduration": 30,
+                    "controller": "hysteresis"}
+
+# Status used when the status file cannot be read
+DEFAULT_STATE = {"heater": "off",
+                 "setpoint": 20.0,
+                 "run": "off",
+                 "temperature": -999}
+
+
+def writejson(path, data):
+    """
+    Write data to path as json by writing a temporary file and renaming it
+    over the old one, so readers never see a partly written file
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    try:
+        st = os.stat(path)
+    except OSError:
+        st = None
+    try:
+        fd, tmppath = tempfile.mkstemp(prefix='.%s.' % name, dir=directory)
+    except OSError:
+        fd = None
+    if fd is not None:
+        try:
+            if st is not None:
+                os.fchmod(fd, st.st_mode & 0777)
+                try:
+                    os.fchown(fd, st.st_uid, st.st_gid)
+                except OSError:
+                    pass
+            else:
+                umask = os.umask(0)
+                os.umask(umask)
+                os.fchmod(fd, 0666 & ~umask)
+            tmp = os.fdopen(fd, "w")
+            json.dump(data, tmp)
+            tmp.write('\n')
+            tmp.close()
+            os.rename(tmppath, path)
+            return True
+        except (OSError, IOError):
+            # Typically the old file belongs to another user in a sticky
+            # directory such as /dev/shm, so fall back to rewriting it
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+    try:
+        fd = open(path, "w")
+        json.dump(data, fd)
+        fd.write('\n')
+        fd.close()
+    except IOError:
+        return False
+    return True
+
+
+class JSONFile(object):
+    """
+    A json file whose parsed contents are cached until the file changes.
+    A read costs a stat() unless the file was replaced or rewritten.
+    """
+    def __init__(self, path, default=None):
+        self.__path = path
+        self.__default = default
+        self.__signature = None
+        self.__data = None
+
+    def getpath(self):
+        """Returns filesystem path of the file"""
+        return self.__path
+
+    def load(self):
+        """
+        Return a copy of the file contents, reparsing only if it changed
+        Raises IOError or ValueError if the file cannot be read or parsed
+        """
+        sig = filewatch.signature(self.__path)
+        if sig is None or sig != self.__signature:
+            fd = open(self.__path, "r")
+            try:
+                data = json.load(fd)
+            finally:
+                fd.close()
+            self.__data = data
+            self.__signature = sig
+        return dict(self.__data)
+
+    def read(self):
+        """Return a copy of the file contents, or of the default on error"""
+        try:
+            return self.load()
+        except IOError:
+            print "Error reading %s" % self.__path
+        except ValueError:
+            print "Error parsing json from %s" % self.__path
+        if self.__default is None:
+            return None
+        return dict(self.__default)
+
+    def write(self, data):
+        """Atomically replace the file contents"""
+        if not writejson(self.__path, data):
+            print "Error writing %s" % self.__path
+            return False
+        self.__data = dict(data)
+        self.__signature = filewatch.signature(self.__path)
+        return True
+
+
+class SettingsConflict(Exception):
+    """The settings were changed since the version an update was based on"""
+    pass
+
+
+def etag(data):
+    """Return a version tag for data, a hash of its canonical json"""
+    return hashlib.sha1(json.dumps(data, sort_keys=True, separators=(',', ':'))).hexdigest()
+
+
+def _convert(key, value):
+    """
+    Return a setting converted to its proper type
+    Raises ValueError if it is not a known setting or cannot be converted
+    """
+    try:
+        if key in ('setpoint', 'temphyst', 'highlowthresh'):
+            if isinstance(value, bool):
+                raise TypeError
+            number = float(value)
+            # NaN compares false with every limit, so would pass the checks
+            if math.isnan(number) or math.isinf(number):
+                raise ValueError
+            return number
+        elif key == 'minduration':
+            if isinstance(value, bool) or (isinstance(value, float) and int(value) != value):
+                raise TypeError
+            return int(value)
+        elif key in ('run', 'elements', 'controller'):
+            return str(value).lower()
+    except (TypeError, ValueError, OverflowError, UnicodeEncodeError):
+        raise ValueError("Invalid value for %s: %r" % (key, value))
+    raise ValueError("Unknown setting: %s" % key)
+
+
+def validatesettings(changes, tempmin=TEMP_MIN, tempmax=TEMP_MAX, minduration=MIN_DURATION):
+    """
+    Check a dict of settings to change and return it with the values
+    converted to their proper types
+    Raises ValueError describing the first invalid setting
+    """
+    result = dict()
+    for key, value in changes.items():
+        value = _convert(key, value)
+        if key == 'setpoint' and not tempmin <= value <= tempmax:
+            raise ValueError("setpoint must be between %g and %g" % (tempmin, tempmax))
+        if key == 'minduration' and value < minduration:
+            raise ValueError("minduration must be at least %d" % minduration)
+        if key in ('temphyst', 'highlowthresh') and value < 0:
+            raise ValueError("%s must not be negative" % key)
+        if key == 'run' and value not in RUN_MODES:
+            raise ValueError("run must be one of %s" % ', '.join(RUN_MODES))
+        if key == 'elements' and value not in ELEMENTS:
+            raise ValueError("elements must be one of %s" % ', '.join(ELEMENTS))
+        if key == 'controller' and value not in CONTROLLERS:
+            raise ValueError("controller must be one of %s" % ', '.join(CONTROLLERS))
+        result[key] = value
+    return result
+
+
+def sanitisesettings(data, tempmin=TEMP_MIN, tempmax=TEMP_MAX, minduration=MIN_DURATION):
+    """
+    Convert a complete set of settings to their proper types and bring any
+    out of range values back within the limits, as the controller does with
+    the control file.
+    Missing settings are given their default.
+    Returns the settings and a list of messages describing what was changed.
+    Raises ValueError if a setting cannot be converted.
+    """
+    settings = dict()
+    problems = []
+    for key in DEFAULT_SETTINGS:
+        if key not in data:
+            problems.append("Missing setting %s, setting to default: %s" % (key, DEFAULT_SETTINGS[key]))
+            settings[key] = DEFAULT_SETTINGS[key]
+        else:
+            settings[key] = _convert(key, data[key])
+
+    if settings['setpoint'] < tempmin:
+        problems.append("Setpoint %f too low, setting to min: %f" % (settings['setpoint'], tempmin))
+        settings['setpoint'] = tempmin
+    elif settings['setpoint'] > tempmax:
+        problems.append("Setpoint %f too high, setting to max: %f" % (settings['setpoint'], tempmax))
+        settings['setpoint'] = tempmax
+    if settings['minduration'] < minduration:
+        problems.append("Minimum duration %d too short, setting to min: %d" % (settings['minduration'], minduration))
+        settings['minduration'] = minduration
+    if settings['temphyst'] < 0:
+        problems.append("Negative hysterisis value %f is invalid, setting to 0" % settings['temphyst'])
+        settings['temphyst'] = 0
+    if settings['highlowthresh'] < 0:
+        problems.append("Negative high/low threshold value %f is invalid, setting to 0" % settings['highlowthresh'])
+        settings['highlowthresh'] = 0
+    if settings['run'] not in RUN_MODES:
+        problems.append("Invalid run state: %s: Setting to off" % settings['run'])
+        settings['run'] = 'off'
+    if settings['elements'] not in ELEMENTS:
+        problems.append("Invalid elements state: %s: Setting to auto" % settings['elements'])
+        settings['elements'] = 'auto'
+    if settings['controller'] not in CONTROLLERS:
+        problems.append("Invalid controller: %s: Setting to hysteresis" % settings['controller'])
+        settings['controller'] = 'hysteresis'
+    return settings, problems
+
+
+def zonepath(path, zone=None):
+    """
+    Return the path of a zone's copy of the file at path: the same path for
+    the default zone, otherwise with the zone name added before any
+    extension, eg /dev/shm/heater-control-garage.sock
+    """
+    if zone is None or zone == DEFAULT_ZONE:
+        return path
+    if not ZONE_NAME.match(zone):
+        raise ValueError("Invalid zone name: %r" % zone)
+    root, ext = os.path.splitext(path)
+    return "%s-%s%s" % (root, zone, ext)
+
+
+@contextlib.contextmanager
+def settingslock(zone=None):
+    """
+    Hold an exclusive lock on a zone's control file for a read-modify-write.
+    Continues unlocked if the lock file cannot be opened.
+    """
+    lockfile = zonepath(LOCK_FILE, zone)
+    try:
+        fd = os.open(lockfile, os.O_RDWR | os.O_CREAT, 0666)
+    except OSError:
+        print "Error opening lock file %s" % lockfile
+        yield
+        return
+    try:
+        try:
+            os.fchmod(fd, 0666)
+        except OSError:
+            pass
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class ZoneFiles(object):
+    """The status and control files of one zone, and cached readers of them"""
+    def __init__(self, zone=None):
+        self.name = zone or DEFAULT_ZONE
+        self.statusfile = JSONFile(zonepath(STATUS_FILE, zone), DEFAULT_STATE)
+        self.controlfile = JSONFile(zonepath(CONTROL_FILE, zone), DEFAULT_SETTINGS)
+        self.socketfile = zonepath(heaterbroker.SOCKET_FILE, zone)
+        self.segment = heatershm.SegmentReader(zonepath(heatershm.SHM_FILE, zone))
+
+
+_zonefiles = {DEFAULT_ZONE: ZoneFiles()}
+zonesfile = JSONFile(ZONES_FILE)
+
+# Files of the default zone
+statusfile = _zonefiles[DEFAULT_ZONE].statusfile
+controlfile = _zonefiles[DEFAULT_ZONE].controlfile
+
+
+def zonefiles(zone=None):
+    """Return the ZoneFiles of zone, the default zone if it is None"""
+    zone = zone or DEFAULT_ZONE
+    files = _zonefiles.get(zone)
+    if files is None:
+        files = _zonefiles.setdefault(zone, ZoneFiles(zone))
+    return files
+
+
+def getzones():
+    """Return the names of the zones the controller runs"""
+    try:
+        zones = zonesfile.load().get('zones', [])
+    except (IOError, ValueError, AttributeError):
+        return [DEFAULT_ZONE]
+    return [str(z) for z in zones if isinstance(z, basestring) and ZONE_NAME.match(z)] or [DEFAULT_ZONE]
+
+
+def getheaterstate(zone=None):
+    """Read a zone's status, from shared memory if the controller publishes it"""
+    files = zonefiles(zone)
+    state = files.segment.readstate()
+    if state is not None:
+        return state
+    return files.statusfile.read()
+
+
+def getheatersettings(zone=None):
+    """
+    Read a zone's settings, from shared memory if the controller publishes
+    them and the control file has not been written since
+    """
+    files = zonefiles(zone)
+    # Until the controller reloads a control file written without the
+    # broker, the settings it published are out of date
+    try:
+        modified = os.stat(files.controlfile.getpath()).st_mtime
+    except OSError:
+        modified = None
+    settings = files.segment.readsettings(modified)
+    if settings is not None:
+        return settings
+    return files.controlfile.read()
+
+
+def getversionedsettings(zone=None):
+    """
+    Return a zone's settings and their version as updates are checked
+    against, from the settings broker if it is running or else the control
+    file
+    """
+    files = zonefiles(zone)
+    try:
+        return heaterbroker.getsettings(files.socketfile)
+    except heaterbroker.BrokerError:
+        pass
+    except EnvironmentError:
+        pass
+    settings = files.controlfile.read()
+    return settings, etag(settings)
+
+
+def saveheatersettings(settings, zone=None):
+    """Save settings to a zone's control file"""
+    with settingslock(zone):
+        return zonefiles(zone).controlfile.write(settings)
+
+
+def updateheatersettings(changes, version=None, zone=None):
+    """
+    Apply a partial update to a zone's settings and return the new
+    settings, None if they could not be written.
+    The update is sent to the controller's settings broker, and only written
+    to the control file directly when the broker is not running.
+    If version is given the update is only made if it matches the etag of
+    the current settings, otherwise SettingsConflict is raised.
+    changes should already have been checked with validatesettings(), the
+    controller checks them against its own limits and ValueError is raised
+    if it refuses them.
+    """
+    files = zonefiles(zone)
+    try:
+        return heaterbroker.setsettings(changes, version, files.socketfile)[0]
+    except heaterbroker.BrokerError as e:
+        if e.code == 'conflict':
+            raise SettingsConflict(version)
+        if e.code == 'invalid':
+            raise ValueError(str(e))
+        print "Settings broker refused update: %s" % e
+        return None
+    except EnvironmentError:
+        pass
+    with settingslock(zone):
+        settings = files.controlfile.read()
+        if version is not None and version != etag(settings):
+            raise SettingsConflict(version)
+        settings.update(changes)
+        if not files.controlfile.write(settings):
+            return None
+        return settings
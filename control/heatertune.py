@@ -0,0 +1,256 @@
+#!/usr/bin/python
+"""
+Tune temphyst, highlowthresh and minduration by simulating every
+combination of them at once against a model of the room
+"""
+# pylint: disable=line-too-long
+
+import argparse
+import math
+import sys
+
+import numpy
+
+import heaterarchive
+import heatersim
+import heaterstate
+
+###
+# Default search
+###
+
+# Values tried for each setting
+TEMPHYST = numpy.linspace(0.05, 1.0, 20)
+HIGHLOWTHRESH = numpy.linspace(0.25, 3.0, 12)
+MINDURATION = numpy.arange(5, 125, 5)
+
+# Days simulated for each combination
+DAYS = 2
+
+# Score added per degree of overshoot and undershoot, per heater switch a
+# day and per kWh a day; the lowest score wins
+WEIGHTS = {'overshoot': 1.0,
+           'undershoot': 1.0,
+           'switches': 0.01,
+           'energy': 0.1}
+
+###
+# End default search
+###
+
+
+def grid(temphyst=TEMPHYST, highlowthresh=HIGHLOWTHRESH, minduration=MINDURATION):
+    """Return every combination of the values as three flat arrays"""
+    h, t, m = numpy.meshgrid(temphyst, highlowthresh, minduration, indexing='ij')
+    return h.ravel(), t.ravel(), m.ravel().astype(int)
+
+
+def _gcd(values):
+    """Greatest common divisor of a list of whole numbers"""
+    result = 0
+    for v in values:
+        a, b = result, int(v)
+        while b:
+            a, b = b, a % b
+        result = a
+    return result
+
+
+def sweep(setpoint, temphyst, highlowthresh, minduration, duration, room=None,
+          elements='auto', resolution=heatersim.RESOLUTION, noise=heatersim.NOISE, seed=None):
+    """
+    Simulate the controller in auto mode for every combination in the
+    arrays temphyst, highlowthresh and minduration together.
+    The room and control logic are those of heatersim and heaterlogic,
+    computed for all combinations in each step.
+    Returns a dict of arrays like heatersim.simulate(), plus energy (kWh).
+    """
+    if room is None:
+        room = heatersim.Room(setpoint)
+    temphyst = numpy.asarray(temphyst, dtype=float)
+    highlowthresh = numpy.asarray(highlowthresh, dtype=float)
+    minduration = numpy.asarray(minduration, dtype=int)
+    count = len(temphyst)
+    rng = numpy.random.RandomState(seed)
+
+    # Every check time is a multiple of the common step
+    step = _gcd(minduration)
+    checkevery = minduration // step
+    steps = int(math.ceil(duration / float(step)))
+    decay = math.exp(-step / room.timeconstant())
+    rise = numpy.array([room.rise('off'), room.rise('low'), room.rise('high')])
+    power = numpy.array([room.power('off'), room.power('low'), room.power('high')])
+    combos = numpy.arange(count)
+
+    temp = numpy.empty(count)
+    temp.fill(room.temp)
+    # Heater state of each combination: 0 off, 1 low, 2 high
+    state = numpy.zeros(count, dtype=int)
+    heatrise = rise[state]
+    since = numpy.zeros(count)
+    switches = numpy.zeros(count, dtype=int)
+    ontime = numpy.zeros((3, count))
+    overshoot = numpy.zeros(count)
+    undershoot = numpy.zeros(count)
+    error = numpy.zeros(count)
+
+    for k in range(steps):
+        t = k * step
+        due = numpy.flatnonzero((k % checkevery) == 0)
+        if len(due):
+            reading = temp[due]
+            if noise:
+                reading = reading + rng.normal(0, noise, len(due))
+            if resolution:
+                reading = numpy.round(reading / resolution) * resolution
+            hyst = temphyst[due]
+            old = state[due]
+            if elements == 'high':
+                heat = 2
+            elif elements == 'low':
+                heat = 1
+            else:
+                heat = numpy.where((setpoint - reading) > highlowthresh[due], 2, 1)
+            below = reading < (setpoint - hyst)
+            new = numpy.where(below, heat, old)
+            new = numpy.where(~below & (reading > (setpoint + hyst)), 0, new)
+            changed = due[new != old]
+            if len(changed):
+                # On time is added up when a combination leaves a state
+                ontime[state[changed], changed] += t - since[changed]
+                since[changed] = t
+                switches[changed] += 1
+                state[due] = new
+                heatrise = rise[state]
+
+        length = min(step, duration - t)
+        before = temp
+        equilibrium = heatrise + room.outside(t + length / 2.0)
+        temp = equilibrium + (temp - equilibrium) * (decay if length == step else math.exp(-length / room.timeconstant()))
+        numpy.maximum(overshoot, temp - setpoint, overshoot)
+        numpy.maximum(undershoot, setpoint - temp, undershoot)
+        error += numpy.abs((before + temp) * 0.5 - setpoint) * length
+    ontime[state, combos] += duration - since
+
+    result = {'switches': switches, 'low': ontime[1], 'high': ontime[2],
+              'overshoot': overshoot, 'undershoot': undershoot,
+              'error': error / duration,
+              'energy': (ontime[1] * power[1] + ontime[2] * power[2]) / 3.6e6}
+    return result
+
+
+def score(results, duration, weights=None):
+    """Return the score of each combination, lower is better"""
+    if weights is None:
+        weights = WEIGHTS
+    days = duration / 86400.0
+    return (weights['overshoot'] * results['overshoot'] +
+            weights['undershoot'] * results['undershoot'] +
+            weights['switches'] * results['switches'] / days +
+            weights['energy'] * results['energy'] / days)
+
+
+def fitroom(rows, loss=heatersim.LOSS):
+    """
+    Fit the room model to recorded history, a list of (timestamp, values)
+    rows from the archive's 1 minute level, assuming a steady outside
+    temperature.
+    Returns a heatersim.Room, None if the history does not fit one.
+    """
+    names = heaterarchive.COLUMNS
+    itemp, iheat = names.index('temp'), names.index('heat')
+    x = []
+    y = []
+    for (t0, v0), (t1, v1) in zip(rows, rows[1:]):
+        if t1 - t0 != heaterarchive.BASE_STEP:
+            continue
+        if math.isnan(v0[itemp]) or math.isnan(v1[itemp]) or math.isnan(v0[iheat]):
+            continue
+        heat = v0[iheat]
+        x.append([1.0, v0[itemp], min(heat, 1.0), max(heat - 1.0, 0.0)])
+        y.append((v1[itemp] - v0[itemp]) / (t1 - t0))
+    if len(y) < 60:
+        return None
+    coeffs = numpy.linalg.lstsq(numpy.array(x), numpy.array(y), rcond=None)[0]
+    c0, c1, c2, c3 = coeffs
+    if c1 >= 0 or c2 <= 0 or c3 < 0:
+        return None
+    tau = -1.0 / c1
+    outside = -c0 / c1
+    power = {'off': 0.0, 'low': c2 * tau * loss, 'high': (c2 + c3) * tau * loss}
+    return heatersim.Room(rows[-1][1][itemp], capacity=tau * loss, loss=loss,
+                          power=power, outside=outside, swing=0)
+
+
+def recommend(settings, results, index):
+    """Return settings with the tuned values of combination index"""
+    recommended = dict(settings)
+    recommended['temphyst'] = round(float(results['temphyst'][index]), 3)
+    recommended['highlowthresh'] = round(float(results['highlowthresh'][index]), 3)
+    recommended['minduration'] = int(results['minduration'][index])
+    return recommended
+
+
+def main():
+    """Run the sweep and print the best combinations"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=float, default=DAYS, help='length of each simulation')
+    parser.add_argument('--setpoint', type=float, default=20.0)
+    parser.add_argument('--outside', type=float, default=heatersim.OUTSIDE, help='mean outside temperature')
+    parser.add_argument('--archive', nargs='?', const=heaterarchive.ARCHIVE_FILE,
+                        help='fit the room model to the history in this archive')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the sensor noise')
+    parser.add_argument('--top', type=int, default=10, help='number of combinations to list')
+    parser.add_argument('--output', help='write the recommended control file here')
+    args = parser.parse_args()
+
+    room = None
+    if args.archive:
+        archive = heaterarchive.openarchive(args.archive)
+        if archive is None:
+            print "Unable to open archive %s" % args.archive
+            return 1
+        level = heaterarchive.getlevel('1m')
+        rows = archive.fetch(level, 0, archive.nextupdate(level) or 0)
+        room = fitroom(rows)
+        if room is None:
+            print "Not enough history to fit the room model, using the default"
+        else:
+            print "Fitted room: time constant %.1f hours, outside %.1fC, low +%.1fC, high +%.1fC" % (
+                room.timeconstant() / 3600, room.outside(0), room.rise('low'), room.rise('high'))
+            room.temp = args.setpoint
+    if room is None:
+        room = heatersim.Room(args.setpoint, outside=args.outside)
+
+    temphyst, highlowthresh, minduration = grid()
+    duration = args.days * 86400
+    results = sweep(args.setpoint, temphyst, highlowthresh, minduration, duration, room, seed=args.seed)
+    results['temphyst'] = temphyst
+    results['highlowthresh'] = highlowthresh
+    results['minduration'] = minduration
+    scores = score(results, duration)
+    order = numpy.argsort(scores)
+
+    print "Simulated %d combinations for %.1f days each" % (len(scores), args.days)
+    print "temphyst highlowthresh minduration  score  over under switches/day kWh/day"
+    for i in order[:args.top]:
+        print "%8.2f %13.2f %11d %6.3f %5.2f %5.2f %12.0f %7.1f" % (
+            temphyst[i], highlowthresh[i], minduration[i], scores[i],
+            results['overshoot'][i], results['undershoot'][i],
+            results['switches'][i] / args.days, results['energy'][i] / args.days)
+
+    settings = heaterstate.DEFAULT_SETTINGS
+    try:
+        settings = heaterstate.controlfile.load()
+    except (IOError, ValueError):
+        pass
+    recommended = recommend(settings, results, order[0])
+    print "Recommended: temphyst %(temphyst)g, highlowthresh %(highlowthresh)g, minduration %(minduration)d" % recommended
+    if args.output:
+        if not heaterstate.writejson(args.output, recommended):
+            print "Error writing %s" % args.output
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
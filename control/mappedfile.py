@@ -0,0 +1,46 @@
+#!/usr/bin/python
+"""
+Readers of memory mapped files the controller recreates, such as the
+shared memory segment and the history archive
+"""
+
+import os
+
+
+def openmapped(opener, path):
+    """Return opener(path), None if the file is missing or unusable"""
+    try:
+        return opener(path)
+    except (EnvironmentError, ValueError):
+        return None
+
+
+class MappedFileReader(object):
+    """
+    Keep a file open for reading with opener, reopening it if it is
+    recreated with a new inode
+    """
+    def __init__(self, path, opener):
+        self.__path = path
+        self.__opener = opener
+        self.__mapped = None
+        self.__ino = None
+
+    def getpath(self):
+        """Returns filesystem path of the file"""
+        return self.__path
+
+    def get(self):
+        """Return the open file, None if there is none usable"""
+        try:
+            ino = os.stat(self.__path).st_ino
+        except OSError:
+            ino = None
+        if ino != self.__ino or self.__mapped is None:
+            # The old mapping is left for the garbage collector, another
+            # thread may still be reading it
+            self.__ino = ino
+            self.__mapped = None
+            if ino is not None:
+                self.__mapped = openmapped(self.__opener, self.__path)
+        return self.__mapped
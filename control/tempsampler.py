@@ -0,0 +1,119 @@
+#!/usr/bin/python
+"""Background temperature sampling with a sliding median filter"""
+
+import bisect
+import collections
+import threading
+
+import eventloop
+import w1therm
+
+
+class MedianWindow(object):
+    """Sliding window of the most recent readings with a running median"""
+    def __init__(self, size):
+        self.__size = size
+        self.__ring = collections.deque()
+        self.__sorted = []
+
+    def add(self, value):
+        """Add a reading, dropping the oldest one if the window is full"""
+        if len(self.__ring) == self.__size:
+            old = self.__ring.popleft()
+            del self.__sorted[bisect.bisect_left(self.__sorted, old)]
+        self.__ring.append(value)
+        bisect.insort(self.__sorted, value)
+
+    def median(self):
+        """Return the median of the window, None if it is empty"""
+        if len(self.__sorted) == 0:
+            return None
+        return self.__sorted[len(self.__sorted) / 2]
+
+    def clear(self):
+        """Discard all readings"""
+        self.__ring.clear()
+        self.__sorted = []
+
+    def __len__(self):
+        return len(self.__ring)
+
+
+class TempSampler(threading.Thread):
+    """
+    Read a list of sensors at a fixed interval in the background and keep a
+    median filtered temperature available without blocking.
+    callback, if given, is called from the sampling thread after every
+    reading with the filtered temperature and the per-sensor readings.
+    """
+    def __init__(self, sensors, interval=1.0, window=9, maxage=None,
+                 parallel=True, callback=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.__sensors = list(sensors)
+        self.__interval = interval
+        self.__window = MedianWindow(window)
+        self.__parallel = parallel
+        self.__callback = callback
+        if maxage is None:
+            maxage = interval * window * 2
+        self.__maxage = maxage
+        self.__lock = threading.Lock()
+        self.__ready = threading.Event()
+        self.__stop = threading.Event()
+        self.__median = None
+        self.__lastgood = None
+
+    def setsensors(self, sensors):
+        """Read sensors from the next reading on"""
+        with self.__lock:
+            self.__sensors = list(sensors)
+
+    def getsensors(self):
+        """Return the sensors being read"""
+        with self.__lock:
+            return list(self.__sensors)
+
+    def sample(self):
+        """Take one reading from every sensor and update the filter"""
+        temps, average = w1therm.readtemps(self.getsensors(),
+                                           parallel=self.__parallel)
+        with self.__lock:
+            if average is not None:
+                self.__window.add(average)
+                self.__median = self.__window.median()
+                self.__lastgood = eventloop.monotonic()
+        if average is not None:
+            self.__ready.set()
+        if self.__callback is not None:
+            self.__callback(self.gettemp(), temps)
+        return average
+
+    def run(self):
+        """Sampling loop"""
+        while not self.__stop.is_set():
+            start = eventloop.monotonic()
+            if self.sample() is None:
+                print "Error getting temperature from all sensors"
+            delay = self.__interval - (eventloop.monotonic() - start)
+            if delay > 0:
+                self.__stop.wait(delay)
+
+    def stop(self):
+        """Ask the sampling loop to finish"""
+        self.__stop.set()
+
+    def wait(self, timeout=None):
+        """Wait until the first good reading is available"""
+        self.__ready.wait(timeout)
+        return self.__ready.is_set()
+
+    def gettemp(self):
+        """
+        Return the median filtered temperature, None if there has been no
+        good reading within maxage seconds
+        """
+        with self.__lock:
+            if self.__lastgood is None or (eventloop.monotonic() - self.__lastgood) > self.__maxage:
+                return None
+            return self.__median
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+"""Tests of the GPIO backends that need no hardware"""
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import types
+import unittest
+
+import gpio
+
+
+class FakeBackendTest(unittest.TestCase):
+    """Writes through Backend.write() to the in-memory backend"""
+    def setUp(self):
+        self.pins = gpio.FakeBackend()
+        self.pins.setoutputs([4, 5])
+
+    def test_pins_written_together(self):
+        self.assertTrue(self.pins.write([(4, True), (5, True)]))
+        self.assertEqual(self.pins.writes, [[(4, 1), (5, 1)]])
+        self.assertEqual((self.pins.value(4), self.pins.value(5)), (1, 1))
+
+    def test_unchanged_pins_skipped(self):
+        self.pins.write([(4, True), (5, False)])
+        self.assertFalse(self.pins.write([(4, 1), (5, 0)]))
+        self.pins.write([(4, True), (5, True)])
+        self.assertEqual(self.pins.writes, [[(4, 1)], [(5, 1)]])
+
+    def test_ordered(self):
+        changes = [(4, 1), (5, 0), (6, 1), (7, 0)]
+        self.assertEqual(gpio.ordered(changes), [(7, 0), (5, 0), (4, 1), (6, 1)])
+
+    def test_watch(self):
+        edges = []
+        self.pins.watch(23, edges.append, pullup=True)
+        self.assertEqual(self.pins.read(23), 1)
+        self.pins.setinput(23, 0)
+        self.pins.setinput(23, 0)
+        self.pins.setinput(23, 1)
+        self.assertEqual(edges, [23, 23])
+
+
+class WiringPiMaskedTest(unittest.TestCase):
+    """
+    The wiringpi backend's register writes, with a stand in for the
+    wiringpi module and a file in place of /dev/gpiomem
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.gpiomem = os.path.join(self.tmpdir, 'gpiomem')
+        fd = open(self.gpiomem, 'wb')
+        fd.write('\0' * 4096)
+        fd.close()
+        self.calls = []
+        wiringpi = types.ModuleType('wiringpi')
+        wiringpi.wiringPiSetup = lambda: None
+        wiringpi.pinMode = lambda pin, mode: None
+        wiringpi.digitalWrite = lambda pin, value: self.calls.append((pin, value))
+        # wiringPi pin n is BCM pin n + 20, putting pin 12 in the second bank
+        wiringpi.wpiPinToGpio = lambda pin: pin + 20
+        self.saved = (sys.modules.get('wiringpi'), gpio.GPIOMEM_FILE)
+        sys.modules['wiringpi'] = wiringpi
+        gpio.GPIOMEM_FILE = self.gpiomem
+
+    def tearDown(self):
+        module, gpio.GPIOMEM_FILE = self.saved
+        if module is None:
+            del sys.modules['wiringpi']
+        else:
+            sys.modules['wiringpi'] = module
+        shutil.rmtree(self.tmpdir)
+
+    def registers(self):
+        """Return the words last stored in GPSET and GPCLR, by bank"""
+        fd = open(self.gpiomem, 'rb')
+        data = fd.read()
+        fd.close()
+        return ([struct.unpack_from('<I', data, offset)[0] for offset in gpio.GPSET],
+                [struct.unpack_from('<I', data, offset)[0] for offset in gpio.GPCLR])
+
+    def test_masked_write(self):
+        pins = gpio.WiringPiBackend()
+        pins.setoutputs([4, 5, 12])
+        del self.calls[:]
+        pins.write([(4, True), (5, True), (12, True)])
+        pins.close()
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.registers()[0], [(1 << 24) | (1 << 25), 1 << 0])
+
+    def test_masked_clear(self):
+        pins = gpio.WiringPiBackend()
+        pins.setoutputs([4, 5])
+        pins.write([(4, True), (5, True)])
+        pins.write([(4, False), (5, False)])
+        pins.close()
+        self.assertEqual(self.registers()[1], [(1 << 24) | (1 << 25), 0])
+
+    def test_fallback_order(self):
+        gpio.GPIOMEM_FILE = os.path.join(self.tmpdir, 'missing')
+        pins = gpio.WiringPiBackend()
+        pins.setoutputs([4, 5])
+        pins.write([(4, True), (5, True)])
+        pins.write([(4, False), (5, False)])
+        self.assertEqual(self.calls[-4:], [(4, 1), (5, 1), (5, 0), (4, 0)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+"""Tests of the settings broker over a socket in a temporary directory"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import heaterbroker
+
+
+class BrokerTest(unittest.TestCase):
+    """Requests made by clients and answered by the owner's process() calls"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'heater-control.sock')
+        self.woken = threading.Event()
+        self.broker = heaterbroker.Broker(self.path, self.woken.set)
+        self.broker.publish({'setpoint': 20.0}, '1')
+
+    def tearDown(self):
+        self.broker.close()
+        shutil.rmtree(self.tmpdir)
+
+    def setlater(self, changes):
+        """Send a set request from another thread, return its result list"""
+        result = []
+
+        def send():
+            """Store the new settings or the error"""
+            try:
+                result.append(heaterbroker.setsettings(changes, path=self.path))
+            except heaterbroker.BrokerError as e:
+                result.append(e)
+
+        thread = threading.Thread(target=send)
+        thread.daemon = True
+        thread.start()
+        self.assertTrue(self.woken.wait(5))
+        return thread, result
+
+    @staticmethod
+    def apply(changes, version):
+        """Accept setpoints, refuse anything else"""
+        if 'setpoint' not in changes:
+            raise heaterbroker.BrokerError('invalid', 'No setpoint')
+        return changes, str(int(version or 1) + 1)
+
+    def test_get(self):
+        self.assertEqual(heaterbroker.getsettings(self.path), ({'setpoint': 20.0}, '1'))
+
+    def test_set_applied(self):
+        thread, result = self.setlater({'setpoint': 21.0})
+        self.assertTrue(self.broker.process(self.apply))
+        thread.join(5)
+        self.assertEqual(result, [({'setpoint': 21.0}, '2')])
+
+    def test_set_refused(self):
+        thread, result = self.setlater({'run': 'off'})
+        self.assertFalse(self.broker.process(self.apply))
+        thread.join(5)
+        self.assertEqual(result[0].code, 'invalid')
+
+    def test_close_answers_queued_sets(self):
+        thread, result = self.setlater({'setpoint': 21.0})
+        # The request is queued before the owner is woken
+        time.sleep(0.1)
+        self.broker.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(result[0].code, 'error')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/usr/bin/python
+"""Tests of the controller's heater switching on the fake GPIO backend"""
+
+import unittest
+
+import gpio
+import heatercontrol
+
+LOW = 4
+HIGH = 5
+
+
+class HeaterTest(unittest.TestCase):
+    """Heater.setstate() writes both element pins at once"""
+    def setUp(self):
+        self.pins = gpio.FakeBackend()
+        self.heater = heatercontrol.Heater(self.pins, LOW, HIGH)
+
+    def test_states(self):
+        self.heater.setstate('high')
+        self.assertEqual((self.pins.pins[LOW], self.pins.pins[HIGH]), (1, 1))
+        self.heater.setstate('low')
+        self.assertEqual((self.pins.pins[LOW], self.pins.pins[HIGH]), (1, 0))
+        self.heater.setstate('off')
+        self.assertEqual((self.pins.pins[LOW], self.pins.pins[HIGH]), (0, 0))
+        self.assertEqual(self.heater.getstate(), 'off')
+
+    def test_both_pins_in_one_write(self):
+        self.heater.setstate('high')
+        self.heater.setstate('off')
+        self.assertEqual(self.pins.writes, [[(LOW, 1), (HIGH, 1)], [(LOW, 0), (HIGH, 0)]])
+
+    def test_redundant_writes_skipped(self):
+        self.heater.setstate('low')
+        self.heater.setstate('low')
+        self.heater.setstate('lo')
+        self.heater.setstate('high')
+        self.heater.setstate('on')
+        self.assertEqual(self.pins.writes, [[(LOW, 1)], [(HIGH, 1)]])
+
+    def test_unknown_state_ignored(self):
+        self.heater.setstate('warm')
+        self.assertEqual(self.heater.getstate(), 'off')
+        self.assertEqual(self.pins.writes, [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+"""Tests of reading 1-wire sensors from a fake sysfs tree"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import w1therm
+
+# A sensor with the temperature attribute of newer kernels
+FAST = '28-000000000001'
+# A sensor with only w1_slave, as on older kernels
+SLOW = '28-000000000002'
+# A sensor which is not present
+MISSING = '28-000000000003'
+
+W1_SLAVE = "72 01 4b 46 7f ff 0e 10 57 : crc=57 %s\n72 01 4b 46 7f ff 0e 10 57 t=%d\n"
+
+
+class W1ThermTest(unittest.TestCase):
+    """Sensors linked from a devices directory to their bus master's, as in sysfs"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.master = os.path.join(self.tmpdir, 'w1_bus_master1')
+        self.root = os.path.join(self.tmpdir, 'devices')
+        os.mkdir(self.master)
+        os.mkdir(self.root)
+        self.write(os.path.join(self.master, 'therm_bulk_read'), '')
+        for sensorid in (FAST, SLOW):
+            os.mkdir(os.path.join(self.master, sensorid))
+            os.symlink(os.path.join(self.master, sensorid), os.path.join(self.root, sensorid))
+        self.write(os.path.join(self.master, FAST, 'temperature'), '21500\n')
+        self.write(os.path.join(self.master, FAST, 'w1_slave'), W1_SLAVE % ('YES', 85000))
+        self.write(os.path.join(self.master, SLOW, 'w1_slave'), W1_SLAVE % ('YES', 23125))
+        self.saved = (w1therm.RETRY_DELAY, w1therm.BULK_WINDOW)
+        w1therm.RETRY_DELAY = 0
+        w1therm._bulktimes.clear()  # pylint: disable=protected-access
+
+    def tearDown(self):
+        w1therm.RETRY_DELAY, w1therm.BULK_WINDOW = self.saved
+        w1therm._bulktimes.clear()  # pylint: disable=protected-access
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def write(path, data):
+        """Write data to path"""
+        fd = open(path, 'w')
+        fd.write(data)
+        fd.close()
+
+    def triggered(self):
+        """Return what was written to therm_bulk_read, and empty it"""
+        path = os.path.join(self.master, 'therm_bulk_read')
+        fd = open(path)
+        data = fd.read()
+        fd.close()
+        self.write(path, '')
+        return data
+
+    def sensor(self, sensorid):
+        """Return the sensor sensorid in the fake tree"""
+        return w1therm.OWTemp(sensorid, root=self.root)
+
+    def test_temperature_attribute_used(self):
+        sensor = self.sensor(FAST)
+        self.assertTrue(sensor.update())
+        self.assertEqual(sensor.gettemp(), 21.5)
+
+    def test_w1_slave_fallback(self):
+        sensor = self.sensor(SLOW)
+        self.assertTrue(sensor.update())
+        self.assertEqual(sensor.gettemp(), 23.125)
+        self.assertEqual(sensor.getresolution(), 12)
+
+    def test_bad_crc_fails(self):
+        self.write(os.path.join(self.master, SLOW, 'w1_slave'), W1_SLAVE % ('NO', 23125))
+        self.assertFalse(self.sensor(SLOW).update())
+
+    def test_missing_sensor_fails(self):
+        self.assertFalse(self.sensor(MISSING).update())
+
+    def test_readtemps(self):
+        sensors = [self.sensor(s) for s in (FAST, SLOW, MISSING)]
+        results, average = w1therm.readtemps(sensors)
+        self.assertEqual(results, {FAST: 21.5, SLOW: 23.125, MISSING: None})
+        self.assertEqual(average, (21.5 + 23.125) / 2)
+        self.assertEqual(self.triggered(), 'trigger\n')
+
+    def test_readtemps_all_failed(self):
+        self.assertEqual(w1therm.readtemps([self.sensor(MISSING)]), ({MISSING: None}, None))
+
+    def test_bulk_triggered_once_per_window(self):
+        first = [self.sensor(FAST)]
+        second = [self.sensor(SLOW)]
+        self.assertEqual(w1therm.bulkconvert(first), [self.master])
+        self.assertEqual(self.triggered(), 'trigger\n')
+        # Another zone's sampler on the same bus uses the same conversion
+        self.assertEqual(w1therm.bulkconvert(second), [self.master])
+        self.assertEqual(self.triggered(), '')
+        w1therm.BULK_WINDOW = 0
+        w1therm.bulkconvert(second)
+        self.assertEqual(self.triggered(), 'trigger\n')
+
+    def test_read_threads_kept(self):
+        sensors = [self.sensor(s) for s in (FAST, SLOW)]
+        readers = set()
+        for sensor in sensors:
+            sensor.update = lambda: readers.add(threading.current_thread()) is None
+        for _ in range(w1therm.READ_THREADS):
+            w1therm.readtemps(sensors)
+        self.assertTrue(len(readers) <= w1therm.READ_THREADS)
+
+    def test_failed_read_reported(self):
+        broken = self.sensor(SLOW)
+        broken.update = lambda: 1 / 0
+        results, average = w1therm.readtemps([self.sensor(FAST), broken])
+        self.assertEqual(results, {FAST: 21.5, SLOW: None})
+        self.assertEqual(average, 21.5)
+
+    def test_no_bulk(self):
+        w1therm.readtemps([self.sensor(FAST)], bulk=False)
+        self.assertEqual(self.triggered(), '')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,20 +1,129 @@
 #!/usr/bin/python
 """1-wire Temperature Sensor support"""
 
+import errno
+import os
 import random
+import threading
 import time
 
+from concurrent import futures
+
+import eventloop
+import heatermetrics
+
+# Directory the 1-wire devices appear in, changed to use a fake tree
+W1_ROOT = '/sys/bus/w1/devices'
+
+# Family codes, the start of each device ID, of the temperature sensors
+# the w1_therm driver supports
+FAMILIES = {'10': 'DS18S20', '22': 'DS1822', '28': 'DS18B20', '3b': 'DS1825', '42': 'DS28EA00'}
+
+# Seconds a listing of the devices is used before they are listed again
+SCAN_INTERVAL = 30
+
+# Start the conversions of every sensor on a bus at once before reading them,
+# where the bus master supports it
+BULK_READ = True
+
+# Conversion time of a DS18B20 at each resolution in bits (seconds)
+CONVERSION_TIME = {9: 0.09375, 10: 0.1875, 11: 0.375, 12: 0.75}
+
+# Seconds after a bus-wide conversion is started during which other readers
+# of the bus, eg the samplers of other zones, read its results rather than
+# starting another over it; a little longer than the slowest conversion
+BULK_WINDOW = 0.9
+
+# Most sensors read at once, by threads kept from one reading to the next
+READ_THREADS = 16
+
+# Attempts at reading a sensor before an update fails
+READ_ATTEMPTS = 4
+
+# Seconds before the first retry of a read, doubled for each one after it
+RETRY_DELAY = 0.05
+
+# Consecutive failed updates after which a sensor is quarantined
+QUARANTINE_FAILURES = 3
+
+# Seconds a sensor is first quarantined for, doubled each time it fails
+# again as soon as it is let back, up to QUARANTINE_MAX
+QUARANTINE_TIME = 30
+QUARANTINE_MAX = 960
+
+
+# When each bus master last started a conversion, shared by every reader
+_bulktimes = dict()
+_bulklock = threading.Lock()
+
+# Threads reading sensors, started when first needed
+_readpool = [None]
+_readpoollock = threading.Lock()
+
 
 class OWTemp(object):
-    """Represents a 1-wire temperature sensor and access"""
-    def __init__(self, sensorid, dummy=False):
+    """
+    Represents a 1-wire temperature sensor and access.
+    A sensor whose updates keep failing is quarantined for a while, during
+    which updates fail at once without reading it.
+    """
+    def __init__(self, sensorid, dummy=False, resolution=None, root=None, alias=None, offset=0.0):
         self.__sensorid = sensorid
-        self.__path = '/sys/bus/w1/devices/%s/w1_slave' % sensorid
-        self.__lastcheck = 0.0
+        self.__alias = alias
+        self.__offset = offset
+        self.__device = os.path.join(root or W1_ROOT, sensorid)
+        self.__path = os.path.join(self.__device, 'w1_slave')
+        # Whether the kernel has the temperature attribute, None until known
+        self.__fast = None
+        self.__lastcheck = None
         self.__temp = 999.99
         self.__defaultunit = 'C'
         self.__registers = [0, 0, 0, 0, 0, 255, 0, 16, 0]
         self.__dummy = dummy
+        self.__failures = 0
+        self.__quarantine = QUARANTINE_TIME
+        self.__quarantineend = 0.0
+        if resolution is not None and not dummy:
+            self.setresolution(resolution)
+
+    def setresolution(self, bits):
+        """
+        Set the resolution of the sensor, 9 to 12 bits, trading precision
+        for conversion time. Returns True if it was set.
+        """
+        if bits not in CONVERSION_TIME:
+            raise ValueError("Resolution must be 9 to 12 bits: %r" % bits)
+        # Newer kernels have a resolution attribute, older ones take the
+        # resolution written to w1_slave
+        for path in (os.path.join(self.__device, 'resolution'), self.__path):
+            try:
+                fd = open(path, "w")
+                fd.write("%d\n" % bits)
+                fd.close()
+                return True
+            except IOError:
+                continue
+        print "Unable to set resolution of sensor %s" % self.__sensorid
+        return False
+
+    def getresolution(self):
+        """Return the resolution of the sensor in bits, None if unknown"""
+        try:
+            fd = open(os.path.join(self.__device, 'resolution'), "r")
+            bits = int(fd.read())
+            fd.close()
+        except (IOError, ValueError):
+            # The configuration register holds it as its bits 5 and 6
+            bits = 9 + ((self.__registers[4] >> 5) & 3)
+        return bits
+
+    def getmaster(self):
+        """Return the directory of the bus master the sensor is on"""
+        return os.path.dirname(os.path.realpath(self.__device))
+
+    def isquarantined(self):
+        """Return True if the sensor is not being read for now"""
+        return eventloop.monotonic() < self.__quarantineend
 
     def get_raw(self):
         """Get raw data from 1-wire data file"""
@@ -30,54 +139,249 @@ class OWTemp(object):
         """Update temperature"""
         if self.__dummy:
             self.__temp = 16 + (random.random() * 10)
+            self.__lastcheck = eventloop.monotonic()
             return True
-        lines = None
-        retries = 10
-        success = False
-        while not success:
-            retries = retries - 1
-            if retries == 0:
-                return False
-            lines = self.get_raw()
-            if lines is None or len(lines) < 2:
-                print "Output too short"
-                time.sleep(0.2)
-                continue
-            if lines[0].split()[-1] != 'YES':
-                print "Bad CRC"
-                time.sleep(0.2)
-                continue
-            regs = []
-            for reg in lines[1].split()[0:9]:
-                regs.append(int(reg, 16))
-            t = lines[1].split('=')
-            if t is None or len(t) > 2:
-                print "Unable to split out temp"
-                time.sleep(0.2)
-                continue
-            success = True
+        if self.isquarantined():
+            return False
+        labels = {'sensor': self.__sensorid}
+        with heatermetrics.registry.time('heater_sensor_read_seconds', labels):
+            success = self.__read()
+        if success:
+            self.__failures = 0
+            self.__quarantine = QUARANTINE_TIME
+            return True
+        heatermetrics.registry.inc('heater_sensor_failures_total', labels)
+        self.__failures += 1
+        if self.__failures >= QUARANTINE_FAILURES:
+            print "Quarantining sensor %s for %d seconds" % (self.__sensorid, self.__quarantine)
+            heatermetrics.registry.inc('heater_sensor_quarantines_total', labels)
+            self.__quarantineend = eventloop.monotonic() + self.__quarantine
+            self.__quarantine = min(self.__quarantine * 2, QUARANTINE_MAX)
+            # One more failure once let back quarantines it again
+            self.__failures = QUARANTINE_FAILURES - 1
+        return False
+
+    def __retry(self, reason, attempt):
+        """Count a read to be retried and back off before retrying it"""
+        heatermetrics.registry.inc('heater_sensor_retries_total', {'sensor': self.__sensorid, 'reason': reason})
+        time.sleep(RETRY_DELAY * (2 ** attempt))
+
+    def __read(self):
+        """Read the sensor, retrying failed reads"""
+        if self.__fast is None and os.path.isdir(self.__device):
+            # Older kernels have no temperature attribute, use w1_slave there
+            self.__fast = os.path.exists(os.path.join(self.__device, 'temperature'))
+        reason = None
+        for attempt in range(READ_ATTEMPTS):
+            if attempt > 0:
+                self.__retry(reason, attempt - 1)
+            if self.__fast is False:
+                reason = self.__readslave()
+            else:
+                reason = self.__readfast()
+            if reason is None:
+                return True
+        return False
+
+    def __readslave(self):
+        """
+        Read and parse w1_slave
+        Returns None on success or else the reason to retry
+        """
+        lines = self.get_raw()
+        if lines is None or len(lines) < 2:
+            print "Output too short"
+            return 'short'
+        if lines[0].split()[-1] != 'YES':
+            print "Bad CRC"
+            return 'crc'
+        t = lines[1].split('=')
+        try:
+            regs = [int(reg, 16) for reg in lines[1].split()[0:9]]
+            if len(t) != 2:
+                raise ValueError
+            temp = float(t[1]) / 1000.00
+        except ValueError:
+            print "Unable to split out temp"
+            return 'parse'
         self.__registers = regs
-        self.__temp = float(t[1]) / 1000.00
-        # print "Temperature: %f" % self.__temp
-        return True
+        self.__temp = temp
+        self.__lastcheck = eventloop.monotonic()
+        return None
+
+    def __readfast(self):
+        """
+        Read the temperature attribute of newer kernels, which are checked
+        by the kernel and need no parsing
+        Returns None on success or else the reason to retry
+        """
+        try:
+            fd = open(os.path.join(self.__device, 'temperature'), "r")
+            try:
+                value = fd.read()
+            finally:
+                fd.close()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return 'short'
+            print "Unable to read temperature"
+            return 'crc'
+        try:
+            self.__temp = int(value) / 1000.0
+        except ValueError:
+            print "Unable to parse temperature"
+            return 'parse'
+        self.__lastcheck = eventloop.monotonic()
+        return None
 
     def getid(self):
         """Returns 1-wire ID for this sensor"""
         return self.__sensorid
 
+    def getname(self):
+        """Returns the alias of this sensor, or its ID if it has none"""
+        return self.__alias or self.__sensorid
+
+    def isdummy(self):
+        """Return True if the sensor makes up its readings"""
+        return self.__dummy
+
     def getpath(self):
         """Returns filesystem path used to access sensor"""
         return self.__path
 
     def gettemp(self, unit=None):
         """Return temperture"""
-        if (time.time() - self.__lastcheck) > 0.5:
+        if self.__lastcheck is None or (eventloop.monotonic() - self.__lastcheck) > 0.5:
             self.update()
         if unit is None:
             unit = self.__defaultunit.upper()
+        # The calibration offset is in C
+        temp = self.__temp + self.__offset
         if str(unit).upper() == 'C':
-            return self.__temp
+            return temp
         elif str(unit).upper() == 'F':
-            return self.__temp * 9.0 / 5.0 + 32.0
+            return temp * 9.0 / 5.0 + 32.0
         else:
             return None
+
+
+def family(sensorid):
+    """Return the family code of a device ID, None if it has none"""
+    if '-' not in sensorid:
+        return None
+    return sensorid.split('-', 1)[0].lower()
+
+
+def discover(root=None, families=None):
+    """Return the IDs of the temperature sensors present, sorted"""
+    if families is None:
+        families = FAMILIES
+    try:
+        names = os.listdir(root or W1_ROOT)
+    except OSError:
+        return []
+    return sorted(n for n in names if family(n) in families)
+
+
+class SensorDirectory(object):
+    """
+    The temperature sensors present, from a listing of the devices which
+    is kept for interval seconds. sysfs does not report new devices to
+    inotify, so sensors added or removed are found when the listing is
+    refreshed.
+    """
+    def __init__(self, root=None, families=None, interval=SCAN_INTERVAL):
+        self.__root = root
+        self.__families = families
+        self.__interval = interval
+        self.__ids = []
+        self.__listed = None
+
+    def sensors(self):
+        """Return the IDs of the sensors, listing them if the listing is old"""
+        if self.__listed is None or eventloop.monotonic() - self.__listed >= self.__interval:
+            self.refresh()
+        return list(self.__ids)
+
+    def refresh(self):
+        """List the sensors now, return the IDs added and removed"""
+        ids = discover(self.__root, self.__families)
+        added = [i for i in ids if i not in self.__ids]
+        removed = [i for i in self.__ids if i not in ids]
+        self.__ids = ids
+        self.__listed = eventloop.monotonic()
+        return added, removed
+
+
+def bulkconvert(sensorlist):
+    """
+    Start a conversion on every sensor of the buses the sensors are on, so
+    reading them afterwards waits for one conversion rather than one each.
+    A bus whose conversion was started within BULK_WINDOW is left alone.
+    Returns the bus masters with a conversion started
+    """
+    masters = set(s.getmaster() for s in sensorlist if not s.isquarantined())
+    started = []
+    with _bulklock:
+        now = eventloop.monotonic()
+        for master in masters:
+            last = _bulktimes.get(master)
+            if last is not None and now - last < BULK_WINDOW:
+                started.append(master)
+                continue
+            try:
+                fd = open(os.path.join(master, 'therm_bulk_read'), "w")
+                fd.write("trigger\n")
+                fd.close()
+            except IOError:
+                continue
+            _bulktimes[master] = now
+            started.append(master)
+    return started
+
+
+def readpool():
+    """Return the pool of threads sensors are read by"""
+    with _readpoollock:
+        if _readpool[0] is None:
+            _readpool[0] = futures.ThreadPoolExecutor(READ_THREADS)
+        return _readpool[0]
+
+
+def readtemps(sensorlist, unit=None, parallel=True, bulk=None):
+    """
+    Read every sensor in sensorlist, concurrently unless parallel is False,
+    after starting all their conversions at once unless bulk is False
+    Return a dict of sensor id to temperature (None for failed reads) and the
+    average of the successful reads (None if every read failed)
+    """
+    results = dict()
+    if bulk is None:
+        bulk = BULK_READ
+    if bulk:
+        bulkconvert([s for s in sensorlist if not s.isdummy()])
+
+    def read(sensor):
+        """Update a single sensor and store its result"""
+        if sensor.update():
+            results[sensor.getid()] = sensor.gettemp(unit)
+        else:
+            results[sensor.getid()] = None
+
+    if parallel and len(sensorlist) > 1:
+        pending = [(s, readpool().submit(read, s)) for s in sensorlist]
+        for s, f in pending:
+            if f.exception() is not None:
+                print "Unable to read sensor %s: %s" % (s.getid(), f.exception())
+                results[s.getid()] = None
+    else:
+        for s in sensorlist:
+            read(s)
+
+    temps = [t for t in results.values() if t is not None]
+    if len(temps) > 0:
+        average = float(sum(temps)) / len(temps)
+    else:
+        average = None
+    return results, average
@@ -2,13 +2,23 @@
 """Heater control main application"""
 # pylint: disable=line-too-long
 
-import json
-import wiringpi
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'control'))
+import eventloop  # noqa pylint: disable=wrong-import-position
+import filewatch  # noqa pylint: disable=wrong-import-position
+import gpio  # noqa pylint: disable=wrong-import-position
+import heaterstate  # noqa pylint: disable=wrong-import-position
 
 ###
 # System configuration
 ###
 
+# How the GPIO pins are driven: wiringpi, chardev or fake, see gpio.py.
+# Pins are numbered as the backend numbers them
+GPIO_BACKEND = gpio.DEFAULT_BACKEND
+
 # GPIO pin for ON button
 GPIO_BTN_ON = 23
 
@@ -19,119 +29,163 @@ GPIO_BTN_OFF = 21
 GPIO_LED_ONOFF = 29
 
 # Path to status file
-STATUS_FILE = '/dev/shm/heater-status'
+STATUS_FILE = heaterstate.STATUS_FILE
 
 # Path to control file
-CONTROL_FILE = '/dev/shm/heater-control'
+CONTROL_FILE = heaterstate.CONTROL_FILE
+
+# Seconds between checks of the status and control files when inotify is
+# unavailable
+WATCH_INTERVAL = 0.5
+
+# Seconds a button must be steady for a change to count
+DEBOUNCE = 0.03
 
-# Group and permissions for the control file
-CONTROL_GROUP = 'www-data'
-CONTROL_PERMS = 0666
+# LED patterns, lists of (value, seconds) steps repeated in turn, a step of
+# None seconds is held until the pattern changes
+LED_OFF = [(0, None)]
+LED_ON = [(1, None)]
+
+# Patterns while the heater has not yet followed the buttons
+LED_TURNING_OFF = [(1, 0.2), (0, 0.8)]
+LED_TURNING_ON = [(1, 0.6), (0, 0.4)]
 
 ###
 # End system configuration
 ###
 
 
+class Button(object):
+    """
+    A push button to ground on a pulled up input, calling callback when it
+    is pressed. Edges start a debounce timer on the loop and the pin is read
+    once it has been steady for DEBOUNCE seconds.
+    """
+    def __init__(self, loop, pins, pin, callback):
+        self.__loop = loop
+        self.__pins = pins
+        self.__pin = pin
+        self.__callback = callback
+        self.__timer = None
+        self.__value = 1
+        pins.watch(pin, self.__edge, pullup=True)
+
+    def __edge(self, pin):  # pylint: disable=unused-argument
+        """Called by the GPIO backend from its own thread"""
+        self.__loop.call_soon_threadsafe(self.__bounce)
+
+    def __bounce(self):
+        """Restart the debounce timer"""
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.__timer = self.__loop.call_later(DEBOUNCE, self.__settled)
+
+    def __settled(self):
+        """Act on the settled value of the pin"""
+        self.__timer = None
+        value = self.__pins.read(self.__pin)
+        if value != self.__value:
+            self.__value = value
+            if value == 0:
+                self.__callback()
+
+
+class LED(object):
+    """An LED following a pattern, stepped by timers on the loop"""
+    def __init__(self, loop, pins, pin):
+        self.__loop = loop
+        self.__pins = pins
+        self.__pin = pin
+        self.__pattern = None
+        self.__timer = None
+        pins.setoutputs([pin])
+
+    def setpattern(self, pattern):
+        """Start showing pattern, unless it is already shown"""
+        if pattern == self.__pattern:
+            return
+        self.__pattern = pattern
+        if self.__timer is not None:
+            self.__timer.cancel()
+        self.__step(0)
+
+    def __step(self, index):
+        """Show step index of the pattern and time the next one"""
+        value, seconds = self.__pattern[index]
+        self.__pins.write([(self.__pin, value)])
+        self.__timer = None
+        if seconds is not None:
+            self.__timer = self.__loop.call_later(seconds, self.__step, (index + 1) % len(self.__pattern))
+
+
+class LocalUI(object):
+    """Buttons to turn the heater on and off, and an LED showing its state"""
+    def __init__(self, loop, pins):
+        self.__watcher = filewatch.FileWatcher([STATUS_FILE, CONTROL_FILE], WATCH_INTERVAL)
+        self.__led = LED(loop, pins, GPIO_LED_ONOFF)
+        self.__state = heaterstate.getheaterstate()
+        self.__settings = heaterstate.getheatersettings()
+        Button(loop, pins, GPIO_BTN_ON, lambda: self.turn("auto"))
+        Button(loop, pins, GPIO_BTN_OFF, lambda: self.turn("off"))
+        if self.__watcher.fileno() is not None:
+            loop.add_reader(self.__watcher.fileno(), self.refresh)
+        else:
+            loop.every(WATCH_INTERVAL, self.refresh)
+        self.show()
+
+    def refresh(self):
+        """Reread the status and settings if they changed"""
+        # A wait of no time checks now, whether inotify is in use or not
+        changed = self.__watcher.wait(0)
+        if STATUS_FILE in changed:
+            self.__state = heaterstate.getheaterstate()
+        if CONTROL_FILE in changed:
+            self.__settings = heaterstate.getheatersettings()
+        if changed:
+            self.show()
+
+    def turn(self, run):
+        """Set the run mode, called when a button is pressed"""
+        print "Turn %s..." % ("off" if run == "off" else "on")
+        try:
+            self.__settings = heaterstate.updateheatersettings({'run': run}) or self.__settings
+        except ValueError as e:
+            print "Controller refused run mode: %s" % e
+        self.show()
+
+    def show(self):
+        """Show the run mode on the LED, blinking until the heater follows it"""
+        if self.__settings['run'] == self.__state['run']:
+            if self.__settings['run'] == "off":
+                self.__led.setpattern(LED_OFF)
+            else:
+                self.__led.setpattern(LED_ON)
+        elif self.__settings['run'] == "off":
+            self.__led.setpattern(LED_TURNING_OFF)
+        else:
+            self.__led.setpattern(LED_TURNING_ON)
+
+
 def setup():
-    """Configure hardware"""
-    wiringpi.wiringPiSetup()
-    wiringpi.pinMode(GPIO_BTN_ON, 0)  # Set as input
-    wiringpi.pullUpDnControl(GPIO_BTN_ON, 2)  # Pull-up
-    wiringpi.pinMode(GPIO_BTN_OFF, 0)
-    wiringpi.pullUpDnControl(GPIO_BTN_OFF, 2)
-    wiringpi.pinMode(GPIO_LED_ONOFF, 1)  # Set as output
-    wiringpi.digitalWrite(GPIO_LED_ONOFF, 0)
-
-
-def getheatersettings():
-    """Read settings from file"""
-    default = {"highlowthresh": 0.75,
-               "temphyst": 0.33,
-               "elements": "auto",
-               "run": "off",
-               "setpoint": 20.0,
-               "minduration": 15}
-    try:
-        fd = open(CONTROL_FILE, "r")
-        settings = json.load(fd)
-        fd.close()
-    except IOError:
-        print "Error reading control file"
-        return default
-    except ValueError:
-        print "Error parsing json from control file"
-        return default
-    return settings
-
-
-def saveheatersettings(settings):
-    """Save settings to file"""
-    try:
-        fd = open(CONTROL_FILE, "w")
-        json.dump(settings, fd)
-        fd.close()
-    except IOError:
-        print "Error writing control file"
-        return False
-    return True
-
-
-def getheaterstate():
-    """Read status from file"""
-    default = {"heater": "off",
-               "setpoint": 21.0,
-               "run": "auto",
-               "temperature": -999}
+    """Configure hardware, returns the GPIO backend"""
     try:
-        fd = open(STATUS_FILE, "r")
-        state = json.load(fd)
-        fd.close()
-    except IOError:
-        print "Error reading state file"
-        return default
-    except ValueError:
-        print "Error parsing json from state file"
-        return default
-    return state
+        pins = gpio.getbackend(GPIO_BACKEND)
+    except gpio.GPIOError as e:
+        print "Error setting up GPIO: %s" % e
+        sys.exit(1)
+    return pins
 
 
 def main():
     """ Main loop"""
-    setup()
-    btn = {'on': 1, 'off': 1}
-    count = 0
-    while True:
-        state = getheaterstate()
-        settings = getheatersettings()
-        btn['on'] = wiringpi.digitalRead(GPIO_BTN_ON)
-        btn['off'] = wiringpi.digitalRead(GPIO_BTN_OFF)
-        if btn['off'] == 0:
-            print "Turn off..."
-            settings['run'] = "off"
-            saveheatersettings(settings)
-        elif btn['on'] == 0:
-            print "Turn on..."
-            settings['run'] = "auto"
-            saveheatersettings(settings)
-        if settings['run'] == state['run']:
-            if settings['run'] == "off":
-                wiringpi.digitalWrite(GPIO_LED_ONOFF, 0)
-            else:
-                wiringpi.digitalWrite(GPIO_LED_ONOFF, 1)
-        else:
-            if settings['run'] == "off":
-                if count < 4:
-                    wiringpi.digitalWrite(GPIO_LED_ONOFF, 1)
-                else:
-                    wiringpi.digitalWrite(GPIO_LED_ONOFF, 0)
-            else:
-                if count < 12:
-                    wiringpi.digitalWrite(GPIO_LED_ONOFF, 1)
-                else:
-                    wiringpi.digitalWrite(GPIO_LED_ONOFF, 0)
-        count = (count + 1) % 20
-        wiringpi.delay(50)
+    pins = setup()
+    loop = eventloop.EventLoop()
+    LocalUI(loop, pins)
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+        pins.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,85 @@
+#!/usr/bin/python
+"""Tests of the local UI's buttons and LED on the fake GPIO backend"""
+
+import unittest
+
+# heaterui puts the controller's modules on the path
+import heaterui
+import eventloop  # noqa pylint: disable=wrong-import-position,wrong-import-order
+import gpio  # noqa pylint: disable=wrong-import-position,wrong-import-order
+
+PIN = 23
+
+
+class ButtonTest(unittest.TestCase):
+    """Button edges are debounced on the loop"""
+    def setUp(self):
+        self.loop = eventloop.EventLoop()
+        self.pins = gpio.FakeBackend()
+        self.presses = []
+        heaterui.Button(self.loop, self.pins, PIN, lambda: self.presses.append(self.loop.time()))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_for(self, seconds):
+        """Run the loop for seconds"""
+        self.loop.call_later(seconds, self.loop.stop)
+        self.loop.run_forever()
+
+    def test_bouncing_press_counts_once(self):
+        for value in (0, 1, 0, 1, 0):
+            self.pins.setinput(PIN, value)
+        self.run_for(heaterui.DEBOUNCE * 3)
+        self.assertEqual(len(self.presses), 1)
+
+    def test_release_is_not_a_press(self):
+        self.pins.setinput(PIN, 0)
+        self.run_for(heaterui.DEBOUNCE * 3)
+        self.pins.setinput(PIN, 1)
+        self.run_for(heaterui.DEBOUNCE * 3)
+        self.assertEqual(len(self.presses), 1)
+        self.pins.setinput(PIN, 0)
+        self.run_for(heaterui.DEBOUNCE * 3)
+        self.assertEqual(len(self.presses), 2)
+
+    def test_glitch_ignored(self):
+        self.pins.setinput(PIN, 0)
+        self.pins.setinput(PIN, 1)
+        self.run_for(heaterui.DEBOUNCE * 3)
+        self.assertEqual(self.presses, [])
+
+    def test_waits_for_pin_to_settle(self):
+        start = self.loop.time()
+        self.pins.setinput(PIN, 0)
+        self.run_for(heaterui.DEBOUNCE * 3)
+        self.assertTrue(self.presses[0] - start >= heaterui.DEBOUNCE)
+
+
+class LEDTest(unittest.TestCase):
+    """LED patterns are stepped by timers"""
+    def setUp(self):
+        self.loop = eventloop.EventLoop()
+        self.pins = gpio.FakeBackend()
+        self.led = heaterui.LED(self.loop, self.pins, PIN)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_steady(self):
+        self.led.setpattern(heaterui.LED_ON)
+        self.led.setpattern(heaterui.LED_ON)
+        self.loop.call_later(0.05, self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(self.pins.writes, [[(PIN, 1)]])
+
+    def test_blinking(self):
+        self.led.setpattern([(1, 0.02), (0, 0.02)])
+        self.loop.call_later(0.09, self.loop.stop)
+        self.loop.run_forever()
+        self.assertEqual(self.pins.writes[:4], [[(PIN, 1)], [(PIN, 0)], [(PIN, 1)], [(PIN, 0)]])
+        self.led.setpattern(heaterui.LED_OFF)
+        self.assertEqual(self.pins.pins[PIN], 0)
+
+if __name__ == "__main__":
+    unittest.main()
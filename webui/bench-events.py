@@ -0,0 +1,196 @@
+#!/usr/bin/python
+"""
+Load test of the event stream: serve the UI with gunicorn as configured in
+gunicorn.conf.py, connect increasing numbers of /events subscribers while
+the status file changes every interval, and measure the server's CPU use
+"""
+# pylint: disable=line-too-long
+
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from heaterui import create_app
+
+import heaterstate
+
+# Zone served by the test server, with its files in a temporary directory
+# so a running controller is left alone
+ZONE = 'bench'
+
+
+def usedir(path):
+    """Keep the heater files in path"""
+    heaterstate.STATUS_FILE = os.path.join(path, 'heater-status')
+    heaterstate.CONTROL_FILE = os.path.join(path, 'heater-control')
+    heaterstate.LOCK_FILE = os.path.join(path, 'heater-control.lock')
+    heaterstate.zonesfile = heaterstate.JSONFile(os.path.join(path, 'heater-zones'))
+    return heaterstate.zonepath(heaterstate.STATUS_FILE, ZONE)
+
+
+def serve(path, port, workers):
+    """Run gunicorn with the settings of gunicorn.conf.py, does not return"""
+    import gunicorn.app.base
+
+    class Server(gunicorn.app.base.BaseApplication):
+        """gunicorn serving the app made here"""
+        def __init__(self, app, options):
+            self.__app = app
+            self.__options = options
+            gunicorn.app.base.BaseApplication.__init__(self)
+
+        def load_config(self):
+            for key, value in self.__options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.__app
+
+    usedir(path)
+    options = dict()
+    execfile(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gunicorn.conf.py'), {}, options)
+    options.update(bind='127.0.0.1:%d' % port, accesslog=None, loglevel='warning')
+    if workers is not None:
+        options['workers'] = workers
+    Server(create_app(), options).run()
+
+
+def cputime(pid):
+    """Return the CPU seconds used by pid and its children"""
+    pids = [pid]
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                fd = open('/proc/%s/stat' % name)
+                fields = fd.read().rsplit(')', 1)[1].split()
+                fd.close()
+            except (IOError, IndexError):
+                continue
+            if int(fields[1]) == pid:
+                pids.append(int(name))
+    total = 0
+    for p in pids:
+        try:
+            fd = open('/proc/%d/stat' % p)
+            fields = fd.read().rsplit(')', 1)[1].split()
+            fd.close()
+        except IOError:
+            continue
+        total += int(fields[11]) + int(fields[12])
+    return float(total) / os.sysconf('SC_CLK_TCK')
+
+
+class Subscriber(threading.Thread):
+    """A client reading the event stream and counting status messages"""
+    def __init__(self, port):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.messages = 0
+        self.__sock = socket.create_connection(('127.0.0.1', port))
+        self.__sock.sendall('GET /zone/%s/events HTTP/1.1\r\nHost: localhost\r\n\r\n' % ZONE)
+
+    def run(self):
+        data = ''
+        while True:
+            try:
+                chunk = self.__sock.recv(4096)
+            except socket.error:
+                return
+            if not chunk:
+                return
+            data += chunk
+            self.messages += data.count('event: status')
+            data = data[data.rfind('\n'):]
+
+    def close(self):
+        """Disconnect"""
+        try:
+            self.__sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.__sock.close()
+
+
+def main():
+    """Start the server, run the load steps and print a table"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[0, 1, 5, 10, 20, 50], help='numbers of subscribers to measure')
+    parser.add_argument('--seconds', type=float, default=10, help='time each number is measured for')
+    parser.add_argument('--interval', type=float, default=1, help='seconds between status changes')
+    parser.add_argument('--workers', type=int, help='gunicorn worker processes, as configured if not given')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--serve', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.workers)
+        return
+
+    tmpdir = tempfile.mkdtemp()
+    statuspath = usedir(tmpdir)
+    heaterstate.writejson(heaterstate.zonesfile.getpath(), {'zones': [heaterstate.DEFAULT_ZONE, ZONE]})
+    heaterstate.writejson(heaterstate.zonepath(heaterstate.CONTROL_FILE, ZONE), heaterstate.DEFAULT_SETTINGS)
+    heaterstate.writejson(statuspath, heaterstate.DEFAULT_STATE)
+    command = [sys.executable, os.path.abspath(__file__), '--serve', tmpdir, '--port', str(args.port)]
+    if args.workers is not None:
+        command += ['--workers', str(args.workers)]
+    server = subprocess.Popen(command)
+    stop = threading.Event()
+
+    def change():
+        """Rewrite the status file every interval as the controller does"""
+        n = 0
+        while not stop.wait(args.interval):
+            n += 1
+            heaterstate.writejson(statuspath, dict(heaterstate.DEFAULT_STATE, temperature=18.0 + (n % 40) / 10.0))
+
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', args.port)).close()
+                break
+            except socket.error:
+                time.sleep(0.1)
+        else:
+            print "Server did not start"
+            return
+        changer = threading.Thread(target=change)
+        changer.daemon = True
+        changer.start()
+
+        print "subscribers  served   CPU   ms/change  messages/subscriber"
+        for count in args.subscribers:
+            clients = [Subscriber(args.port) for _ in range(count)]
+            for c in clients:
+                c.start()
+            # Let every client get its snapshot before measuring
+            time.sleep(1)
+            before = [c.messages for c in clients]
+            cpu = cputime(server.pid)
+            start = time.time()
+            time.sleep(args.seconds)
+            used = cputime(server.pid) - cpu
+            elapsed = time.time() - start
+            received = [c.messages - b for c, b in zip(clients, before)]
+            for c in clients:
+                c.close()
+            changes = elapsed / args.interval
+            mean = float(sum(received)) / len(received) if received else 0.0
+            # Each stream holds a worker thread, those beyond workers x
+            # threads wait for one and get nothing
+            served = len([r for r in received if r > 0])
+            print "%11d %7d %5.1f%% %9.2f %20.1f" % (count, served, 100 * used / elapsed, 1000 * used / changes, mean)
+            time.sleep(0.5)
+    finally:
+        stop.set()
+        server.terminate()
+        server.wait()
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+"""
+Benchmark the history endpoint: fill an archive with a year of samples, so
+every level is full, and time /history queries over spans up to a year
+"""
+# pylint: disable=line-too-long
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from heaterui import create_app
+from heaterui import history
+
+import heaterarchive
+
+# Spans queried, name and seconds
+SPANS = [('hour', 3600), ('day', 86400), ('week', 7 * 86400),
+         ('month', 30 * 86400), ('year', 365 * 86400)]
+
+
+def fill(archive, end, days, sensors):
+    """Append one sample per primary data point for days up to end"""
+    ids = ['28-%012x' % n for n in range(sensors)]
+    start = end - days * 86400
+    t = start
+    while t < end:
+        phase = (t - start) / 86400.0
+        temp = 19.0 + 2.0 * ((phase * 24) % 1)
+        archive.append(t, temp, 20.0, 1 if temp < 20 else 0,
+                       dict((sid, temp + 0.1 * n) for n, sid in enumerate(ids)))
+        t += heaterarchive.BASE_STEP
+
+
+def main():
+    """Fill an archive, time the queries and print a table"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=float, default=366, help='days of samples to fill the archive with')
+    parser.add_argument('--sensors', type=int, default=4, help='sensors recorded besides the average')
+    parser.add_argument('--max-points', type=int, default=history.DEFAULT_POINTS)
+    parser.add_argument('--repeat', type=int, default=20, help='queries timed per span, the median is shown')
+    parser.add_argument('--archive', help='existing archive to query instead of filling a new one')
+    args = parser.parse_args()
+
+    tmpdir = None
+    path = args.archive
+    if path is None:
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'heater.archive')
+    try:
+        if args.archive is None:
+            archive = heaterarchive.Archive(path, create=True)
+            start = time.time()
+            fill(archive, time.time(), args.days, args.sensors)
+            print "Filled %.0f days in %.1f seconds" % (args.days, time.time() - start)
+            archive.close()
+        history.archivereader = heaterarchive.ArchiveReader(path)
+
+        client = create_app().test_client()
+        print "span     level  rows   median      max"
+        for name, seconds in SPANS:
+            url = '/history?start=-%d&max_points=%d' % (seconds, args.max_points)
+            times = []
+            for _ in range(args.repeat):
+                before = time.time()
+                response = client.get(url)
+                times.append(time.time() - before)
+            if response.status_code != 200:
+                print "%-7s failed: %s" % (name, response.status)
+                continue
+            result = response.get_json()
+            level = [l[0] for l in heaterarchive.LEVELS if l[1] == result['step']][0]
+            times.sort()
+            print "%-7s %5s %5d %6.1fms %6.1fms" % (name, level, len(result['rows']), times[len(times) / 2] * 1000, times[-1] * 1000)
+    finally:
+        if tmpdir is not None:
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
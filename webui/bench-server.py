@@ -0,0 +1,115 @@
+#!/usr/bin/python
+"""
+Benchmark the production server against the development one: time each
+from launch to its first response, then count the requests per second it
+answers for concurrent clients
+"""
+# pylint: disable=line-too-long
+
+import argparse
+import httplib
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+WEBUI = os.path.dirname(os.path.abspath(__file__))
+
+# Port run-heaterui.py serves on
+DEV_PORT = 5000
+
+# Servers compared, name and command, each serving on DEV_PORT
+SERVERS = [('run-heaterui.py', [sys.executable, os.path.join(WEBUI, 'run-heaterui.py')]),
+           ('gunicorn', [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+                         '--config', os.path.join(WEBUI, 'gunicorn.conf.py'),
+                         '--bind', '127.0.0.1:%d' % DEV_PORT, 'wsgi:app'])]
+
+
+def startup(command, path):
+    """Launch a server, return it and the seconds until it answered path"""
+    devnull = open(os.devnull, 'w')
+    start = time.time()
+    # In its own process group so the reloader's child is stopped with it
+    server = subprocess.Popen(command, cwd=WEBUI, stdout=devnull, stderr=devnull, preexec_fn=os.setsid)
+    while time.time() - start < 30:
+        try:
+            conn = httplib.HTTPConnection('127.0.0.1', DEV_PORT, timeout=5)
+            conn.request('GET', path)
+            if conn.getresponse().status == 200:
+                return server, time.time() - start
+        except (socket.error, httplib.HTTPException):
+            time.sleep(0.01)
+    return server, None
+
+
+def stop(server):
+    """Stop a server and every process it started"""
+    try:
+        os.killpg(server.pid, signal.SIGTERM)
+    except OSError:
+        pass
+    server.wait()
+    # Wait for the port to be released for the next server
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', DEV_PORT)).close()
+        except socket.error:
+            return
+        time.sleep(0.1)
+
+
+def throughput(path, clients, seconds):
+    """Return the requests per second answered to clients for seconds"""
+    counts = [0] * clients
+    end = time.time() + seconds
+
+    def client(n):
+        """Request path over and over, on one connection where kept alive"""
+        conn = httplib.HTTPConnection('127.0.0.1', DEV_PORT, timeout=10)
+        while time.time() < end:
+            try:
+                conn.request('GET', path)
+                response = conn.getresponse()
+                response.read()
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                continue
+            if response.status == 200:
+                counts[n] += 1
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.time() - start)
+
+
+def main():
+    """Benchmark each server in turn and print a table"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--path', default='/', help='page requested')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--seconds', type=float, default=5, help='time requests are counted for')
+    parser.add_argument('--runs', type=int, default=3, help='runs of each server')
+    args = parser.parse_args()
+
+    print "server            startup      req/s"
+    for name, command in SERVERS:
+        for _ in range(args.runs):
+            server, taken = startup(command, args.path)
+            try:
+                if taken is None:
+                    print "%-16s did not start" % name
+                    continue
+                rate = throughput(args.path, args.clients, args.seconds)
+                print "%-16s %6.2fs %10.1f" % (name, taken, rate)
+            finally:
+                stop(server)
+
+if __name__ == "__main__":
+    main()
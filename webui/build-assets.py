@@ -0,0 +1,7 @@
+#!/usr/bin/python
+"""Build fingerprinted, precompressed static assets for heaterui"""
+
+from heaterui.assets import build, DIST_DIR
+
+built = build()
+print "Built %d assets into %s" % (len(built), DIST_DIR)
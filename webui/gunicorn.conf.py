@@ -0,0 +1,13 @@
+# Gunicorn settings for serving heaterui, see run-heaterui.sh
+
+bind = '0.0.0.0:5000'
+
+# A couple of processes so one slow request can't hold up the others
+workers = 2
+
+# Each live dashboard holds a thread open for its event stream
+worker_class = 'gthread'
+threads = 32
+
+# Keep connections open for the static files a page load fetches
+keepalive = 5
@@ -1,10 +1,16 @@
 """WebUI for Heater - module init"""
+import os
+import sys
+
 from flask import Flask
 from flask_appconfig import AppConfig
 from flask_bootstrap import Bootstrap
-from flask_debug import Debug
-from flask_debugtoolbar import DebugToolbarExtension
 
+# Modules shared with the controller live alongside it
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'control'))
+
+from .api import api
+from .assets import assets
 from .frontend import frontend
 from .nav import nav
 
@@ -17,20 +23,17 @@ def create_app(configfile=None):
     app = Flask(__name__)
 
     # We use Flask-Appconfig here, but this is not a requirement
-    AppConfig(app)
-
-    app.debug = True
+    AppConfig(app, configfile)
 
     # Install our Bootstrap extension
     Bootstrap(app)
 
-    # Debug(app)
-    # DebugToolbarExtension(app)
-
     # Our application uses blueprints as well; these go well with the
     # application factory. We already imported the blueprint, now we just need
     # to register it:
     app.register_blueprint(frontend)
+    app.register_blueprint(assets)
+    app.register_blueprint(api)
 
     # Because we're security-conscious developers, we also hard-code disabling
     # the CDN support (this might become a default in later versions):
@@ -0,0 +1,79 @@
+"""JSON control API for Heater WebUI"""
+
+from flask import Blueprint, request, jsonify, abort, make_response
+
+import heaterstate
+
+api = Blueprint('api', __name__, url_prefix='/api')
+
+
+def _error(status, message):
+    """Return a json error response"""
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+def _tagged(data, version):
+    """Return data as json with its etag, or 304 if the client has it"""
+    response = jsonify(data)
+    response.set_etag(version)
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def _zone(zone):
+    """Return zone, aborting with 404 if the controller does not run it"""
+    if zone is not None and zone not in heaterstate.getzones():
+        abort(404)
+    return zone
+
+
+@api.route('/zones')
+def zones():
+    result = [dict(name=z, status=heaterstate.getheaterstate(z)) for z in heaterstate.getzones()]
+    return jsonify(zones=result)
+
+
+@api.route('/status', defaults={'zone': None})
+@api.route('/zones/<zone>/status')
+def status(zone):
+    state = heaterstate.getheaterstate(_zone(zone))
+    return _tagged(state, heaterstate.etag(state))
+
+
+@api.route('/settings', defaults={'zone': None})
+@api.route('/zones/<zone>/settings')
+def settings(zone):
+    current, version = heaterstate.getversionedsettings(_zone(zone))
+    return _tagged(current, version)
+
+
+@api.route('/settings', methods=['PATCH'], defaults={'zone': None})
+@api.route('/zones/<zone>/settings', methods=['PATCH'])
+def updatesettings(zone):
+    zone = _zone(zone)
+    if not request.if_match:
+        return _error(428, 'If-Match header with the settings ETag is required')
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        return _error(400, 'Request body must be a json object')
+    try:
+        changes = heaterstate.validatesettings(changes)
+    except ValueError as e:
+        return _error(422, str(e))
+
+    version = heaterstate.getversionedsettings(zone)[1]
+    if not request.if_match.contains(version) and not request.if_match.star_tag:
+        return _error(412, 'Settings have changed')
+    try:
+        new = heaterstate.updateheatersettings(changes, None if request.if_match.star_tag else version, zone)
+    except heaterstate.SettingsConflict:
+        return _error(412, 'Settings have changed')
+    except ValueError as e:
+        return _error(422, str(e))
+    if new is None:
+        abort(503)
+    response = make_response(jsonify(new))
+    response.set_etag(heaterstate.etag(new))
+    return response
@@ -0,0 +1,172 @@
+"""Fingerprinted, precompressed static assets for Heater WebUI"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+import StringIO
+
+from flask import Blueprint, abort, request, send_file, url_for
+import flask_bootstrap
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+assets = Blueprint('assets', __name__)
+
+# Directory the built assets and manifest are written to
+DIST_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'dist')
+MANIFEST_FILE = os.path.join(DIST_DIR, 'manifest.json')
+
+# Source directories and the name prefix their files get
+SOURCES = [('', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')),
+           ('bootstrap/', os.path.join(os.path.dirname(os.path.abspath(flask_bootstrap.__file__)), 'static'))]
+
+# File types that are built
+EXTENSIONS = ['.css', '.js', '.eot', '.svg', '.ttf', '.woff', '.woff2', '.png', '.ico']
+
+# File types worth compressing
+COMPRESS = ['.css', '.js', '.eot', '.svg', '.ttf', '.ico']
+
+# Fingerprinted files never change, so they may be cached for a year
+CACHE_SECONDS = 365 * 86400
+
+CSS_URL = re.compile(r'''url\((['"]?)([^'")?#]+)([?#][^'")]*)?\1\)''')
+
+# Encodings in order of preference, with the suffix of their file
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+manifest = None
+
+
+def fingerprint(name, data):
+    """Return name with a hash of data inserted before the extension"""
+    base, ext = posixpath.splitext(name)
+    return '%s.%s%s' % (base, hashlib.sha1(data).hexdigest()[:12], ext)
+
+
+def _rewritecss(name, data, built):
+    """Point url() references in a stylesheet at the fingerprinted files"""
+    directory = posixpath.dirname(name)
+
+    def replace(match):
+        """Replace one url()"""
+        quote, target, suffix = match.group(1), match.group(2), match.group(3) or ''
+        if ':' in target or target.startswith('/'):
+            return match.group(0)
+        logical = posixpath.normpath(posixpath.join(directory, target))
+        if logical not in built:
+            return match.group(0)
+        hashed = posixpath.relpath(built[logical], directory)
+        return 'url(%s%s%s%s)' % (quote, hashed, suffix, quote)
+    return CSS_URL.sub(replace, data)
+
+
+def _compress(path, data):
+    """Write compressed copies of data next to path if they are smaller"""
+    buf = StringIO.StringIO()
+    gz = gzip.GzipFile(filename='', mode='wb', fileobj=buf, compresslevel=9, mtime=0)
+    gz.write(data)
+    gz.close()
+    if len(buf.getvalue()) < len(data):
+        open(path + '.gz', 'wb').write(buf.getvalue())
+    if brotli is not None:
+        compressed = brotli.compress(data)
+        if len(compressed) < len(data):
+            open(path + '.br', 'wb').write(compressed)
+
+
+def build():
+    """
+    Fingerprint every asset into DIST_DIR with compressed copies alongside,
+    and write the manifest mapping asset names to built names
+    Returns the manifest
+    """
+    sources = dict()
+    for prefix, directory in SOURCES:
+        for root, dirs, files in os.walk(directory):
+            if os.path.abspath(root) == DIST_DIR or root.startswith(DIST_DIR + os.sep):
+                dirs[:] = []
+                continue
+            for f in files:
+                if os.path.splitext(f)[1] not in EXTENSIONS:
+                    continue
+                path = os.path.join(root, f)
+                name = prefix + os.path.relpath(path, directory).replace(os.sep, '/')
+                sources[name] = path
+
+    # Stylesheets refer to other assets, so they are built last
+    built = dict()
+    for name in sorted(sources, key=lambda n: (n.endswith('.css'), n)):
+        data = open(sources[name], 'rb').read()
+        if name.endswith('.css'):
+            data = _rewritecss(name, data, built)
+        hashed = fingerprint(name, data)
+        path = os.path.join(DIST_DIR, hashed)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if not os.path.exists(path):
+            open(path, 'wb').write(data)
+            if os.path.splitext(name)[1] in COMPRESS:
+                _compress(path, data)
+        built[name] = hashed
+
+    tmp = MANIFEST_FILE + '.tmp'
+    json.dump(built, open(tmp, 'w'), indent=1, sort_keys=True)
+    os.rename(tmp, MANIFEST_FILE)
+    return built
+
+
+def getmanifest():
+    """Return the manifest, empty if the assets have not been built"""
+    global manifest  # pylint: disable=global-statement
+    if manifest is None:
+        try:
+            manifest = json.load(open(MANIFEST_FILE, 'r'))
+        except (IOError, ValueError):
+            manifest = dict()
+    return manifest
+
+
+def asset_url(name):
+    """Return the url of an asset, fingerprinted if it has been built"""
+    hashed = getmanifest().get(name)
+    if hashed is not None:
+        return url_for('assets.asset', filename=hashed)
+    if name.startswith('bootstrap/'):
+        return url_for('bootstrap.static', filename=name[len('bootstrap/'):])
+    return url_for('static', filename=name)
+
+
+@assets.app_context_processor
+def inject_asset_url():
+    return dict(asset_url=asset_url)
+
+
+@assets.route('/assets/<path:filename>')
+def asset(filename):
+    path = os.path.abspath(os.path.join(DIST_DIR, filename))
+    if not path.startswith(DIST_DIR + os.sep) or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    encoding = None
+    accepted = request.accept_encodings
+    for name, suffix in ENCODINGS:
+        if accepted[name] and os.path.isfile(path + suffix):
+            encoding = name
+            path = path + suffix
+            break
+
+    response = send_file(path, mimetype=mimetype, conditional=True,
+                         cache_timeout=CACHE_SECONDS)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = 'public, max-age=%d, immutable' % CACHE_SECONDS
+    return response
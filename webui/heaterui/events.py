@@ -0,0 +1,143 @@
+"""Live status push for Heater WebUI using Server-Sent Events"""
+
+import json
+import Queue
+import threading
+
+import filewatch
+import heaterstate
+
+# Seconds between keepalive comments sent to idle clients
+KEEPALIVE = 15
+
+# Seconds between checks of the status and control files when inotify is
+# unavailable
+WATCH_INTERVAL = 1
+
+# Messages queued for a client that is not reading before it is dropped
+QUEUE_SIZE = 50
+
+
+def message(event, data):
+    """Format one Server-Sent Event"""
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data))
+
+
+def delta(old, new):
+    """Return the items of new which differ from old"""
+    if old is None:
+        return dict(new)
+    return dict((k, v) for k, v in new.items() if old.get(k) != v)
+
+
+class EventHub(object):
+    """
+    Watch a zone's status and control files from a single thread and fan changes
+    out to every subscribed client, so the cost of watching does not grow
+    with the number of clients. Each change is formatted once and the same
+    message is queued for every client.
+    """
+    def __init__(self, zone=None):
+        self.__zone = zone
+        self.__lock = threading.Lock()
+        self.__subscribers = set()
+        self.__thread = None
+        self.__state = None
+        self.__settings = None
+
+    def subscribe(self):
+        """Return a queue which will receive messages, starting the watcher"""
+        q = Queue.Queue(QUEUE_SIZE)
+        with self.__lock:
+            if self.__thread is None:
+                self.__state = heaterstate.getheaterstate(self.__zone)
+                self.__settings = heaterstate.getheatersettings(self.__zone)
+                self.__thread = threading.Thread(target=self.__run)
+                self.__thread.daemon = True
+                self.__thread.start()
+            self.__subscribers.add(q)
+            q.put(message('status', self.__state))
+            q.put(message('settings', self.__settings))
+        return q
+
+    def unsubscribe(self, q):
+        """Stop sending messages to q"""
+        with self.__lock:
+            self.__subscribers.discard(q)
+
+    def subscribers(self):
+        """Return the number of subscribed clients"""
+        with self.__lock:
+            return len(self.__subscribers)
+
+    def __broadcast(self, msg):
+        """Queue msg for every client, dropping clients that stopped reading"""
+        for q in list(self.__subscribers):
+            try:
+                q.put_nowait(msg)
+            except Queue.Full:
+                # Replace the backlog with an end of stream marker, the
+                # browser will reconnect and get a fresh snapshot
+                self.__subscribers.discard(q)
+                try:
+                    while True:
+                        q.get_nowait()
+                except Queue.Empty:
+                    pass
+                q.put_nowait(None)
+
+    def __run(self):
+        """Watcher thread, exits when the last client goes away"""
+        paths = [heaterstate.zonepath(heaterstate.STATUS_FILE, self.__zone),
+                 heaterstate.zonepath(heaterstate.CONTROL_FILE, self.__zone)]
+        watcher = filewatch.FileWatcher(paths, WATCH_INTERVAL)
+        try:
+            while True:
+                changed = watcher.wait(KEEPALIVE)
+                state = heaterstate.getheaterstate(self.__zone) if changed else None
+                settings = heaterstate.getheatersettings(self.__zone) if changed else None
+                with self.__lock:
+                    if not self.__subscribers:
+                        self.__thread = None
+                        return
+                    if not changed:
+                        self.__broadcast(': keepalive\n\n')
+                        continue
+                    d = delta(self.__state, state)
+                    if d:
+                        self.__state = state
+                        self.__broadcast(message('status', d))
+                    d = delta(self.__settings, settings)
+                    if d:
+                        self.__settings = settings
+                        self.__broadcast(message('settings', d))
+        finally:
+            watcher.close()
+
+    def stream(self):
+        """Generator of messages for one client"""
+        q = self.subscribe()
+        try:
+            while True:
+                # Block without a timeout; a timed wait polls in Python 2.
+                # The watcher sends keepalives so dead clients are noticed.
+                msg = q.get()
+                if msg is None:
+                    return
+                yield msg
+        finally:
+            self.unsubscribe(q)
+
+
+hub = EventHub()
+_hubs = {heaterstate.DEFAULT_ZONE: hub}
+_hubslock = threading.Lock()
+
+
+def gethub(zone=None):
+    """Return the EventHub of zone, the default zone if it is None"""
+    with _hubslock:
+        zone = zone or heaterstate.DEFAULT_ZONE
+        if zone not in _hubs:
+            _hubs[zone] = EventHub(zone)
+        return _hubs[zone]
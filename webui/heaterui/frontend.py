@@ -1,8 +1,8 @@
 """Frontend blueprint for Heater WebUI"""
 
-import json
+import time
 
-from flask import Blueprint, render_template, flash, redirect, url_for, request
+from flask import Blueprint, render_template, flash, redirect, url_for, request, abort, make_response, jsonify, Response
 from flask_bootstrap import __version__ as FLASK_BOOTSTRAP_VERSION
 from flask_nav.elements import Navbar, View, Subgroup, Link, Text, Separator
 from markupsafe import escape
@@ -11,7 +11,13 @@ from wtforms.fields import RadioField, DecimalField
 from wtforms.fields.html5 import DecimalRangeField
 
 
+import heatermetrics
+import heaterstate
+
 # from .forms import SignupForm
+from . import events
+from . import graphs
+from . import history
 from .nav import nav
 
 frontend = Blueprint('frontend', __name__)
@@ -20,84 +26,125 @@ frontend = Blueprint('frontend', __name__)
 nav.register_element('frontend_top', Navbar(
     View('Heater Control', '.index'),
     View('Home', '.index'),
+    View('Graphs', '.graphlist'),
     Text('Using Flask-Bootstrap {}'.format(FLASK_BOOTSTRAP_VERSION)),
 ))
 
 
-def getheatersettings():
-    CONTROL_FILE = "/dev/shm/heater-control"
-    default = {"highlowthresh": 1.5, "temphyst": 0.5, "elements": "auto", "run": "auto", "setpoint": 21.0, "minduration": 15}
-    try:
-        fd = open(CONTROL_FILE, "r")
-        settings = json.load(fd)
-        fd.close()
-    except IOError:
-        print "Error reading control file"
-        return default
-    except ValueError:
-        print "Error parsing json from control file"
-        return default
-    return settings
-
-
-def saveheatersettings(settings):
-    CONTROL_FILE = "/dev/shm/heater-control"
-    try:
-        fd = open(CONTROL_FILE, "w")
-        json.dump(settings, fd)
-        fd.close()
-    except IOError:
-        print "Error writing control file"
-        return False
-    return True
-
-
-def getheaterstate():
-    STATUS_FILE = "/dev/shm/heater-status"
-    default = {"heater": "off", "setpoint": 21.0, "run": "auto", "temperature": -999}
-    try:
-        fd = open(STATUS_FILE, "r")
-        state = json.load(fd)
-        fd.close()
-    except IOError:
-        print "Error reading state file"
-        return default
-    except ValueError:
-        print "Error parsing json from state file"
-        return default
-    return state
+# Metrics dumped by the controller
+metricsfile = heaterstate.JSONFile(heatermetrics.METRICS_FILE)
 
 
 class HeaterForm(Form):
-    state = getheaterstate()
-    settings = getheatersettings()
     run = RadioField(u'Heater', choices=[('off', 'Off'), ('cont', 'Continuous'), ('auto', 'Automatic')])
-    # setpoint = DecimalRangeField('Setpoint', default=settings['setpoint'])
-    setpoint = DecimalField('Setpoint', default=settings['setpoint'])
+    # setpoint = DecimalRangeField('Setpoint')
+    setpoint = DecimalField('Setpoint')
     elements = RadioField(u'Heat', choices=[('low', 'Low'), ('high', 'High'), ('auto', 'Automatic')])
 
 
-@frontend.route('/', methods=['GET', 'POST'])
-def index():
-    state = getheaterstate()
-    settings = getheatersettings()
+@frontend.route('/', methods=['GET', 'POST'], defaults={'zone': None})
+@frontend.route('/zone/<zone>', methods=['GET', 'POST'])
+def index(zone):
+    zones = heaterstate.getzones()
+    if zone is not None and zone not in zones:
+        abort(404)
+    state = heaterstate.getheaterstate(zone)
+    settings = heaterstate.getheatersettings(zone)
     tempC = "%.2fC" % state['temperature']
-    form = HeaterForm(request.form)
+    form = HeaterForm(request.form, setpoint=settings['setpoint'])
 
     if request.method == "POST" and form.validate():
-        settings['run'] = request.form.get('run')
+        changes = dict()
+        changes['run'] = request.form.get('run')
         setpoint = float(request.form.get('setpoint'))
         setpoint = round(setpoint * 2) / 2
-        settings['setpoint'] = setpoint
-        settings['elements'] = request.form.get('elements')
-        saveheatersettings(settings)
+        changes['setpoint'] = setpoint
+        changes['elements'] = request.form.get('elements')
+        try:
+            changes = heaterstate.validatesettings(changes)
+            # Only the fields on the form are changed, so settings changed
+            # elsewhere meanwhile are kept
+            newsettings = heaterstate.updateheatersettings(changes, zone=zone)
+        except ValueError as e:
+            flash(str(e), 'error')
+        else:
+            if newsettings is not None:
+                settings = newsettings
 
     if settings['run'] == "cont":
         flash(u'Heater is in continuous mode and will not turn off automatically', 'error')
     elif settings['run'] == "off":
         flash(u'Heater is turned off', 'warning')
 
-    return render_template('index.html', tempC=tempC, state=state, settings=settings, form=form)
+    return render_template('index.html', tempC=tempC, state=state, settings=settings, form=form,
+                           zone=zone or heaterstate.DEFAULT_ZONE, zones=zones)
+
+
+@frontend.route('/events', defaults={'zone': None})
+@frontend.route('/zone/<zone>/events')
+def eventstream(zone):
+    if zone is not None and zone not in heaterstate.getzones():
+        abort(404)
+    response = Response(events.gethub(zone).stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@frontend.route('/metrics')
+def metrics():
+    try:
+        snapshot = metricsfile.load()
+    except (IOError, ValueError):
+        abort(404)
+    response = make_response(heatermetrics.render(snapshot))
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+@frontend.route('/graphs')
+def graphlist():
+    return render_template('graphs.html', ranges=graphs.RANGES)
+
+
+@frontend.route('/graph/<timerange>')
+def graph(timerange):
+    result = graphs.getgraph(timerange)
+    if result is None:
+        abort(404)
+    svg, current = result
+    response = make_response(svg)
+    response.mimetype = 'image/svg+xml'
+    response.cache_control.max_age = max(0, int(current - time.time()))
+    return response
+
+
+@frontend.route('/history')
+def historyquery():
+    now = time.time()
+    try:
+        end = history.parsetime(request.args.get('end'), now, now)
+        start = history.parsetime(request.args.get('start'), end - 86400, now)
+        maxpoints = int(request.args.get('max_points', history.DEFAULT_POINTS))
+    except ValueError:
+        abort(400)
+    if start >= end or maxpoints < 1:
+        abort(400)
+    maxpoints = min(maxpoints, history.MAX_POINTS)
+    columns = request.args.get('columns')
+    if columns:
+        columns = columns.split(',')
+    else:
+        columns = None
+
+    result = history.query(start, end, maxpoints, columns)
+    if result is None:
+        abort(404)
+    if request.args.get('format') == 'csv':
+        response = make_response(history.tocsv(result))
+        response.mimetype = 'text/csv'
+        return response
+    return jsonify(result)
 
 """
 # Shows a long signup form, demonstrating form rendering.
@@ -0,0 +1,183 @@
+"""History graphs for Heater WebUI, rendered on request from the archive"""
+
+import math
+import threading
+import time
+
+from markupsafe import escape
+
+import heaterarchive
+
+# Graph ranges: name, title, length (seconds) and archive level to use
+RANGES = [('1h', 'Past Hour', 3600, '1m'),
+          ('3h', 'Past 3 Hours', 3 * 3600, '1m'),
+          ('1d', 'Past Day', 86400, '1m'),
+          ('1w', 'Past Week', 7 * 86400, '15m'),
+          ('30d', 'Past Month', 30 * 86400, '1h'),
+          ('1y', 'Past Year', 365 * 86400, '1d')]
+
+# Size of the plot area in pixels
+WIDTH = 800
+HEIGHT = 600
+
+# Space around the plot area for labels
+MARGIN_LEFT = 60
+MARGIN_RIGHT = 20
+MARGIN_TOP = 40
+MARGIN_BOTTOM = 70
+
+# Heater level (0-2) is multiplied by this to be visible against temperature
+HEAT_SCALE = 5
+
+# Lines drawn: column, label, colour and width
+LINES = [('temp', 'Temperature', '#0000ff', 1),
+         ('setpoint', 'Setpoint', '#00aa00', 2),
+         ('heat', 'Heat', '#ff0000', 1)]
+
+archivereader = heaterarchive.ArchiveReader()
+
+# Rendered graphs by range: (archive bucket the graph was drawn at, svg)
+cache = dict()
+cachelocks = dict((r[0], threading.Lock()) for r in RANGES)
+
+
+def getrange(name):
+    """Return the range tuple called name, None if there is none"""
+    for r in RANGES:
+        if r[0] == name:
+            return r
+    return None
+
+
+def _ticks(low, high, count):
+    """Return round tick values spanning low to high"""
+    span = high - low
+    if span <= 0:
+        return [low]
+    raw = span / count
+    magnitude = 10 ** math.floor(math.log10(raw))
+    for m in (1, 2, 5, 10):
+        step = m * magnitude
+        if step >= raw:
+            break
+    first = math.ceil(low / step) * step
+    ticks = []
+    t = first
+    while t <= high + step / 1000:
+        ticks.append(round(t, 6))
+        t += step
+    return ticks
+
+
+def _timeticks(start, end):
+    """Return (timestamp, label) ticks for the time axis"""
+    span = end - start
+    for step, fmt in ((300, '%H:%M'), (900, '%H:%M'), (1800, '%H:%M'),
+                      (3600, '%H:%M'), (3 * 3600, '%H:%M'), (6 * 3600, '%a %H:%M'),
+                      (86400, '%a %d'), (7 * 86400, '%d %b'), (30 * 86400, '%b')):
+        if span / step <= 12:
+            break
+    offset = time.altzone if time.localtime(end).tm_isdst else time.timezone
+    t = math.ceil((start - offset) / step) * step + offset
+    ticks = []
+    while t <= end:
+        ticks.append((t, time.strftime(fmt, time.localtime(t))))
+        t += step
+    return ticks
+
+
+def render(title, start, end, columns, rows):
+    """Return an svg graph of rows, as fetched from the archive"""
+    series = dict()
+    for column, label, colour, width in LINES:  # pylint: disable=unused-variable
+        index = columns.index(column)
+        scale = HEAT_SCALE if column == 'heat' else 1
+        series[column] = [(t, v[index] * scale) for t, v in rows]
+
+    values = [v for s in series.values() for t, v in s if not math.isnan(v)]
+    low = min(values + [0])
+    high = max(values + [1])
+    high = high + (high - low) * 0.05
+
+    def x(t):
+        """Timestamp to horizontal position"""
+        return MARGIN_LEFT + (t - start) * WIDTH / float(end - start)
+
+    def y(v):
+        """Value to vertical position"""
+        return MARGIN_TOP + HEIGHT - (v - low) * HEIGHT / float(high - low)
+
+    out = []
+    out.append('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif" font-size="12">'
+               % (MARGIN_LEFT + WIDTH + MARGIN_RIGHT, MARGIN_TOP + HEIGHT + MARGIN_BOTTOM))
+    out.append('<rect width="100%" height="100%" fill="#f8f8f8"/>')
+    out.append('<rect x="%d" y="%d" width="%d" height="%d" fill="#ffffff" stroke="#888888"/>'
+               % (MARGIN_LEFT, MARGIN_TOP, WIDTH, HEIGHT))
+    out.append('<text x="%d" y="%d" text-anchor="middle" font-size="16">%s</text>'
+               % (MARGIN_LEFT + WIDTH / 2, MARGIN_TOP / 2 + 6, escape(title)))
+    out.append('<text transform="translate(16,%d) rotate(-90)" text-anchor="middle">Temperature (C)</text>'
+               % (MARGIN_TOP + HEIGHT / 2))
+
+    for v in _ticks(low, high, 10):
+        out.append('<line x1="%d" x2="%d" y1="%.1f" y2="%.1f" stroke="#dddddd"/>'
+                   % (MARGIN_LEFT, MARGIN_LEFT + WIDTH, y(v), y(v)))
+        out.append('<text x="%d" y="%.1f" text-anchor="end">%g</text>'
+                   % (MARGIN_LEFT - 4, y(v) + 4, v))
+    for t, label in _timeticks(start, end):
+        out.append('<line x1="%.1f" x2="%.1f" y1="%d" y2="%d" stroke="#dddddd"/>'
+                   % (x(t), x(t), MARGIN_TOP, MARGIN_TOP + HEIGHT))
+        out.append('<text x="%.1f" y="%d" text-anchor="middle">%s</text>'
+                   % (x(t), MARGIN_TOP + HEIGHT + 16, label))
+
+    for column, label, colour, width in LINES:
+        segments = [[]]
+        for t, v in series[column]:
+            if math.isnan(v):
+                if segments[-1]:
+                    segments.append([])
+            else:
+                segments[-1].append('%.1f,%.1f' % (x(t), y(v)))
+        for segment in segments:
+            if segment:
+                out.append('<polyline fill="none" stroke="%s" stroke-width="%d" points="%s"/>'
+                           % (colour, width, ' '.join(segment)))
+
+    legendx = MARGIN_LEFT
+    for column, label, colour, width in LINES:
+        out.append('<rect x="%d" y="%d" width="10" height="10" fill="%s"/>'
+                   % (legendx, MARGIN_TOP + HEIGHT + 40, colour))
+        out.append('<text x="%d" y="%d">%s</text>' % (legendx + 14, MARGIN_TOP + HEIGHT + 49, label))
+        legendx += 120
+
+    out.append('</svg>')
+    return '\n'.join(out)
+
+
+def getgraph(name):
+    """
+    Return the svg graph for the named range and the time until which it is
+    current, None if the range or archive does not exist.
+    A graph is only redrawn once the archive has completed another row of
+    the level it is drawn from, and concurrent requests for the same range
+    share a single rendering.
+    """
+    r = getrange(name)
+    if r is None:
+        return None
+    name, title, length, levelname = r
+    archive = archivereader.archive()
+    if archive is None:
+        return None
+    level = heaterarchive.getlevel(levelname)
+    with cachelocks[name]:
+        bucket = archive.nextupdate(level)
+        cached = cache.get(name)
+        if cached is not None and cached[0] == bucket and bucket is not None:
+            return cached[1], bucket
+        end = time.time()
+        rows = archive.fetch(level, end - length, end)
+        svg = render(title, end - length, end, archive.columns(), rows)
+        cache[name] = (bucket, svg)
+        if bucket is None:
+            bucket = end + heaterarchive.LEVELS[level][1]
+        return svg, bucket
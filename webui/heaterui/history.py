@@ -0,0 +1,81 @@
+"""History queries for Heater WebUI, answered from the archive"""
+
+import math
+import time
+
+import heaterarchive
+
+# Number of points returned when the request does not say
+DEFAULT_POINTS = 500
+
+# Most points a single request may ask for
+MAX_POINTS = 5000
+
+archivereader = heaterarchive.ArchiveReader()
+
+
+def _value(v):
+    """Unknown values are returned as None"""
+    if math.isnan(v):
+        return None
+    return v
+
+
+def query(start, end, maxpoints, columns=None):
+    """
+    Return history between start and end reduced to at most maxpoints rows,
+    as a dict with the step of the level used, the column names and the
+    rows as [timestamp, value, ...] lists.
+    Only the named columns are returned if columns is given.
+    Returns None if there is no archive.
+    """
+    archive = archivereader.archive()
+    if archive is None:
+        return None
+    level = heaterarchive.chooselevel(start, end, maxpoints)
+    names = archive.columns()
+    ids = archive.sensors()
+    available = list(heaterarchive.COLUMNS) + [s for s in ids if s is not None]
+    if columns is None:
+        columns = available
+    else:
+        columns = [c for c in columns if c in available]
+    indexes = [names.index(c) for c in columns]
+
+    rows = archive.fetch(level, start, end)
+    rows = heaterarchive.downsample(rows, maxpoints, names.index('temp'))
+
+    result = dict()
+    result['start'] = start
+    result['end'] = end
+    result['step'] = heaterarchive.LEVELS[level][1]
+    result['columns'] = ['time'] + columns
+    result['rows'] = [[t] + [_value(values[i]) for i in indexes] for t, values in rows]
+    return result
+
+
+def parsetime(value, default, now=None):
+    """
+    Parse a timestamp, negative values are seconds before now
+    Raises ValueError if it is not a finite number
+    """
+    if now is None:
+        now = time.time()
+    if value is None or value == '':
+        return default
+    t = float(value)
+    if math.isnan(t) or math.isinf(t):
+        raise ValueError("Timestamp must be finite: %r" % value)
+    if t <= 0:
+        t = now + t
+    return t
+
+
+def tocsv(result):
+    """Render a query result as csv, unknown values are left empty"""
+    lines = [','.join(result['columns'])]
+    for row in result['rows']:
+        values = ['' if v is None else '%g' % v for v in row[1:]]
+        lines.append(','.join(['%d' % row[0]] + values))
+    lines.append('')
+    return '\n'.join(lines)
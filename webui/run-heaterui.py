@@ -1,5 +1,5 @@
 #!/usr/bin/python
-"""Startup script for heaterui"""
+"""Development server for heaterui, see run-heaterui.sh for production"""
 
 from heaterui import create_app
 
@@ -1,2 +1,3 @@
 #!/bin/bash
-su -c "/home/heater/heater/webui/run-heaterui.py" heater
+cd /home/heater/heater/webui
+su -c "./build-assets.py && gunicorn --config gunicorn.conf.py wsgi:app" heater
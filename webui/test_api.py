@@ -0,0 +1,76 @@
+#!/usr/bin/python
+"""Tests of the JSON API against a settings broker in a temporary directory"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from heaterui import create_app
+
+import heaterbroker
+import heaterstate
+
+# Zone served, with its files in the temporary directory
+ZONE = 'apitest'
+
+# Highest setpoint the test controller accepts, below the web UI's limit
+CONTROLLER_MAX = 25
+
+
+class SettingsPatchTest(unittest.TestCase):
+    """PATCH requests checked by the web UI and then by the controller"""
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = (heaterstate.STATUS_FILE, heaterstate.CONTROL_FILE, heaterstate.LOCK_FILE,
+                      heaterstate.zonesfile, heaterbroker.SOCKET_FILE)
+        heaterstate.STATUS_FILE = os.path.join(self.tmpdir, 'heater-status')
+        heaterstate.CONTROL_FILE = os.path.join(self.tmpdir, 'heater-control')
+        heaterstate.LOCK_FILE = os.path.join(self.tmpdir, 'heater-control.lock')
+        heaterstate.zonesfile = heaterstate.JSONFile(os.path.join(self.tmpdir, 'heater-zones'))
+        heaterbroker.SOCKET_FILE = os.path.join(self.tmpdir, 'heater-control.sock')
+        heaterstate.writejson(heaterstate.zonesfile.getpath(), {'zones': [ZONE]})
+        heaterstate._zonefiles.pop(ZONE, None)  # pylint: disable=protected-access
+        self.settings = dict(heaterstate.DEFAULT_SETTINGS)
+        path = heaterstate.zonefiles(ZONE).socketfile
+        # Requests are processed as soon as they are queued
+        self.broker = heaterbroker.Broker(path, lambda: self.broker.process(self.apply))
+        self.broker.publish(self.settings, heaterstate.etag(self.settings))
+        self.client = create_app().test_client()
+
+    def tearDown(self):
+        self.broker.close()
+        (heaterstate.STATUS_FILE, heaterstate.CONTROL_FILE, heaterstate.LOCK_FILE,
+         heaterstate.zonesfile, heaterbroker.SOCKET_FILE) = self.saved
+        heaterstate._zonefiles.pop(ZONE, None)  # pylint: disable=protected-access
+        shutil.rmtree(self.tmpdir)
+
+    def apply(self, changes, version):
+        """Refuse setpoints above CONTROLLER_MAX as the controller would"""
+        if changes.get('setpoint', 0) > CONTROLLER_MAX:
+            raise heaterbroker.BrokerError('invalid', 'setpoint must be at most %d' % CONTROLLER_MAX)
+        self.settings.update(changes)
+        return dict(self.settings), heaterstate.etag(self.settings)
+
+    def patch(self, changes):
+        """PATCH the zone's settings, return the response"""
+        return self.client.patch('/api/zones/%s/settings' % ZONE, data=json.dumps(changes),
+                                 content_type='application/json', headers={'If-Match': '*'})
+
+    def test_accepted(self):
+        response = self.patch({'setpoint': 21.5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['setpoint'], 21.5)
+
+    def test_refused_locally(self):
+        self.assertEqual(self.patch({'setpoint': 'warm'}).status_code, 422)
+
+    def test_refused_by_controller(self):
+        response = self.patch({'setpoint': CONTROLLER_MAX + 1})
+        self.assertEqual(response.status_code, 422)
+        self.assertIn('at most', json.loads(response.data)['error'])
+        self.assertEqual(self.settings['setpoint'], heaterstate.DEFAULT_SETTINGS['setpoint'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+#!/usr/bin/python
+"""Tests of the history endpoint's parameters"""
+
+import unittest
+
+from heaterui import create_app
+from heaterui import history
+
+
+class ParseTimeTest(unittest.TestCase):
+    """Timestamps in history queries"""
+    def test_absolute(self):
+        self.assertEqual(history.parsetime('1000.5', None, 2000), 1000.5)
+
+    def test_relative(self):
+        self.assertEqual(history.parsetime('-600', None, 2000), 1400)
+
+    def test_default(self):
+        self.assertEqual(history.parsetime('', 5, 2000), 5)
+        self.assertEqual(history.parsetime(None, 5, 2000), 5)
+
+    def test_not_finite(self):
+        for value in ('nan', 'inf', '-inf', 'Infinity'):
+            self.assertRaises(ValueError, history.parsetime, value, None, 2000)
+
+    def test_rejected_with_400(self):
+        client = create_app().test_client()
+        for param in ('start', 'end'):
+            for value in ('nan', 'inf', '-inf', 'now'):
+                response = client.get('/history?%s=%s' % (param, value))
+                self.assertEqual(response.status_code, 400, '%s=%s' % (param, value))
+
+if __name__ == "__main__":
+    unittest.main()
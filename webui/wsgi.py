@@ -0,0 +1,5 @@
+"""WSGI entry point for serving heaterui in production"""
+
+from heaterui import create_app
+
+app = create_app()